@@ -0,0 +1,235 @@
+"""
+Benchmark so khớp gallery (không cần webcam / model).
+
+Sinh N danh tính giả (embedding normalize), ghi vào EmbeddingStore tạm rồi đo
+FaceMatcher.match_batch cho từng backend và batch size:
+    - latency p50 / p99 mỗi lần gọi (ms), throughput (khuôn mặt / giây)
+    - recall@1 so với danh tính gốc (ANN / lượng tử hoá có thể sai)
+    - RSS của process sau khi load gallery và sau khi chạy
+Mỗi backend chạy trong một process riêng → RSS không cộng dồn giữa các backend.
+
+Chạy (từ thư mục attendance):
+    python benchmark_gallery.py --sizes 1000,10000,100000 --output bench.json
+    python benchmark_gallery.py --sizes 1000000 --backends flat,int8,ivf
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+import psutil
+
+from core.embedding_store import EmbeddingStore
+
+DIM = 512
+BACKENDS = ("flat", "int8", "float16", "ivf", "hnsw")
+# HNSW thuần Python build ~2-3 ms / template → bỏ qua gallery lớn trừ khi --no-limit
+# (--no-limit cũng tắt giới hạn build lúc load của FaceMatcher)
+MAX_IDENTITIES = {"hnsw": 20000}
+CHUNK = 50000       # số danh tính sinh mỗi block (tâm tái tạo được theo block)
+
+
+# =====================================================
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-10)
+
+
+def _centers(seed, start, stop):
+    """Vector tâm của danh tính [start, stop) - tái tạo được theo (seed, start)"""
+    rng = np.random.default_rng([seed, start])
+    return _normalize(rng.standard_normal((stop - start, DIM)).astype(np.float32))
+
+
+def _noisy(centers, noise, rng):
+    # cos(template, tâm) ≈ 1 / sqrt(1 + noise²)
+    jitter = rng.standard_normal(centers.shape).astype(np.float32) * (noise / np.sqrt(DIM))
+    return _normalize(centers + jitter)
+
+
+def build_synthetic_store(db_path, n_identities, templates=1, noise=0.65, seed=0):
+    """Ghi N danh tính giả vào EmbeddingStore, mỗi người `templates` mẫu"""
+    def segments():
+        for start in range(0, n_identities, CHUNK):
+            stop = min(start + CHUNK, n_identities)
+            centers = np.repeat(_centers(seed, start, stop), templates, axis=0)
+            rng = np.random.default_rng([seed, start, 1])
+            yield _noisy(centers, noise, rng)
+
+    ids = [f"S{i:07d}" for i in range(n_identities)]
+    columns = {
+        "id": ids,
+        "name": [f"Synthetic {i}" for i in range(n_identities)],
+        "num_samples": [templates] * n_identities,
+        "quality_score": [1.0] * n_identities,
+        "model": ["synthetic"] * n_identities,
+        "created_date": [None] * n_identities,
+    }
+    offsets = list(range(0, (n_identities + 1) * templates, templates))
+    EmbeddingStore(db_path).replace_all(segments(), columns, offsets)
+    return ids
+
+
+def make_queries(n_identities, n_queries, noise=0.65, seed=0):
+    """Query = tâm của một danh tính ngẫu nhiên + nhiễu. Trả về (queries, id gốc)"""
+    rng = np.random.default_rng([seed, 2])
+    truth = rng.integers(0, n_identities, n_queries)
+    centers = np.empty((n_queries, DIM), dtype=np.float32)
+    for start in np.unique(truth // CHUNK * CHUNK):
+        block = _centers(seed, start, min(start + CHUNK, n_identities))
+        mask = truth // CHUNK * CHUNK == start
+        centers[mask] = block[truth[mask] - start]
+    return _noisy(centers, noise, rng), [f"S{t:07d}" for t in truth]
+
+
+# =====================================================
+def _rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def run_backend(db_path, backend, batch_sizes, queries, truth, repeats, kernel, no_limit=False):
+    """Chạy trong process con: load FaceMatcher rồi đo từng batch size"""
+    from core.face_matcher import FaceMatcher
+
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+    matcher = FaceMatcher(db_path=db_path, threshold=0.0, index=backend, kernel=kernel,
+                          online_build_limit=not no_limit)
+    load_s = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    # recall@1 trên toàn bộ query (batch lớn nhất để nhanh)
+    step = max(batch_sizes)
+    hits = 0
+    for i in range(0, len(queries), step):
+        for result, expected in zip(matcher.match_batch(queries[i:i + step]), truth[i:i + step]):
+            hits += result[0][0] == expected
+
+    cases = []
+    for batch in batch_sizes:
+        n_batches = max(1, len(queries) // batch)
+        matcher.match_batch(queries[:batch])                # warm-up
+        latencies = []
+        for r in range(repeats):
+            b = r % n_batches
+            chunk = queries[b * batch:(b + 1) * batch]
+            t = time.perf_counter()
+            matcher.match_batch(chunk)
+            latencies.append(time.perf_counter() - t)
+
+        latencies = np.asarray(latencies) * 1000
+        cases.append({
+            "batch_size": batch,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            "mean_ms": round(float(latencies.mean()), 3),
+            "throughput_fps": round(batch * 1000 / float(latencies.mean()), 1),
+        })
+
+    return {
+        "backend": backend,
+        "kernel": matcher.kernel.name,
+        "load_s": round(load_s, 3),
+        "recall_at_1": round(hits / len(queries), 4),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_loaded_mb": round(rss_loaded, 1),
+        "rss_end_mb": round(_rss_mb(), 1),
+        "cases": cases,
+    }
+
+
+def run(sizes, backends, batch_sizes, templates=1, n_queries=512, repeats=50,
+        kernel=None, no_limit=False, workdir=None):
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+            "dim": DIM,
+            "templates_per_identity": templates,
+            "n_queries": n_queries,
+            "repeats": repeats,
+        },
+        "results": [],
+    }
+
+    ctx = get_context("spawn")
+    for n in sizes:
+        tmp = tempfile.mkdtemp(prefix=f"gallery_bench_{n}_", dir=workdir)
+        try:
+            db_path = os.path.join(tmp, "embeddings.pkl")
+            start = time.perf_counter()
+            build_synthetic_store(db_path, n, templates=templates)
+            print(f"\n=== N = {n:,} identities (store {time.perf_counter() - start:.1f}s) ===")
+            queries, truth = make_queries(n, n_queries)
+
+            for backend in backends:
+                limit = MAX_IDENTITIES.get(backend)
+                if limit and n > limit and not no_limit:
+                    print(f"  {backend:>8}: skipped (> {limit:,} identities, dùng --no-limit)")
+                    report["results"].append({"n_identities": n, "backend": backend,
+                                              "skipped": f"n > {limit}"})
+                    continue
+
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    result = pool.submit(run_backend, db_path, backend, batch_sizes,
+                                         queries, truth, repeats, kernel, no_limit).result()
+                result["n_identities"] = n
+                report["results"].append(result)
+
+                for case in result["cases"]:
+                    print(f"  {backend:>8} batch={case['batch_size']:<4} "
+                          f"p50={case['p50_ms']:8.2f}ms p99={case['p99_ms']:8.2f}ms "
+                          f"{case['throughput_fps']:10.1f} faces/s "
+                          f"recall@1={result['recall_at_1']:.3f} "
+                          f"rss={result['rss_end_mb']:.0f}MB")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FaceMatcher trên gallery giả lập")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="số danh tính, cách nhau bởi dấu phẩy (vd 1000,1000000)")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--templates", type=int, default=1, help="số mẫu mỗi danh tính")
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=50, help="số lần gọi mỗi batch size")
+    parser.add_argument("--kernel", default=None, help="numpy / simsimd / auto")
+    parser.add_argument("--no-limit", action="store_true",
+                        help="không bỏ qua HNSW trên gallery lớn")
+    parser.add_argument("--workdir", default=None, help="thư mục tạm cho store (cần ~2GB / 1M)")
+    parser.add_argument("--output", default="benchmark_gallery.json")
+    args = parser.parse_args()
+
+    report = run(
+        sizes=[int(s) for s in args.sizes.split(",")],
+        backends=[b.strip() for b in args.backends.split(",")],
+        batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+        templates=args.templates,
+        n_queries=args.queries,
+        repeats=args.repeats,
+        kernel=args.kernel,
+        no_limit=args.no_limit,
+        workdir=args.workdir,
+    )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n✓ Đã ghi kết quả vào {args.output}")
+
+
+if __name__ == "__main__":
+    main()
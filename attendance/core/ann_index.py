@@ -0,0 +1,456 @@
+import heapq
+import os
+import time
+import zlib
+from functools import partial
+import numpy as np
+from core.quantization import ScalarQuantizer
+from core.similarity import get_kernel
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index (IVF-flat) thuần NumPy.
+    - Chia gallery thành `nlist` cụm bằng spherical k-means.
+    - Khi tìm kiếm chỉ quét `nprobe` cụm gần query nhất.
+    - nprobe càng lớn → recall càng cao, latency càng lớn.
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist=None, nprobe=8, kmeans_iters=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+
+        self.vectors = None
+        self.centroids = None       # (nlist, dim)
+        self.list_rows = None       # row index của gallery, xếp theo cụm
+        self.list_offsets = None    # (nlist + 1,) - cụm c nằm ở list_rows[off[c]:off[c+1]]
+
+    @property
+    def build_params(self):
+        return {"nlist": self.nlist, "kmeans_iters": self.kmeans_iters, "seed": self.seed}
+
+    def set_search_params(self, nprobe=None, **_):
+        if nprobe is not None:
+            self.nprobe = int(nprobe)
+
+    # =====================================================
+    def build(self, vectors):
+        self.vectors = vectors
+        n = len(vectors)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        self.nlist = nlist
+
+        self.centroids = self._train_kmeans(vectors, nlist)
+        assign = self._assign(vectors)
+
+        self.list_rows = np.argsort(assign, kind="stable").astype(np.int64)
+        counts = np.bincount(assign, minlength=nlist)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def _train_kmeans(self, vectors, nlist):
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), max(nlist * 64, 10000))
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+
+            # Cụm rỗng → khởi tạo lại bằng một điểm ngẫu nhiên
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+            centroids = sums / np.maximum(
+                np.linalg.norm(sums, axis=1, keepdims=True), 1e-10)
+        return centroids.astype(np.float32)
+
+    def _assign(self, vectors, chunk=65536):
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            assign[start:start + chunk] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    # =====================================================
+    def search(self, queries, n_candidates, kernel=None):
+        """Trả về (N, n_candidates) row index ứng viên, -1 nếu thiếu"""
+        kernel = kernel or get_kernel()
+        nprobe = max(1, min(self.nprobe, self.nlist))
+        centroid_sims = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_sims, nprobe - 1, axis=1)[:, :nprobe]
+
+        result = np.full((len(queries), n_candidates), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            rows = np.concatenate([
+                self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]]
+                for c in probes[i]
+            ])
+            if len(rows) == 0:
+                continue
+            sims = kernel.dot(query[None, :], self.vectors[rows])[0]
+            k = min(n_candidates, len(rows))
+            top = np.argpartition(-sims, k - 1)[:k] if k < len(rows) else np.arange(k)
+            result[i, :k] = rows[top]
+        return result
+
+    # =====================================================
+    def state(self):
+        return {
+            "centroids": self.centroids,
+            "list_rows": self.list_rows,
+            "list_offsets": self.list_offsets,
+        }
+
+    def restore(self, vectors, state):
+        self.vectors = vectors
+        self.centroids = state["centroids"]
+        self.list_rows = state["list_rows"]
+        self.list_offsets = state["list_offsets"]
+        self.nlist = len(self.centroids)
+
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph thuần NumPy.
+    - Build O(N log N) nhưng chèn từng node bằng Python: ~2-3 ms / template
+      (20k ≈ 40s, 200k > 10 phút) → gallery lớn build offline bằng
+      `python -m core.ann_index hnsw`, FaceMatcher chỉ load file đã lưu.
+    - Tìm kiếm greedy từ tầng trên xuống tầng 0.
+    - ef_search càng lớn → recall càng cao, latency càng lớn.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, M=16, ef_construction=100, ef_search=64, seed=0):
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+
+        self.vectors = None
+        self.entry_point = -1
+        self.max_level = -1
+        self.links = []             # links[level][node] -> list neighbor
+
+    @property
+    def build_params(self):
+        return {"M": self.M, "ef_construction": self.ef_construction, "seed": self.seed}
+
+    def set_search_params(self, ef_search=None, **_):
+        if ef_search is not None:
+            self.ef_search = int(ef_search)
+
+    def _max_links(self, level):
+        return self.M * 2 if level == 0 else self.M
+
+    # =====================================================
+    def build(self, vectors):
+        self.vectors = vectors
+        self.entry_point = -1
+        self.max_level = -1
+        self.links = []
+
+        rng = np.random.default_rng(self.seed)
+        ml = 1.0 / np.log(max(self.M, 2))
+        levels = (-np.log(1.0 - rng.random(len(vectors))) * ml).astype(int)
+
+        for node, level in enumerate(levels):
+            self._insert(node, int(level))
+
+    def _insert(self, node, level):
+        while len(self.links) <= level:
+            self.links.append({})
+        for lc in range(level + 1):
+            self.links[lc][node] = []
+
+        if self.entry_point < 0:
+            self.entry_point = node
+            self.max_level = level
+            return
+
+        query = self.vectors[node]
+        ep = self.entry_point
+        for lc in range(self.max_level, level, -1):
+            ep = self._search_layer(query, [ep], 1, lc)[0][1]
+
+        for lc in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, [ep], self.ef_construction, lc)
+            neighbors = [n for _, n in found[:self.M]]
+            self.links[lc][node] = neighbors
+
+            max_links = self._max_links(lc)
+            for n in neighbors:
+                n_links = self.links[lc][n]
+                n_links.append(node)
+                if len(n_links) > max_links:
+                    sims = self.vectors[n_links] @ self.vectors[n]
+                    keep = np.argsort(-sims)[:max_links]
+                    self.links[lc][n] = [n_links[j] for j in keep]
+            ep = found[0][1]
+
+        if level > self.max_level:
+            self.entry_point = node
+            self.max_level = level
+
+    def _search_layer(self, query, entry_points, ef, level):
+        """Trả về list (sim, node) giảm dần, tối đa ef phần tử"""
+        layer = self.links[level]
+        visited = set(entry_points)
+        sims = self.vectors[entry_points] @ query
+        candidates = [(-float(s), n) for s, n in zip(sims, entry_points)]
+        found = [(float(s), n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(found)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < found[0][0] and len(found) >= ef:
+                break
+
+            neighbors = [n for n in layer.get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for s, n in zip(self.vectors[neighbors] @ query, neighbors):
+                s = float(s)
+                if len(found) < ef or s > found[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(found, (s, n))
+                    if len(found) > ef:
+                        heapq.heappop(found)
+
+        return sorted(found, reverse=True)
+
+    # =====================================================
+    def search(self, queries, n_candidates, kernel=None):
+        """Trả về (N, n_candidates) row index ứng viên, -1 nếu thiếu"""
+        # Mỗi bước graph chỉ tính vài chục dot product → dùng NumPy trực tiếp
+        result = np.full((len(queries), n_candidates), -1, dtype=np.int64)
+        if self.entry_point < 0:
+            return result
+
+        ef = max(self.ef_search, n_candidates)
+        for i, query in enumerate(queries):
+            ep = self.entry_point
+            for lc in range(self.max_level, 0, -1):
+                ep = self._search_layer(query, [ep], 1, lc)[0][1]
+            found = self._search_layer(query, [ep], ef, 0)[:n_candidates]
+            result[i, :len(found)] = [n for _, n in found]
+        return result
+
+    # =====================================================
+    def state(self):
+        state = {"graph": np.array([self.entry_point, self.max_level], dtype=np.int64)}
+        for lc, layer in enumerate(self.links):
+            nodes = np.fromiter(layer.keys(), dtype=np.int64, count=len(layer))
+            neighbors = np.full((len(layer), self._max_links(lc)), -1, dtype=np.int64)
+            for j, node in enumerate(nodes):
+                node_links = layer[node]
+                neighbors[j, :len(node_links)] = node_links
+            state[f"nodes_{lc}"] = nodes
+            state[f"links_{lc}"] = neighbors
+        return state
+
+    def restore(self, vectors, state):
+        self.vectors = vectors
+        self.entry_point, self.max_level = (int(v) for v in state["graph"])
+        self.links = []
+        for lc in range(self.max_level + 1):
+            nodes = state[f"nodes_{lc}"]
+            neighbors = state[f"links_{lc}"]
+            self.links.append({
+                int(node): [int(n) for n in row if n >= 0]
+                for node, row in zip(nodes, neighbors)
+            })
+
+
+class ScalarQuantizedIndex:
+    """
+    Quét toàn bộ gallery trên bản lượng tử hoá int8/float16.
+    - Chỉ code (N, dim) int8/float16 nằm trong RAM (nhỏ hơn 4x / 2x float32);
+      index không giữ reference tới vectors float32.
+    - Build / quét theo block để bộ nhớ tạm không phụ thuộc kích thước gallery.
+    - Shortlist trả về được Gallery re-rank trên ma trận float32 mmap của
+      EmbeddingStore: mỗi query chỉ đọc vài chục dòng ứng viên từ file.
+    """
+
+    name = "sq"
+
+    def __init__(self, mode="int8", chunk_rows=16384):
+        self.quantizer = ScalarQuantizer(mode)
+        self.chunk_rows = chunk_rows
+        self.codes = None
+
+    @property
+    def build_params(self):
+        return {"mode": self.quantizer.mode}
+
+    def set_search_params(self, chunk_rows=None, **_):
+        if chunk_rows is not None:
+            self.chunk_rows = int(chunk_rows)
+
+    def build(self, vectors):
+        self.quantizer.train(vectors)
+        self.codes = self.quantizer.encode(vectors)
+
+    def search(self, queries, n_candidates, kernel=None):
+        """Trả về (N, n_candidates) row index ứng viên, -1 nếu thiếu"""
+        kernel = kernel or get_kernel()
+        n = len(queries)
+        best_rows = np.full((n, 0), -1, dtype=np.int64)
+        best_sims = np.empty((n, 0), dtype=np.float32)
+
+        for start in range(0, len(self.codes), self.chunk_rows):
+            sims = self.quantizer.score(queries, self.codes[start:start + self.chunk_rows], kernel)
+            rows = np.broadcast_to(
+                np.arange(start, start + sims.shape[1], dtype=np.int64), sims.shape)
+
+            # Gộp block hiện tại với top hiện có, giữ lại n_candidates tốt nhất
+            merged_sims = np.concatenate((best_sims, sims), axis=1)
+            merged_rows = np.concatenate((best_rows, rows), axis=1)
+            if merged_sims.shape[1] > n_candidates:
+                keep = np.argpartition(-merged_sims, n_candidates - 1, axis=1)[:, :n_candidates]
+                merged_sims = np.take_along_axis(merged_sims, keep, axis=1)
+                merged_rows = np.take_along_axis(merged_rows, keep, axis=1)
+            best_sims, best_rows = merged_sims, merged_rows
+
+        result = np.full((n, n_candidates), -1, dtype=np.int64)
+        result[:, :best_rows.shape[1]] = best_rows
+        return result
+
+    def state(self):
+        state = {"codes": self.codes}
+        if self.quantizer.scale is not None:
+            state["scale"] = self.quantizer.scale
+        return state
+
+    def restore(self, vectors, state):
+        self.codes = state["codes"]
+        self.quantizer.scale = state.get("scale")
+
+
+INDEX_BACKENDS = {
+    IVFFlatIndex.name: IVFFlatIndex,
+    HNSWIndex.name: HNSWIndex,
+    "int8": partial(ScalarQuantizedIndex, mode="int8"),
+    "float16": partial(ScalarQuantizedIndex, mode="float16"),
+}
+
+# Số dòng tối đa được build ngay lúc load gallery, lớn hơn phải build offline
+ONLINE_BUILD_MAX_ROWS = {HNSWIndex.name: 20000}
+
+
+# =====================================================
+def gallery_fingerprint(vectors):
+    """Checksum của gallery để phát hiện index đã cũ"""
+    data = np.ascontiguousarray(vectors).view(np.uint8).reshape(-1)
+    return np.array([len(vectors), vectors.shape[1], zlib.crc32(data)], dtype=np.int64)
+
+
+def index_path_for(db_path, backend):
+    """embeddings.pkl → embeddings.<backend>.npz (cùng thư mục)"""
+    return os.path.splitext(db_path)[0] + f".{backend}.npz"
+
+
+def store_fingerprint(matrix, meta):
+    """Định danh ma trận base của EmbeddingStore - đổi khi store compact / ghi lại"""
+    return [len(matrix), matrix.shape[1], zlib.crc32(meta["matrix"].encode())]
+
+
+def build_or_load_index(backend, vectors, path=None, fingerprint=None,
+                        max_build_rows=None, **params):
+    """
+    Load index đã lưu nếu khớp gallery + tham số build, nếu không thì build mới và lưu lại.
+
+    Args:
+        backend: "ivf", "hnsw", "int8" hoặc "float16"
+        vectors: (total_samples, dim) embeddings đã normalize
+        path: file .npz lưu index (None = không lưu)
+        fingerprint: định danh phiên bản gallery (None = checksum toàn bộ vectors)
+        max_build_rows: không build nếu gallery lớn hơn (None = không giới hạn)
+            → trả về None khi chưa có index hợp lệ
+        params: tham số build + search của backend
+    """
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Index backend không hỗ trợ: {backend}")
+
+    index = INDEX_BACKENDS[backend](**params)
+    if fingerprint is None:
+        fingerprint = gallery_fingerprint(vectors)
+    fingerprint = np.asarray(fingerprint, dtype=np.int64)
+
+    if path and os.path.exists(path):
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                state = {key: saved[key] for key in saved.files}
+            saved_params = dict(zip(state.pop("param_names").tolist(),
+                                    state.pop("param_values").tolist()))
+            wanted = {k: str(v) for k, v in index.build_params.items() if v is not None}
+            if (np.array_equal(state.pop("fingerprint"), fingerprint) and
+                    all(saved_params.get(k) == v for k, v in wanted.items())):
+                index.restore(vectors, state)
+                print(f"✓ Loaded {backend} index from {path}")
+                return index
+            print(f"ℹ {backend} index đã cũ, build lại...")
+        except Exception as e:
+            print(f"⚠ Lỗi load index {path}: {e}")
+
+    if max_build_rows is not None and len(vectors) > max_build_rows:
+        print(f"⚠ Chưa có {backend} index cho gallery {len(vectors)} templates "
+              f"(> {max_build_rows} không build lúc load) - chạy "
+              f"`python -m core.ann_index {backend}` để build offline")
+        return None
+
+    start = time.perf_counter()
+    index.build(vectors)
+    print(f"✓ Built {backend} index ({len(vectors)} vectors, {time.perf_counter() - start:.1f}s)")
+
+    if path:
+        try:
+            params_to_save = {k: v for k, v in index.build_params.items() if v is not None}
+            np.savez(
+                path,
+                fingerprint=fingerprint,
+                param_names=np.array(list(params_to_save.keys())),
+                param_values=np.array([str(v) for v in params_to_save.values()]),
+                **index.state()
+            )
+        except Exception as e:
+            print(f"⚠ Không lưu được index {path}: {e}")
+    return index
+
+
+if __name__ == "__main__":
+    # Build index offline rồi lưu cạnh store, FaceMatcher chỉ việc load (từ thư mục attendance):
+    #   python -m core.ann_index hnsw --db database/embeddings.pkl --param M=16
+    # Tham số build phải khớp index_params của FaceMatcher thì file mới được dùng.
+    import argparse
+    from core.embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description="Build ANN index offline cho EmbeddingStore")
+    parser.add_argument("backend", choices=sorted(INDEX_BACKENDS))
+    parser.add_argument("--db", default="database/embeddings.pkl")
+    parser.add_argument("--param", action="append", default=[], help="key=value, lặp lại được")
+    args = parser.parse_args()
+
+    params = {}
+    for item in args.param:
+        key, value = item.split("=", 1)
+        params[key] = int(value) if value.lstrip("-").isdigit() else value
+
+    matrix, meta = EmbeddingStore(args.db).load()
+    if meta is None or not len(matrix):
+        print("Gallery rỗng, không có gì để build")
+    else:
+        build_or_load_index(args.backend, matrix, path=index_path_for(args.db, args.backend),
+                            fingerprint=store_fingerprint(matrix, meta), **params)
@@ -100,6 +100,60 @@ class AntiSpoofing:
             'fake_boxes': fake_boxes
         }
 
+    def detect_spoof_rois(self, img_bgr, face_boxes, pad=0.4, roi_size=320):
+        """
+        ROI mode: chạy YOLO trên vùng mặt (có padding) thay vì full frame.
+        Tất cả crop được gom vào MỘT lần gọi model (batch).
+
+        Args:
+            img_bgr: frame gốc
+            face_boxes: list (x1, y1, x2, y2) từ face detector, toạ độ frame gốc
+            pad: mở rộng mỗi cạnh theo tỉ lệ kích thước mặt (giữ ngữ cảnh viền điện thoại / giấy)
+            roi_size: kích thước input YOLO cho crop
+
+        Returns:
+            list (is_real, conf, label) cùng thứ tự face_boxes -
+            label None nếu không có detection nào trên mặt (coi như không phải real)
+        """
+        verdicts = [(False, 0.0, None)] * len(face_boxes)
+        img_h, img_w = img_bgr.shape[:2]
+
+        crops, slots, local_boxes = [], [], []
+        for i, (x1, y1, x2, y2) in enumerate(face_boxes):
+            bw, bh = x2 - x1, y2 - y1
+            cx1 = max(int(x1 - pad * bw), 0)
+            cy1 = max(int(y1 - pad * bh), 0)
+            cx2 = min(int(x2 + pad * bw), img_w)
+            cy2 = min(int(y2 + pad * bh), img_h)
+            if cx2 <= cx1 or cy2 <= cy1:
+                continue
+            crops.append(img_bgr[cy1:cy2, cx1:cx2])
+            slots.append(i)
+            local_boxes.append((x1 - cx1, y1 - cy1, x2 - cx1, y2 - cy1))
+
+        if not crops:
+            return verdicts
+
+        results = self.model(crops, imgsz=roi_size, verbose=False)
+
+        for i, (fx1, fy1, fx2, fy2), r in zip(slots, local_boxes, results):
+            best = None
+            for box in r.boxes:
+                conf = float(box.conf[0])
+                if conf < self.conf_threshold:
+                    continue
+                x1, y1, x2, y2 = map(float, box.xyxy[0])
+                # Chỉ tính detection nằm trên mặt (crop có thể chứa một phần mặt khác)
+                if not (x1 < fx2 and x2 > fx1 and y1 < fy2 and y2 > fy1):
+                    continue
+                if best is None or conf > best[1]:
+                    label = self.classes[int(box.cls[0])]
+                    best = (label == "real", conf, label)
+            if best is not None:
+                verdicts[i] = best
+
+        return verdicts
+
     def draw_results(self, img_bgr, detections_info, thickness=2, text_scale=0.7):
         """
         Vẽ tất cả detections lên ảnh (real xanh, fake đỏ).
@@ -0,0 +1,105 @@
+import numpy as np
+
+
+class AttendanceRecorder:
+    """
+    Logic chấm công cho một phiên, dùng chung cho AttendanceUI và headless runner.
+    process(result) nhận FrameResult của RecognitionEngine (chạy trên worker
+    hoặc vòng lặp headless): so khớp khuôn mặt thật, ghi AttendanceDB và trả về
+    overlay / status để nơi gọi hiển thị - không import gì từ GUI.
+    """
+
+    def __init__(self, matcher, attendance_db, session_id, roster=None,
+                 threshold=0.45, cooldown_max=60, on_marked=None):
+        self.matcher = matcher
+        self.attendance_db = attendance_db  # AttendanceDB hoặc AttendanceWriter (write-behind)
+        self.session_id = session_id
+        self.roster = roster                # RosterView của phiên (tùy chọn)
+        self.threshold = threshold
+        self.cooldown_max = cooldown_max    # tính theo số frame đã xử lý
+        self.on_marked = on_marked          # callback(student_id, name, similarity)
+
+        self.marked_ids = set()
+        self.cooldown_frames = 0
+
+    def unmark(self, student_id):
+        """Lượt chấm công bị từ chối khi ghi (write-behind) → cho phép chấm lại"""
+        self.marked_ids.discard(student_id)
+
+    def process(self, result):
+        """Trả về {"overlays", "status", "marked"} cho một FrameResult"""
+        has_real = result.spoof_info['has_real']
+        real_boxes = result.spoof_info['real_boxes']
+
+        # ========== Logic chấm công ==========
+        marked = []
+        overlays = []
+        status = None
+
+        if has_real:
+            # Có ít nhất một box "real" → chỉ giữ khuôn mặt overlap với box real
+            verified_faces = [face for face in result.faces if face.is_real]
+
+            # Chỉ track mới / chưa chắc chắn có embedding mới → match một lần
+            # bằng một phép nhân ma trận, còn lại dùng danh tính cache trên track
+            fresh = [face for face in verified_faces if face.embedding is not None]
+            if fresh:
+                matches = self.matcher.match_batch(
+                    np.stack([face.embedding for face in fresh]),
+                    roster=self.roster)
+                for face, candidates in zip(fresh, matches):
+                    student_id, _, similarity = candidates[0]
+                    face.track.set_identity(
+                        candidates[0],
+                        confident=student_id is not None and similarity >= self.threshold)
+
+            for face in verified_faces:
+                if face.identity is None:
+                    continue
+                student_id, name, similarity = face.identity
+
+                if student_id and similarity >= self.threshold:
+                    color = (0, 255, 0)
+                    label_text = f"{name} ({similarity:.2f})"
+
+                    if (self.cooldown_frames <= 0 and
+                        student_id not in self.marked_ids and
+                            self.session_id is not None):
+
+                        if self.attendance_db.mark_attendance(
+                            session_id=self.session_id,
+                            student_id=student_id,
+                            status="present"
+                        ):
+                            self.marked_ids.add(student_id)
+                            self.cooldown_frames = self.cooldown_max
+                            marked.append((student_id, name, similarity))
+                            if self.on_marked is not None:
+                                self.on_marked(student_id, name, similarity)
+
+                            status = (f"✅ Chấm công: {name} (Session {self.session_id})",
+                                      "#27ae60")
+                            print(f"Marked: {name} in session {self.session_id}")
+                else:
+                    label_text = "Unknown"
+                    color = (0, 165, 255)  # vàng cho unknown
+
+                # Box từ face detector
+                overlays.append({"bbox": face.bbox, "color": color, "thickness": 2,
+                                 "labels": [(label_text, 10, 0.7, color)]})
+
+        # ========== Status tổng ==========
+        if marked:
+            pass  # đã set ở trên
+        elif has_real:
+            status = ("✅ Khuôn mặt thật – đang kiểm tra danh tính", "#3498db")
+        elif len(real_boxes) == 0 and len(result.faces) > 0:
+            status = ("🚨 Có thể là giả mạo hoặc chất lượng thấp", "#e74c3c")
+        else:
+            status = ("Đang chờ phát hiện khuôn mặt...", "#7f8c8d")
+
+        # Cooldown countdown
+        if self.cooldown_frames > 0:
+            self.cooldown_frames -= 1
+
+        return {"overlays": overlays, "status": status, "marked": marked}
@@ -1,7 +1,21 @@
+import threading
+import time
+from collections import deque
+
 import cv2
 
 class Camera:
-    def __init__(self, src=0, width=640, height=480):
+    """
+    Đọc frame từ webcam / video.
+
+    threaded=False: read() gọi cv2.VideoCapture.read() trực tiếp (blocking).
+    threaded=True:  một thread nền đọc liên tục vào ring buffer nhỏ, chỉ giữ
+        buffer_size frame mới nhất. read() không block, trả về frame mới nhất
+        chưa đọc (None nếu chưa có frame mới) → thời gian inference không cộng
+        vào độ trễ capture và frame cũ không dồn trong buffer của driver.
+    """
+
+    def __init__(self, src=0, width=640, height=480, threaded=False, buffer_size=2):
         self.cap = cv2.VideoCapture(src)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
@@ -9,12 +23,113 @@ class Camera:
         if not self.cap.isOpened():
             raise RuntimeError("Không mở được camera")
 
-    def read(self):
-        ret, frame = self.cap.read()
-        if not ret:
-            return None
-        return frame
+        self.threaded = threaded
+        self.frames_captured = 0
+        self.frames_dropped = 0     # frame đã capture nhưng không ai đọc
+        self.last_timestamp = None  # time.monotonic() lúc capture frame vừa trả về
+
+        if threaded:
+            # Giảm buffer của driver (backend không hỗ trợ thì bỏ qua)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self._buffer = deque(maxlen=buffer_size)    # (seq, timestamp, frame)
+            self._cond = threading.Condition()
+            self._last_seq = 0
+            self._running = True
+            self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+            self._thread.start()
+
+    # =====================================================
+    def _capture_loop(self, max_failures=50):
+        failures = 0
+        while self._running:
+            ret, frame = self.cap.read()
+            if not ret:
+                failures += 1
+                if failures >= max_failures:
+                    print("⚠ Camera không trả frame, dừng thread capture")
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+
+            with self._cond:
+                self.frames_captured += 1
+                self._buffer.append((self.frames_captured, time.monotonic(), frame))
+                self._cond.notify_all()
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    @property
+    def is_running(self):
+        return self._running if self.threaded else self.cap.isOpened()
+
+    @property
+    def stats(self):
+        return {
+            "captured": self.frames_captured,
+            "dropped": self.frames_dropped,
+            "pending": self.pending,
+            "last_timestamp": self.last_timestamp,
+        }
+
+    @property
+    def pending(self):
+        """Số frame trong ring buffer chưa được đọc (độ sâu hàng đợi capture)"""
+        if not self.threaded:
+            return 0
+        with self._cond:
+            return sum(1 for seq, _, _ in self._buffer if seq > self._last_seq)
+
+    # =====================================================
+    def read(self, timeout=0):
+        """
+        Trả về frame BGR hoặc None.
+        Chế độ thread: frame mới nhất chưa đọc; timeout > 0 thì chờ tối đa
+        timeout giây cho frame mới.
+        """
+        if not self.threaded:
+            ret, frame = self.cap.read()
+            if not ret:
+                return None
+            self.frames_captured += 1
+            self.last_timestamp = time.monotonic()
+            return frame
+
+        item = self.read_latest(timeout)
+        return item[2] if item is not None else None
+
+    def read_latest(self, timeout=0):
+        """(seq, timestamp, frame) mới nhất chưa đọc, None nếu không có"""
+        with self._cond:
+            if timeout and not self._has_new():
+                self._cond.wait_for(lambda: self._has_new() or not self._running, timeout)
+            if not self._has_new():
+                return None
+
+            seq, timestamp, frame = self._buffer[-1]
+            # Các frame bị bỏ qua giữa hai lần đọc tính là dropped
+            self.frames_dropped += seq - self._last_seq - 1
+            self._last_seq = seq
+            self.last_timestamp = timestamp
+            return seq, timestamp, frame
+
+    def recent(self, n=None):
+        """Tối đa n frame gần nhất trong ring buffer (cũ → mới), không đánh dấu đã đọc"""
+        if not self.threaded:
+            return []
+        with self._cond:
+            items = list(self._buffer)
+        return items[-n:] if n else items
+
+    def _has_new(self):
+        return bool(self._buffer) and self._buffer[-1][0] > self._last_seq
 
+    # =====================================================
     def release(self):
+        if self.threaded and self._thread.is_alive():
+            self._running = False
+            self._thread.join(timeout=1.0)
         if self.cap.isOpened():
             self.cap.release()
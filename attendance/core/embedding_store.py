@@ -0,0 +1,402 @@
+import glob
+import json
+import os
+import pickle
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+
+class EmbeddingStore:
+    """
+    Lưu gallery dạng cột thay cho embeddings.pkl.
+    - <base>.<gen>.npy:  ma trận float32 (total_samples, 512) đã normalize,
+      mở bằng np.load(mmap_mode='r') → nhiều process dùng chung page cache.
+    - <base>.<gen>.delta.f32: các dòng thêm sau lần ghi đầy đủ gần nhất, chỉ
+      append (float32 thô, số dòng hợp lệ nằm trong meta).
+    - <base>.meta.json:  bảng metadata dạng cột (id, name, num_samples,
+      quality_score, model, created_date) + offsets templates của từng người,
+      danh sách id đã bị xoá / ghi đè ở base (tombstone) và người ở delta.
+
+    upsert() / remove() không ghi lại ma trận: templates mới được append vào
+    file delta, người cũ bị đánh tombstone, rồi publish meta.json bằng
+    os.replace → chi phí O(k) I/O cho ma trận, cộng meta.json (O(N) id, nhỏ).
+    Khi số dòng delta + dòng chết vượt COMPACT_RATIO của base (và tối thiểu
+    COMPACT_MIN_ROWS) thì compact: ghi ma trận thế hệ mới chỉ gồm dòng còn
+    hiệu lực. File thế hệ cũ không bị sửa nên reader đang mmap không bị ảnh
+    hưởng (kể cả trên Windows).
+
+    Writer ở nhiều process (GUI enroll, quản lý sinh viên, service) giữ lock
+    độc quyền trên <base>.lock quanh cả đoạn đọc meta → ghi delta → publish /
+    compact, meta luôn được đọc lại sau khi có lock. Reader không cần lock.
+    """
+
+    VERSION = 2
+    COLUMNS = ("id", "name", "num_samples", "quality_score", "model", "created_date")
+    COMPACT_RATIO = 0.25
+    COMPACT_MIN_ROWS = 4096
+
+    def __init__(self, db_path="database/embeddings.pkl", dim=512):
+        self.base_path = os.path.splitext(db_path)[0]
+        self.legacy_path = self.base_path + ".pkl"
+        self.meta_path = self.base_path + ".meta.json"
+        self.lock_path = self.base_path + ".lock"
+        self.dim = dim
+
+    # =====================================================
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def read_meta(self):
+        if not self.exists():
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextmanager
+    def _locked(self):
+        """Lock độc quyền giữa các process (và thread) cho một lần read-modify-write"""
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        with open(self.lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue    # LK_LOCK chỉ chờ ~10s rồi raise → chờ tiếp
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _path(self, name):
+        return os.path.join(os.path.dirname(self.meta_path), name)
+
+    def _matrix_path(self, meta):
+        return self._path(meta["matrix"])
+
+    def load(self, mmap=True):
+        """
+        Trả về (matrix, meta) của phần base - matrix là memmap read-only nếu
+        mmap=True. Người trong meta["removed"] không còn hiệu lực ở base; phần
+        delta đọc bằng load_delta(meta). (None, None) nếu chưa có dữ liệu.
+        """
+        self.migrate_legacy()
+        meta = self.read_meta()
+        if meta is None:
+            return None, None
+
+        if meta["rows"] == 0:
+            return np.empty((0, self.dim), dtype=np.float32), meta
+        matrix = np.load(self._matrix_path(meta), mmap_mode="r" if mmap else None)
+        return matrix, meta
+
+    def load_delta(self, meta, mmap=True):
+        """
+        (matrix, delta) của phần delta: matrix (rows, 512) gồm mọi dòng đã
+        append, delta["columns"] / delta["ranges"] là người còn hiệu lực và
+        khoảng dòng [start, end) của họ trong matrix.
+        """
+        delta = self._delta(meta)
+        if delta["rows"] == 0:
+            return np.empty((0, self.dim), dtype=np.float32), delta
+        matrix = np.memmap(self._path(delta["file"]), dtype=np.float32, mode="r",
+                           shape=(delta["rows"], self.dim))
+        return (matrix if mmap else np.array(matrix)), delta
+
+    def records(self):
+        """Danh sách metadata của từng người (không kèm embedding)"""
+        self.migrate_legacy()
+        meta = self.read_meta()
+        if meta is None:
+            return []
+        return [record for record, _ in self._people(meta)]
+
+    def get_templates(self, student_id):
+        """Templates (k, 512) của một người, None nếu không có"""
+        matrix, meta = self.load()
+        if meta is None:
+            return None
+        found = self._find(meta, student_id)
+        if found is None:
+            return None
+        part, pos = found
+        if part == "base":
+            return np.array(matrix[meta["offsets"][pos]:meta["offsets"][pos + 1]])
+        delta_matrix, delta = self.load_delta(meta)
+        start, end = delta["ranges"][pos]
+        return np.array(delta_matrix[start:end])
+
+    # =====================================================
+    def upsert(self, student_id, name, templates, **fields):
+        """
+        Thêm mới hoặc ghi đè một người. templates: (k, 512).
+        Giữ created_date cũ nếu người đã tồn tại. Trả về record metadata.
+        """
+        templates = np.asarray(templates, dtype=np.float32).reshape(-1, self.dim)
+        templates = templates / np.maximum(
+            np.linalg.norm(templates, axis=1, keepdims=True), 1e-10)
+
+        record = {col: fields.get(col) for col in self.COLUMNS}
+        record.update(id=str(student_id), name=name)
+        if record["num_samples"] is None:
+            record["num_samples"] = len(templates)
+
+        self.migrate_legacy()
+        with self._locked():
+            self._upsert(record, templates)
+        return record
+
+    def _upsert(self, record, templates):
+        meta = self.read_meta()
+        if meta is None:
+            columns = {col: [record[col]] for col in self.COLUMNS}
+            self._write([templates], columns, [0, len(templates)], None)
+            return
+
+        meta, previous = self._without(meta, record["id"])
+        if previous is not None:
+            record["created_date"] = previous["created_date"] or record["created_date"]
+
+        # Append vào file delta ngay sau các dòng đã publish; byte thừa của lần
+        # ghi dở (crash trước khi publish meta) bị ghi đè, reader không đọc tới
+        delta = meta["delta"]
+        mode = "r+b" if os.path.exists(self._path(delta["file"])) else "wb"
+        with open(self._path(delta["file"]), mode) as f:
+            f.seek(delta["rows"] * self.dim * 4)
+            f.write(np.ascontiguousarray(templates, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        for col in self.COLUMNS:
+            delta["columns"][col].append(record[col])
+        delta["ranges"].append([delta["rows"], delta["rows"] + len(templates)])
+        delta["rows"] += len(templates)
+
+        self._commit(meta)
+
+    def remove(self, student_id):
+        """Xoá một người khỏi store. Trả về False nếu không tìm thấy."""
+        self.migrate_legacy()
+        with self._locked():
+            meta = self.read_meta()
+            if meta is None:
+                return False
+            meta, previous = self._without(meta, student_id)
+            if previous is None:
+                return False
+            self._commit(meta)
+        return True
+
+    def compact(self):
+        """Ghi ma trận thế hệ mới chỉ gồm templates còn hiệu lực (bỏ tombstone / delta)"""
+        self.migrate_legacy()
+        with self._locked():
+            meta = self.read_meta()
+            if meta is not None:
+                self._compact(meta)
+
+    def replace_all(self, segments, columns, offsets):
+        """
+        Ghi đè toàn bộ store (import hàng loạt, benchmark).
+        segments: iterable các block (rows, 512) đã normalize, duyệt đúng một lần
+        → có thể là generator để không giữ cả gallery trong RAM.
+        """
+        with self._locked():
+            self._write(segments, columns, offsets, self.read_meta())
+
+    # =====================================================
+    def _delta(self, meta):
+        """Phần delta của meta (meta version 1 không có → delta rỗng)"""
+        delta = meta.get("delta")
+        if delta is None:
+            base_name = os.path.basename(self.base_path)
+            delta = {"file": f"{base_name}.{meta['generation']}.delta.f32", "rows": 0,
+                     "columns": {col: [] for col in self.COLUMNS}, "ranges": []}
+        return delta
+
+    def _find(self, meta, student_id):
+        """("delta", vị trí) / ("base", vị trí) của người còn hiệu lực, None nếu không có"""
+        student_id = str(student_id)
+        delta_ids = self._delta(meta)["columns"]["id"]
+        if student_id in delta_ids:
+            return "delta", delta_ids.index(student_id)
+        if student_id in meta.get("removed", ()):
+            return None
+        ids = meta["columns"]["id"]
+        if student_id in ids:
+            return "base", ids.index(student_id)
+        return None
+
+    def _without(self, meta, student_id):
+        """(bản sao meta đã bỏ người này, record cũ hoặc None)"""
+        found = self._find(meta, student_id)
+        delta = self._delta(meta)
+        meta = {**meta, "version": self.VERSION,
+                "removed": list(meta.get("removed", ())),
+                "delta": {**delta, "columns": {col: list(delta["columns"][col])
+                                               for col in self.COLUMNS},
+                          "ranges": [list(r) for r in delta["ranges"]]}}
+        if found is None:
+            return meta, None
+
+        part, pos = found
+        if part == "base":
+            previous = {col: meta["columns"][col][pos] for col in self.COLUMNS}
+            meta["removed"].append(str(student_id))
+        else:
+            delta = meta["delta"]
+            previous = {col: delta["columns"][col].pop(pos) for col in self.COLUMNS}
+            del delta["ranges"][pos]
+        return meta, previous
+
+    def _people(self, meta, matrix=None, delta_matrix=None):
+        """(record, templates hoặc None) của mọi người còn hiệu lực: base rồi delta"""
+        removed = set(meta.get("removed", ()))
+        columns, offsets = meta["columns"], meta["offsets"]
+        for i, student_id in enumerate(columns["id"]):
+            if str(student_id) in removed:
+                continue
+            rows = matrix[offsets[i]:offsets[i + 1]] if matrix is not None else None
+            yield {col: columns[col][i] for col in self.COLUMNS}, rows
+        delta = self._delta(meta)
+        for j, (start, end) in enumerate(delta["ranges"]):
+            rows = delta_matrix[start:end] if delta_matrix is not None else None
+            yield {col: delta["columns"][col][j] for col in self.COLUMNS}, rows
+
+    def _commit(self, meta):
+        """Publish meta, hoặc compact nếu delta + dòng chết đã quá lớn so với base"""
+        removed = set(meta["removed"])
+        offsets = meta["offsets"]
+        dead = sum(offsets[i + 1] - offsets[i]
+                   for i, student_id in enumerate(meta["columns"]["id"])
+                   if str(student_id) in removed)
+        pending = dead + meta["delta"]["rows"]
+        if pending > max(self.COMPACT_MIN_ROWS, self.COMPACT_RATIO * meta["rows"]):
+            self._compact(meta)
+        else:
+            self._publish(meta)
+
+    def _compact(self, meta):
+        matrix = np.load(self._matrix_path(meta), mmap_mode="r") if meta["rows"] else None
+        delta_matrix, _ = self.load_delta(meta)
+        segments = []
+        columns = {col: [] for col in self.COLUMNS}
+        offsets = [0]
+        for record, rows in self._people(meta, matrix, delta_matrix):
+            segments.append(rows)
+            offsets.append(offsets[-1] + len(rows))
+            for col in self.COLUMNS:
+                columns[col].append(record[col])
+        self._write(segments, columns, offsets, meta)
+
+    def _write(self, segments, columns, offsets, old_meta):
+        """Ghi file ma trận thế hệ mới (delta rỗng) rồi publish meta.json"""
+        generation = (old_meta["generation"] + 1) if old_meta else 1
+        base_name = os.path.basename(self.base_path)
+        matrix_name = f"{base_name}.{generation}.npy"
+        matrix_path = self._path(matrix_name)
+        rows = int(offsets[-1])
+
+        # Ghi thẳng vào file qua memmap → không cần giữ cả gallery trong RAM
+        out = np.lib.format.open_memmap(
+            matrix_path, mode="w+", dtype=np.float32, shape=(rows, self.dim))
+        cursor = 0
+        for segment in segments:
+            out[cursor:cursor + len(segment)] = segment
+            cursor += len(segment)
+        out.flush()
+        del out
+
+        meta = {
+            "version": self.VERSION,
+            "generation": generation,
+            "matrix": matrix_name,
+            "rows": rows,
+            "dim": self.dim,
+            "offsets": [int(o) for o in offsets],
+            "columns": self._clean_columns(columns),
+            "removed": [],
+        }
+        meta["delta"] = self._delta(meta)
+        self._publish(meta)
+        self._cleanup(keep=(matrix_name, meta["delta"]["file"]))
+
+    @classmethod
+    def _clean_columns(cls, columns):
+        return {
+            "id": [str(v) for v in columns["id"]],
+            "name": list(columns["name"]),
+            "num_samples": [int(v or 0) for v in columns["num_samples"]],
+            "quality_score": [float(v or 0.0) for v in columns["quality_score"]],
+            "model": list(columns["model"]),
+            "created_date": list(columns["created_date"]),
+        }
+
+    def _publish(self, meta):
+        meta["delta"]["columns"] = self._clean_columns(meta["delta"]["columns"])
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+
+    def _cleanup(self, keep):
+        """Xoá file ma trận / delta thế hệ cũ (bỏ qua nếu process khác còn mmap)"""
+        prefix = self.base_path + "."
+        for path in glob.glob(glob.escape(self.base_path) + ".*"):
+            generation = path[len(prefix):].split(".", 1)[0]
+            if (os.path.basename(path) in keep or not generation.isdigit()
+                    or not path.endswith((".npy", ".delta.f32"))):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # =====================================================
+    def migrate_legacy(self):
+        """Chuyển embeddings.pkl (list dict) sang định dạng cột nếu chưa có store"""
+        if self.exists() or not os.path.exists(self.legacy_path):
+            return False
+        with self._locked():
+            # Process khác có thể đã migrate trong lúc chờ lock
+            if self.exists():
+                return False
+            return self._migrate_legacy()
+
+    def _migrate_legacy(self):
+        try:
+            with open(self.legacy_path, "rb") as f:
+                data = pickle.load(f) or []
+        except Exception as e:
+            print(f"⚠ Lỗi đọc {self.legacy_path} để migrate: {e}")
+            return False
+
+        segments = []
+        columns = {col: [] for col in self.COLUMNS}
+        offsets = [0]
+        for item in data:
+            templates = np.asarray(item.get("embeddings", item["embedding"]),
+                                   dtype=np.float32).reshape(-1, self.dim)
+            templates = templates / np.maximum(
+                np.linalg.norm(templates, axis=1, keepdims=True), 1e-10)
+            segments.append(templates)
+            offsets.append(offsets[-1] + len(templates))
+            for col in self.COLUMNS:
+                columns[col].append(item.get(col))
+
+        self._write(segments, columns, offsets, None)
+        print(f"✓ Migrated {len(data)} records từ {self.legacy_path} → {self.meta_path}")
+        return True
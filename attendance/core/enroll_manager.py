@@ -1,8 +1,9 @@
 from datetime import datetime
 import os
-import pickle
 import numpy as np
-from core.insightface_singleton import InsightFaceSingleton
+from core.embedding_store import EmbeddingStore
+from core.model_pool import FACE_MODULES, ModelPool
+from core.similarity import get_kernel
 
 
 class EnrollManager:
@@ -14,31 +15,50 @@ class EnrollManager:
 
     def __init__(self, db_path="database/embeddings.pkl", max_samples=15):
         self.db_path = db_path
+        self.store = EmbeddingStore(db_path)
         self.max_samples = max_samples
         self.samples = []           # list[np.ndarray]
         self.last_embedding = None
-        self.app = InsightFaceSingleton.get_instance(
-            name="buffalo_l",
-            providers=["CPUExecutionProvider"],
-            det_size=(320, 320),
-            ctx_id=0
-        )
+        self.kernel = get_kernel()
+        self._faces = None
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         print(f"✓ EnrollManager ready")
         print(f"  - Max samples: {max_samples}")
         print(f"  - Similarity threshold: {self.MIN_SAMPLE_SIMILARITY}")
         print(f"  - Min confidence: {self.MIN_CONFIDENCE}")
 
+    @property
+    def faces(self):
+        """
+        Pipeline riêng (det_size 320) cho add_frame(), dựng khi dùng lần đầu:
+        GUI enroll đưa khuôn mặt đã detect từ RecognitionEngine qua add_faces().
+        """
+        if self._faces is None:
+            # Chỉ detection + recognition: enroll không dùng landmark / gender-age
+            self._faces = ModelPool.pipeline(
+                name="buffalo_l",
+                providers=["CPUExecutionProvider"],
+                det_size=(320, 320),
+                allowed_modules=FACE_MODULES,
+                ctx_id=0
+            )
+        return self._faces
+
     # =====================================================
     def add_frame(self, rgb_frame):
         """Thêm frame vào danh sách mẫu"""
-        faces = self.app.get(rgb_frame)
+        return self.add_faces(self.faces.get(rgb_frame))
+
+    def add_faces(self, faces):
+        """Thêm mẫu từ các khuôn mặt đã detect sẵn (vd. từ RecognitionEngine)"""
         if len(faces) != 1:
             if len(faces) > 1:
                 print(f"⚠ Multiple faces detected ({len(faces)})")
             return False
+        return self.add_face(faces[0])
 
-        face = faces[0]
+    def add_face(self, face):
+        """Thêm một khuôn mặt (insightface Face có normed_embedding) vào danh sách mẫu"""
         if face.det_score < self.MIN_CONFIDENCE:
             print(
                 f"⚠ Low confidence: {face.det_score:.3f} < {self.MIN_CONFIDENCE}")
@@ -51,7 +71,7 @@ class EnrollManager:
 
         # ===== Chống sample trùng =====
         if self.last_embedding is not None:
-            sim = float(np.dot(emb, self.last_embedding))
+            sim = float(self.kernel.dot(emb[None, :], self.last_embedding[None, :])[0, 0])
             if sim > self.MIN_SAMPLE_SIMILARITY:
                 print(
                     f"⚠ Too similar to last sample: {sim:.3f} > {self.MIN_SAMPLE_SIMILARITY}")
@@ -90,15 +110,11 @@ class EnrollManager:
         mean = np.mean(embeddings, axis=0)
         mean /= (np.linalg.norm(mean) + 1e-10)
 
-        filtered = []
-        removed_indices = []
-
-        for i, emb in enumerate(embeddings):
-            dist = 1.0 - float(np.dot(emb, mean))  # cosine distance
-            if dist <= self.MAX_OUTLIER_DISTANCE:
-                filtered.append(emb)
-            else:
-                removed_indices.append(i)
+        # Cosine distance của tất cả mẫu tới mean trong một lần gọi kernel
+        dists = 1.0 - self.kernel.dot(np.stack(embeddings), mean[None, :])[:, 0]
+        filtered = [emb for emb, dist in zip(embeddings, dists)
+                    if dist <= self.MAX_OUTLIER_DISTANCE]
+        removed_indices = np.nonzero(dists > self.MAX_OUTLIER_DISTANCE)[0].tolist()
 
         if len(filtered) < 5:
             print(
@@ -120,10 +136,7 @@ class EnrollManager:
 
         # Tính độ phân tán (variance) - cao hơn = đa dạng hơn
         mean = np.mean(embeddings, axis=0)
-        variances = []
-        for emb in embeddings:
-            dist = 1.0 - float(np.dot(emb, mean))
-            variances.append(dist)
+        variances = 1.0 - self.kernel.dot(np.stack(embeddings), mean[None, :])[:, 0]
 
         avg_variance = np.mean(variances)
         quality_score = min(1.0, avg_variance / 0.2)  # Normalize to 0-1
@@ -132,9 +145,13 @@ class EnrollManager:
 
     # =====================================================
     def save(self, student_id, name):
+        """
+        Lưu templates của phiên enroll vào store. Trả về templates (k, 512) vừa
+        ghi để nơi gọi vá FaceMatcher mà không đọc lại store, None nếu thất bại.
+        """
         if not self.samples:
             print("❌ Không có mẫu để lưu")
-            return False
+            return None
 
         print(f"\n{'='*60}")
         print(f"💾 Saving enrollment for: {name} ({student_id})")
@@ -147,77 +164,39 @@ class EnrollManager:
         quality = self._calculate_quality_score(embeddings)
         print(f"📊 Quality score: {quality:.2%}")
 
-        # ===== Mean + normalize =====
-        mean_emb = np.mean(embeddings, axis=0)
-        mean_emb /= (np.linalg.norm(mean_emb) + 1e-10)
+        # ===== Giữ lại từng mẫu để match max-over-templates =====
+        templates = np.stack(embeddings).astype(np.float32)
 
         # Thời điểm hiện tại
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # ===== Load existing database =====
-        data = []
-        if os.path.exists(self.db_path):
-            try:
-                with open(self.db_path, "rb") as f:
-                    data = pickle.load(f)
-                print(f"✓ Loaded existing database ({len(data)} records)")
-            except Exception as e:
-                print(f"⚠ Error loading database: {e}")
-                data = []
-
-        # ===== Update or append =====
-        updated = False
-        for i, item in enumerate(data):
-            if item["id"] == student_id:
-                # GIỮ created_date cũ
-                record = {
-                    "id": student_id,
-                    "name": name,
-                    "embedding": mean_emb,
-                    "num_samples": len(embeddings),
-                    "quality_score": quality,
-                    "model": "buffalo_l",
-                    "created_date": item.get("created_date", now)
-                }
-                data[i] = record
-                updated = True
-                print(f"✓ Updated existing record for {student_id}")
-                break
-
-        if not updated:
-            # Nhân viên mới → tạo created_date
-            record = {
-                "id": student_id,
-                "name": name,
-                "embedding": mean_emb,
-                "num_samples": len(embeddings),
-                "quality_score": quality,
-                "model": "buffalo_l",
-                "created_date": now
-            }
-            data.append(record)
-            print(f"✓ Added new record for {student_id}")
-
-        # ===== Save to file =====
+        # ===== Update or append (giữ created_date cũ nếu đã tồn tại) =====
         try:
-            with open(self.db_path, "wb") as f:
-                pickle.dump(data, f)
+            record = self.store.upsert(
+                student_id,
+                name,
+                templates,
+                num_samples=len(embeddings),
+                quality_score=quality,
+                model="buffalo_l",
+                created_date=now
+            )
             print(f"✅ SUCCESS!")
             print(f"   Student: {name} ({student_id})")
             print(f"   Samples: {len(embeddings)}/{len(self.samples)}")
             print(f"   Quality: {quality:.2%}")
-            print(f"   Created: {record['created_date']}") # type: ignore
-            print(f"   Location: {self.db_path}")
+            print(f"   Created: {record['created_date']}")
+            print(f"   Location: {self.store.meta_path}")
             print(f"{'='*60}\n")
         except Exception as e:
             print(f"❌ Lỗi lưu embedding: {e}")
-            return False
+            return None
 
         # ===== Clear samples =====
         self.samples.clear()
         self.last_embedding = None
 
-        return True
+        return templates
 
     # =====================================================
     def reset(self):
@@ -1,61 +1,218 @@
+import threading
 import numpy as np
-import pickle
-import os
+from core.ann_index import (ONLINE_BUILD_MAX_ROWS, build_or_load_index, index_path_for,
+                            store_fingerprint)
+from core.embedding_store import EmbeddingStore
+from core.gallery import Gallery, RosterView
+from core.similarity import get_kernel
 
 class FaceMatcher:
-    def __init__(self, db_path="database/embeddings.pkl", threshold=0.45):
-        self.db_path = db_path         
+    """
+    So khớp embedding với gallery đã đăng ký.
+
+    index:
+        - "flat": quét toàn bộ gallery (chính xác, mặc định)
+        - "ivf" / "hnsw": ANN index lấy shortlist rồi re-rank chính xác,
+          dùng khi gallery lớn. Knob recall/latency qua index_params
+          (ivf: nlist, nprobe - hnsw: M, ef_construction, ef_search).
+          Chi phí build (lưu .npz cạnh store, build lại sau mỗi lần store compact):
+          ivf ~25s cho 200k templates → build được lúc load, là lựa chọn cho
+          gallery lớn; hnsw ~2-3 ms / template (200k > 10 phút) → trên
+          ONLINE_BUILD_MAX_ROWS phải build offline (python -m core.ann_index hnsw),
+          chưa có file thì tạm quét flat.
+        - "int8" / "float16": quét code lượng tử hoá trong RAM (nhỏ hơn 4x / 2x
+          so với float32) rồi re-rank top ứng viên trên ma trận float32 mmap
+          của EmbeddingStore - chỉ đọc dòng ứng viên, không có bản float32
+          riêng trong RAM (page cache của file dùng chung, kernel tự thu hồi).
+
+    kernel: similarity kernel "numpy" / "simsimd" / "auto" (core.similarity).
+
+    Roster: match_batch(..., roster=matcher.roster_view(ids)) quét gallery con
+    của phiên trước, chỉ những khuôn mặt không khớp mới quét toàn bộ gallery.
+
+    Thread-safety: gallery là snapshot bất biến (core.gallery.Gallery).
+    reload()/upsert()/remove() dựng snapshot mới rồi publish bằng một phép
+    gán reference; match() không lock và không bao giờ thấy gallery dở dang.
+    """
+
+    def __init__(self, db_path="database/embeddings.pkl", threshold=0.45,
+                 index="flat", index_params=None, rerank_candidates=64, kernel=None,
+                 online_build_limit=True):
+        self.db_path = db_path
+        self.store = EmbeddingStore(db_path)
         self.threshold = threshold
-        self.embeddings = None
-        self.ids = []
-        self.names = []
-        self._load()                   
+        self.index_backend = index
+        self.index_params = dict(index_params or {})
+        self.rerank_candidates = rerank_candidates
+        # False = cho phép build hnsw lớn ngay lúc load (benchmark), rất chậm
+        self.online_build_limit = online_build_limit
+        self.kernel = get_kernel(kernel)
+        self._gallery = Gallery()
+        self._write_lock = threading.Lock()    # chỉ serialize các writer
+        self._load()
 
-    def _load(self):
-        """Hàm load hoặc reload embeddings"""
-        self.embeddings = None
-        self.ids = []
-        self.names = []
+    # Giữ các thuộc tính cũ cho code bên ngoài - đọc từ snapshot hiện tại
+    @property
+    def gallery(self):
+        return self._gallery
+
+    @property
+    def embeddings(self):
+        return self._gallery.embeddings
+
+    @property
+    def ids(self):
+        """Id những người còn hiệu lực (base chưa xoá + delta)"""
+        return self._gallery.people()[0]
 
-        if not os.path.exists(self.db_path):
-            print("Không tìm thấy file embeddings.pkl")
-            return
+    @property
+    def names(self):
+        return self._gallery.people()[1]
 
-        try:
-            with open(self.db_path, "rb") as f:
-                data = pickle.load(f)
+    @property
+    def index(self):
+        return self._gallery.index
+
+    def _load(self):
+        """Hàm load hoặc reload embeddings - dựng snapshot mới rồi mới publish"""
+        with self._write_lock:
+            try:
+                # Ma trận templates được mmap read-only, đã normalize khi ghi
+                matrix, meta = self.store.load()
+                delta_matrix, delta = self.store.load_delta(meta) if meta else (None, None)
+                if meta is None or not (meta["rows"] or delta["ranges"]):
+                    print("Gallery embeddings rỗng")
+                    self._gallery = Gallery()
+                    return
 
-            if not data:
-                print("File embeddings rỗng")
+                # Mỗi người giữ toàn bộ mẫu (templates) liên tiếp trong một ma trận
+                offsets = np.asarray(meta["offsets"], dtype=np.int64)[:-1]
+                ids = meta["columns"]["id"]
+                names = meta["columns"]["name"]
+            except Exception as e:
+                print(f"Lỗi khi load embeddings: {e} (giữ gallery hiện tại)")
                 return
 
-            self.embeddings = np.array([item["embedding"] for item in data])
-            self.ids = [item["id"] for item in data]
-            self.names = [item["name"] for item in data]
+            index = None
+            if self.index_backend != "flat" and len(matrix):
+                try:
+                    index = build_or_load_index(
+                        self.index_backend,
+                        matrix,
+                        path=index_path_for(self.db_path, self.index_backend),
+                        fingerprint=store_fingerprint(matrix, meta),
+                        max_build_rows=(ONLINE_BUILD_MAX_ROWS.get(self.index_backend)
+                                        if self.online_build_limit else None),
+                        **self.index_params
+                    )
+                except Exception as e:
+                    print(f"⚠ Lỗi build index {self.index_backend}, dùng flat: {e}")
 
-            # Normalize 
-            norms = np.linalg.norm(self.embeddings, axis=1, keepdims=True)
-            self.embeddings /= np.maximum(norms, 1e-10)
+            # Người bị xoá / enroll lại sau lần compact: tombstone ở base, templates
+            # mới từ file delta của store → cùng cơ chế với upsert() trong RAM
+            gallery = Gallery(matrix, offsets, ids, names, index)
+            for student_id in meta.get("removed", ()):
+                person = gallery.id_to_person.get(student_id)
+                if person is not None:
+                    gallery.removed[person] = True
+            for student_id, name, (start, end) in zip(delta["columns"]["id"],
+                                                     delta["columns"]["name"], delta["ranges"]):
+                gallery = gallery.with_upsert(student_id, name, np.asarray(delta_matrix[start:end]))
 
-            print(f"Loaded / Reloaded {len(self.ids)} known faces from {self.db_path}")
-        except Exception as e:
-            print(f"Lỗi khi load embeddings: {e}")
+            # Publish: một phép gán reference duy nhất
+            self._gallery = gallery
+            print(f"Loaded / Reloaded {len(ids) - len(meta.get('removed', ())) + len(delta['ranges'])} "
+                  f"known faces ({gallery.num_templates} templates) from {self.store.meta_path}")
+
+    def set_search_params(self, **params):
+        """Chỉnh knob recall/latency lúc chạy (nprobe, ef_search)"""
+        self.index_params.update(params)
+        if self.index is not None:
+            self.index.set_search_params(**params)
 
     def reload(self):
         print("Reloading embeddings sau khi enroll mới...")
         self._load()
 
+    # =====================================================
+    def upsert(self, student_id, name, emb):
+        """
+        Thêm / ghi đè một người trong RAM mà không reload cả gallery.
+        emb: (512,) hoặc (k, 512) templates. Chi phí O(k), không phụ thuộc N.
+        """
+        templates = np.asarray(emb, dtype=np.float32).reshape(-1, 512)
+        templates = templates / np.maximum(
+            np.linalg.norm(templates, axis=1, keepdims=True), 1e-10)
+
+        with self._write_lock:
+            self._gallery = self._gallery.with_upsert(str(student_id), name, templates)
+
+    def remove(self, student_id):
+        """Xoá một người khỏi gallery trong RAM. Trả về False nếu không có."""
+        with self._write_lock:
+            self._gallery, removed = self._gallery.with_removed(str(student_id))
+        return removed
+
+    # =====================================================
     def match(self, query_embedding):
-        if self.embeddings is None or len(self.embeddings) == 0:
-            return None, None, 0.0
+        return self.match_batch(np.asarray(query_embedding)[None, :])[0][0]
+
+    def roster_view(self, student_ids):
+        """Tạo RosterView cho một phiên, dùng lại qua nhiều lần match_batch"""
+        return RosterView(student_ids)
+
+    def match_batch(self, query_embeddings, top_k=1, roster=None):
+        """
+        So khớp nhiều khuôn mặt cùng lúc bằng một phép nhân ma trận.
+
+        Args:
+            query_embeddings: array (N, 512) - embedding của N khuôn mặt trong frame
+            top_k: số ứng viên trả về cho mỗi khuôn mặt
+            roster: RosterView của phiên (tùy chọn) - quét gallery con trước,
+                fallback gallery đầy đủ cho khuôn mặt không khớp
+
+        Returns:
+            list N phần tử, mỗi phần tử là list top_k tuple (id, name, similarity)
+            sắp xếp giảm dần theo similarity. id/name là None nếu dưới threshold.
+        """
+        gallery = self._gallery     # đọc reference đúng một lần
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        if len(queries) == 0:
+            return []
+
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-10)
+
+        if roster is None:
+            return self._match_gallery(gallery, queries, top_k)
+
+        results = self._match_gallery(roster.gallery_for(gallery), queries, top_k)
+        misses = [i for i, candidates in enumerate(results) if candidates[0][0] is None]
+        if misses:
+            fallback = self._match_gallery(gallery, queries[misses], top_k)
+            for i, candidates in zip(misses, fallback):
+                results[i] = candidates
+        return results
 
-        query_norm = query_embedding / (np.linalg.norm(query_embedding) + 1e-10)
-        similarities = np.dot(self.embeddings, query_norm)
+    def _match_gallery(self, gallery, queries, top_k):
+        if gallery.is_empty():
+            return [[(None, None, 0.0)] for _ in range(len(queries))]
 
-        idx = np.argmax(similarities)
-        best_sim = similarities[idx]
+        top_idx, top_sims = gallery.search(
+            queries, top_k, self.rerank_candidates, self.kernel)
 
-        if best_sim >= self.threshold:
-            return self.ids[idx], self.names[idx], best_sim
-        else:
-            return None, None, best_sim
\ No newline at end of file
+        results = []
+        for row_idx, row_sims in zip(top_idx, top_sims):
+            candidates = []
+            for idx, sim in zip(row_idx, row_sims):
+                if idx < 0 or sim == -np.inf:
+                    continue
+                sim = float(sim)
+                if sim >= self.threshold:
+                    candidates.append((*gallery.label(idx), sim))
+                else:
+                    candidates.append((None, None, sim))
+            results.append(candidates or [(None, None, 0.0)])
+        return results
@@ -0,0 +1,301 @@
+import copy
+import numpy as np
+from core.similarity import get_kernel
+
+
+class Gallery:
+    """
+    Snapshot bất biến của gallery mà FaceMatcher dùng để so khớp.
+    - Reader giữ một reference tới snapshot và không bao giờ thấy nó thay đổi.
+    - Mọi thay đổi (reload, upsert, remove) tạo snapshot mới rồi publish bằng
+      một phép gán reference duy nhất → reader không cần lock.
+
+    Gồm 2 phần:
+        - base: ma trận templates (thường là mmap read-only) + ANN index nếu có
+        - delta: ma trận nhỏ trong RAM nhận upsert() giữa hai lần reload.
+          Người bị xoá/ghi đè (ở base hay delta) được đánh dấu tombstone.
+    Index người: base dùng [0, P), delta dùng [P, P + D).
+    """
+
+    DELTA_INITIAL_CAPACITY = 64
+
+    def __init__(self, embeddings=None, offsets=None, ids=(), names=(), index=None):
+        self.embeddings = embeddings    # (total_samples, 512) - tất cả mẫu của mọi người
+        self.offsets = offsets          # (num_people,) - dòng bắt đầu của từng người
+        self.ids = tuple(ids)
+        self.names = tuple(names)
+        self.index = index
+
+        if embeddings is not None and len(embeddings):
+            counts = np.diff(np.append(offsets, len(embeddings)))
+            self.owners = np.repeat(np.arange(len(counts)), counts)
+        else:
+            self.embeddings = None
+            self.owners = None
+
+        self.id_to_person = {sid: i for i, sid in enumerate(self.ids)}
+        self.removed = np.zeros(len(self.ids), dtype=bool)
+
+        self.delta_rows = np.empty((0, 512), dtype=np.float32)
+        self.delta_owner = np.empty(0, dtype=np.int64)
+        self.delta_count = 0            # số dòng delta thuộc snapshot này
+        self.delta_ids = ()
+        self.delta_names = ()
+        self.delta_removed = np.zeros(0, dtype=bool)    # tombstone theo người ở delta
+        self.delta_dead_rows = 0        # số dòng delta thuộc người đã tombstone
+        self.delta_index = {}           # id -> index người ở delta (chỉ người còn sống)
+
+    @property
+    def num_templates(self):
+        base = len(self.embeddings) if self.embeddings is not None else 0
+        return base + self.delta_count - self.delta_dead_rows
+
+    def is_empty(self):
+        return self.num_templates == 0
+
+    def label(self, idx):
+        if idx < len(self.ids):
+            return self.ids[idx], self.names[idx]
+        idx -= len(self.ids)
+        return self.delta_ids[idx], self.delta_names[idx]
+
+    def templates_of(self, student_id):
+        """Templates (k, 512) của một người còn hiệu lực, None nếu không có"""
+        person = self.delta_index.get(student_id)
+        if person is not None:
+            count = self.delta_count
+            return self.delta_rows[:count][self.delta_owner[:count] == person]
+
+        person = self.id_to_person.get(student_id)
+        if person is None or self.removed[person]:
+            return None
+        end = self.offsets[person + 1] if person + 1 < len(self.offsets) else len(self.embeddings)
+        return np.asarray(self.embeddings[self.offsets[person]:end])
+
+    def subset(self, student_ids):
+        """Gallery con (copy trong RAM, quét flat) chỉ gồm các id cho trước"""
+        ids, names, templates = [], [], []
+        for student_id in student_ids:
+            rows = self.templates_of(student_id)
+            if rows is None or not len(rows):
+                continue
+            ids.append(student_id)
+            names.append(self.label(self._person_of(student_id))[1])
+            templates.append(rows)
+
+        if not templates:
+            return Gallery()
+        counts = np.array([len(t) for t in templates])
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return Gallery(np.ascontiguousarray(np.concatenate(templates), dtype=np.float32),
+                       offsets, ids, names)
+
+    def _person_of(self, student_id):
+        if student_id in self.delta_index:
+            return len(self.ids) + self.delta_index[student_id]
+        return self.id_to_person[student_id]
+
+    def _derive(self):
+        """Bản sao nông - mảng dùng chung cho tới khi bị thay bằng mảng mới"""
+        return copy.copy(self)
+
+    # =====================================================
+    def with_upsert(self, student_id, name, templates):
+        """
+        Snapshot mới có thêm / ghi đè một người.
+        Dòng mới được ghi vào phần capacity dư của buffer delta (sau delta_count),
+        vùng mà các snapshot cũ không bao giờ đọc tới → không cần copy buffer.
+        """
+        gallery, _ = self.with_removed(student_id)
+        gallery = gallery if gallery is not self else self._derive()
+
+        # Tăng capacity theo cấp số nhân → append amortized O(1)
+        count = gallery.delta_count
+        needed = count + len(templates)
+        if needed > len(gallery.delta_rows):
+            capacity = max(self.DELTA_INITIAL_CAPACITY, len(gallery.delta_rows) * 2, needed)
+            rows = np.empty((capacity, 512), dtype=np.float32)
+            owner = np.empty(capacity, dtype=np.int64)
+            rows[:count] = gallery.delta_rows[:count]
+            owner[:count] = gallery.delta_owner[:count]
+            gallery.delta_rows, gallery.delta_owner = rows, owner
+
+        person = len(gallery.delta_ids)
+        gallery.delta_rows[count:needed] = templates
+        gallery.delta_owner[count:needed] = person
+        gallery.delta_count = needed
+        gallery.delta_ids = gallery.delta_ids + (student_id,)
+        gallery.delta_names = gallery.delta_names + (name,)
+        gallery.delta_removed = np.append(gallery.delta_removed, False)
+        gallery.delta_index = {**gallery.delta_index, student_id: person}
+        return gallery
+
+    def with_removed(self, student_id):
+        """
+        Trả về (snapshot mới, removed). Snapshot giữ nguyên nếu không có người này.
+        Người ở base hay delta đều chỉ bị đánh tombstone, buffer delta không bị copy;
+        dòng chết ở delta được dọn khi chiếm quá nửa buffer (_compact_delta).
+        """
+        gallery = self
+        removed = False
+
+        person = self.id_to_person.get(student_id)
+        if person is not None and not self.removed[person]:
+            gallery = self._derive()
+            gallery.removed = self.removed.copy()
+            gallery.removed[person] = True          # tombstone ở base
+            removed = True
+
+        person = self.delta_index.get(student_id)
+        if person is not None:
+            gallery = gallery if removed else self._derive()
+            gallery.delta_removed = self.delta_removed.copy()
+            gallery.delta_removed[person] = True    # tombstone ở delta
+            gallery.delta_index = {sid: p for sid, p in self.delta_index.items()
+                                   if sid != student_id}
+            count = self.delta_count
+            gallery.delta_dead_rows = self.delta_dead_rows + int(
+                np.count_nonzero(self.delta_owner[:count] == person))
+            removed = True
+
+            if gallery.delta_dead_rows > max(self.DELTA_INITIAL_CAPACITY,
+                                             count - gallery.delta_dead_rows):
+                gallery._compact_delta()
+
+        return gallery, removed
+
+    def _compact_delta(self):
+        """
+        Dồn các người còn sống của delta sang buffer mới (gọi trên snapshot vừa
+        derive, snapshot cũ vẫn đọc buffer cũ). Chỉ chạy khi dòng chết vượt số
+        dòng sống → chi phí khấu hao O(1) mỗi lần xoá / ghi đè.
+        """
+        count = self.delta_count
+        owner = self.delta_owner[:count]
+        alive = ~self.delta_removed[owner]
+        # Đánh lại index người theo thứ tự cũ, bỏ người đã xoá
+        remap = np.cumsum(~self.delta_removed) - 1
+        keep = np.flatnonzero(~self.delta_removed)
+
+        self.delta_rows = self.delta_rows[:count][alive]
+        self.delta_owner = remap[owner[alive]]
+        self.delta_count = len(self.delta_rows)
+        self.delta_ids = tuple(self.delta_ids[p] for p in keep)
+        self.delta_names = tuple(self.delta_names[p] for p in keep)
+        self.delta_removed = np.zeros(len(keep), dtype=bool)
+        self.delta_index = {sid: p for p, sid in enumerate(self.delta_ids)}
+        self.delta_dead_rows = 0
+
+    def people(self):
+        """(ids, names) của những người còn hiệu lực - base trước, delta sau"""
+        ids = [sid for sid, dead in zip(self.ids, self.removed) if not dead]
+        names = [name for name, dead in zip(self.names, self.removed) if not dead]
+        for student_id, person in self.delta_index.items():
+            ids.append(student_id)
+            names.append(self.delta_names[person])
+        return ids, names
+
+    # =====================================================
+    def search(self, queries, top_k, rerank_candidates=64, kernel=None):
+        """
+        Trả về (person_idx, sim) top_k mỗi query, shape (N, top_k).
+        person_idx = -1 / sim = -inf nếu không đủ ứng viên.
+        kernel: similarity kernel (core.similarity), None = mặc định.
+        """
+        kernel = kernel or get_kernel()
+        parts = []
+        if self.embeddings is not None:
+            if self.index is not None:
+                parts.append(self._search_index(queries, top_k, rerank_candidates, kernel))
+            else:
+                parts.append(self._search_exact(queries, top_k, kernel))
+        if self.delta_count:
+            delta_idx, delta_sims = self._search_delta(queries, top_k, kernel)
+            parts.append((np.where(delta_idx >= 0, delta_idx + len(self.ids), -1), delta_sims))
+
+        top_idx = np.concatenate([idx for idx, _ in parts], axis=1)
+        top_sims = np.concatenate([sims for _, sims in parts], axis=1)
+        if len(parts) > 1:
+            order = np.argsort(-top_sims, axis=1)[:, :top_k]
+            top_idx = np.take_along_axis(top_idx, order, axis=1)
+            top_sims = np.take_along_axis(top_sims, order, axis=1)
+        return top_idx, top_sims
+
+    @staticmethod
+    def _top_k(similarities, top_k):
+        """Top-k theo cột của ma trận (N, num_people), sắp xếp giảm dần"""
+        k = max(1, min(top_k, similarities.shape[1]))
+        if k < similarities.shape[1]:
+            top_idx = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            top_idx = np.tile(np.arange(k), (len(similarities), 1))
+        top_sims = np.take_along_axis(similarities, top_idx, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        top_idx = np.take_along_axis(top_idx, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+        return top_idx, top_sims
+
+    def _search_exact(self, queries, top_k, kernel):
+        """Quét toàn bộ base"""
+        # Một GEMM trên toàn bộ templates rồi lấy max theo từng người
+        template_sims = kernel.dot(queries, self.embeddings)    # (N, total_samples)
+        similarities = np.maximum.reduceat(
+            template_sims, self.offsets, axis=1)        # (N, num_people)
+        similarities[:, self.removed] = -np.inf
+        return self._top_k(similarities, top_k)
+
+    def _search_delta(self, queries, top_k, kernel):
+        """Quét phần delta trong RAM, max theo từng người qua owner index"""
+        count = self.delta_count
+        template_sims = kernel.dot(queries, self.delta_rows[:count])
+        similarities = np.full((len(queries), len(self.delta_ids)), -np.inf, dtype=np.float32)
+        np.maximum.at(similarities.T, self.delta_owner[:count], template_sims.T)
+        similarities[:, self.delta_removed] = -np.inf
+        return self._top_k(similarities, top_k)
+
+    def _search_index(self, queries, top_k, rerank_candidates, kernel):
+        """Lấy shortlist templates từ ANN index rồi re-rank chính xác theo người"""
+        n_candidates = max(rerank_candidates, top_k)
+        rows = self.index.search(queries, n_candidates, kernel)     # (N, C), -1 = trống
+        valid = rows >= 0
+        safe_rows = np.where(valid, rows, 0)
+        valid &= ~self.removed[self.owners[safe_rows]]
+
+        # Re-rank: tính lại similarity chính xác trên float32 gallery
+        exact = np.einsum("nd,ncd->nc", queries, self.embeddings[safe_rows])
+        exact[~valid] = -np.inf
+
+        top_idx = np.full((len(queries), top_k), -1, dtype=np.int64)
+        top_sims = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        for i in range(len(queries)):
+            order = np.argsort(-exact[i])
+            order = order[valid[i, order]]
+            owners = self.owners[safe_rows[i, order]]
+            # Giữ template tốt nhất của mỗi người (lần xuất hiện đầu tiên)
+            _, first = np.unique(owners, return_index=True)
+            first = np.sort(first)[:top_k]
+            top_idx[i, :len(first)] = owners[first]
+            top_sims[i, :len(first)] = exact[i, order[first]]
+        return top_idx, top_sims
+
+
+class RosterView:
+    """
+    Danh sách người của một phiên (session roster) + gallery con được cache.
+    Gallery con chỉ build lại khi snapshot gallery gốc thay đổi.
+    """
+
+    def __init__(self, student_ids):
+        self.student_ids = tuple(dict.fromkeys(str(sid) for sid in student_ids))
+        self._cache = (None, None)      # (gallery gốc, gallery con) - gán nguyên tuple
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def gallery_for(self, source):
+        cached_source, cached_subset = self._cache
+        if cached_source is source:
+            return cached_subset
+        subset = source.subset(self.student_ids)
+        self._cache = (source, subset)
+        return subset
@@ -0,0 +1,191 @@
+import copy
+import threading
+
+import numpy as np
+from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
+
+from core.session_profile import get_profile, insightface_sessions
+
+# Chấm công / enroll chỉ cần bbox, kps (detection) và normed_embedding (recognition);
+# landmark 2D/3D và gender-age của buffalo_l không bao giờ được dùng
+FACE_MODULES = ("detection", "recognition")
+
+
+class ModelPool:
+    """
+    Registry InsightFace theo cấu hình thay cho singleton "ai gọi trước thắng".
+
+    Mỗi key (model pack, det_size, providers, modules) có một FaceAnalysis
+    riêng với đúng det_size của stage đó, nhưng ONNX session được dùng chung:
+        - "base": FaceAnalysis thật (tạo session) theo (pack, providers, modules);
+          yêu cầu một tập module con của base đã có thì dùng lại base đó
+        - "view": bản sao nông của base, chỉ khác detector (cũng là bản sao
+          nông của SCRFD, dùng chung session) với input_size riêng
+    → EnrollManager (320), RecognitionEngine (480), profile (640) cùng chạy
+    mà chỉ tốn RAM / thời gian load một bộ model.
+    Session được tạo với SessionOptions của SessionProfile (thread, execution
+    mode, affinity, cache graph tối ưu, bản INT8 theo ngưỡng drift) - profile
+    là một phần của key nên FP32 và INT8 không dùng lẫn session của nhau.
+    """
+
+    _bases = {}     # (name, providers, modules, profile) → FaceAnalysis
+    _views = {}     # (name, det_size, providers, modules, profile) → FaceAnalysis
+    _applied = set()    # profile đã áp thiết lập cấp process (affinity, thread torch)
+    _lock = threading.Lock()
+
+    DEFAULT_PROVIDERS = ("CPUExecutionProvider",)
+
+    @classmethod
+    def get(cls, name="buffalo_l", det_size=(640, 640), providers=None,
+            allowed_modules=None, ctx_id=0, det_thresh=0.5, profile=None):
+        """
+        FaceAnalysis đã prepare cho cấu hình yêu cầu.
+
+        Args:
+            det_size: (w, h) input SCRFD của stage gọi
+            providers: danh sách execution provider ONNX Runtime
+            allowed_modules: tên task cần load (vd. ["detection", "recognition"]),
+                None = toàn bộ model trong pack
+            profile: SessionProfile hoặc tên profile (None → FACE_ORT_PROFILE)
+        """
+        providers = tuple(providers or cls.DEFAULT_PROVIDERS)
+        modules = tuple(sorted(allowed_modules)) if allowed_modules else None
+        det_size = tuple(det_size)
+        profile = get_profile(profile)
+        key = (name, det_size, providers, modules, profile)
+
+        app = cls._views.get(key)
+        if app is not None:
+            return app
+
+        with cls._lock:
+            if key not in cls._views:
+                base = cls._base(name, providers, modules, profile, ctx_id, det_size, det_thresh)
+                cls._views[key] = cls._view(base, det_size, modules)
+                print(f"ModelPool: {name} det_size={det_size} modules={modules or 'all'} "
+                      f"profile={profile.name} ({len(cls._bases)} bộ session, "
+                      f"{len(cls._views)} cấu hình)")
+            return cls._views[key]
+
+    @classmethod
+    def _base(cls, name, providers, modules, profile, ctx_id, det_size, det_thresh):
+        for (base_name, base_providers, base_modules, base_profile), base in cls._bases.items():
+            if (base_name == name and base_providers == providers and base_profile == profile
+                    and (base_modules is None or (modules and set(modules) <= set(base_modules)))):
+                return base
+
+        if profile not in cls._applied:
+            profile.apply_process()
+            cls._applied.add(profile)
+
+        print(f"Khởi tạo InsightFace {name} {list(providers)} profile={profile.name}... "
+              f"(có thể mất vài giây)")
+        with insightface_sessions(profile):
+            base = FaceAnalysis(name=name, providers=list(providers),
+                                allowed_modules=list(modules) if modules else None)
+        base.prepare(ctx_id=ctx_id, det_thresh=det_thresh, det_size=det_size)
+        cls._bases[(name, providers, modules, profile)] = base
+        print("InsightFace đã sẵn sàng!")
+        return base
+
+    @staticmethod
+    def _view(base, det_size, modules):
+        if tuple(base.det_size) == det_size and modules is None:
+            return base
+
+        view = copy.copy(base)
+        view.models = {task: model for task, model in base.models.items()
+                       if modules is None or task in modules}
+        if tuple(base.det_size) != det_size:
+            # SCRFD.prepare() bỏ qua input_size nếu đã set → gán trực tiếp trên bản sao
+            detector = copy.copy(base.det_model)
+            detector.input_size = det_size
+            view.models["detection"] = detector
+        view.det_model = view.models["detection"]
+        view.det_size = det_size
+        return view
+
+    @classmethod
+    def pipeline(cls, name="buffalo_l", det_size=(640, 640), providers=None,
+                 allowed_modules=FACE_MODULES, ctx_id=0, det_thresh=0.5, profile=None):
+        """FacePipeline (detect / embed tách rời) trên FaceAnalysis của pool"""
+        return FacePipeline(cls.get(name, det_size, providers, allowed_modules,
+                                    ctx_id, det_thresh, profile))
+
+    @classmethod
+    def loaded(cls):
+        """Các cấu hình đang có trong pool (để log / debug)"""
+        return list(cls._views)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._views.clear()
+            cls._bases.clear()
+
+
+class FacePipeline:
+    """
+    API tách rời thay cho FaceAnalysis.get() (chạy mọi module cho mọi mặt):
+        - detect(img): chỉ SCRFD → list Face (bbox, kps, det_score)
+        - embed(img, faces): chỉ ArcFace cho các mặt được chọn
+        - embed_batch([(img, faces), ...]): như embed nhưng gom mặt của nhiều frame
+    Frame chỉ cần box (tracking, frame giữa hai lần embed) không tốn recognition
+    hay landmark / gender-age.
+
+    ArcFace chạy theo batch: mọi mặt được align (norm_crop 112x112) rồi đưa vào
+    session một lần dạng (N, 3, 112, 112) thay vì N lần recognition.get().
+    """
+
+    def __init__(self, app, max_batch=32):
+        self.app = app
+        self.detector = app.det_model
+        self.recognizer = app.models.get("recognition")
+        self.max_batch = max_batch
+        if self.recognizer is not None:
+            # Model export với batch cố định (vd. 1) thì không gom được hơn thế
+            batch_dim = self.recognizer.input_shape[0]
+            if isinstance(batch_dim, int) and batch_dim > 0:
+                self.max_batch = min(max_batch, batch_dim)
+
+    def detect(self, img, input_size=None, max_num=0):
+        """input_size=None → det_size đã prepare của cấu hình"""
+        bboxes, kpss = self.detector.detect(img, input_size=input_size,
+                                            max_num=max_num, metric="default")
+        return [Face(bbox=bboxes[i, :4], kps=kpss[i] if kpss is not None else None,
+                     det_score=bboxes[i, 4])
+                for i in range(len(bboxes))]
+
+    def embed(self, img, faces):
+        """Gán embedding cho faces (cùng ảnh img đã detect). Trả về faces."""
+        self.embed_batch([(img, faces)])
+        return faces
+
+    def embed_batch(self, items):
+        """
+        items: [(img, faces), ...] - một hoặc nhiều frame, mỗi frame kèm các mặt
+        cần embed. Gán face.embedding và trả về ma trận (N, 512) chưa normalize
+        theo đúng thứ tự đầu vào (frame trước, trong frame theo thứ tự faces).
+        """
+        if self.recognizer is None:
+            raise RuntimeError("Model pack chưa load module 'recognition'")
+        image_size = self.recognizer.input_size[0]
+        faces, crops = [], []
+        for img, frame_faces in items:
+            for face in frame_faces:
+                faces.append(face)
+                crops.append(face_align.norm_crop(img, landmark=face.kps, image_size=image_size))
+        if not crops:
+            return np.empty((0, self.recognizer.output_shape[-1]), dtype=np.float32)
+
+        feats = np.concatenate([self.recognizer.get_feat(crops[i:i + self.max_batch])
+                                for i in range(0, len(crops), self.max_batch)])
+        for face, feat in zip(faces, feats):
+            face.embedding = feat.flatten()
+        return feats
+
+    def get(self, img, max_num=0):
+        """detect + embed mọi mặt - tương đương app.get() nhưng chỉ 2 model"""
+        return self.embed(img, self.detect(img, max_num=max_num))
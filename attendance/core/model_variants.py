@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+
+INT8_DIR = os.path.join("models", "int8")
+MANIFEST_NAME = "manifest.json"
+
+_digests = {}       # (path, size, mtime_ns) → sha1
+_reported = set()   # (model, variant) đã log quyết định chọn model
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha1 nội dung file model (nhớ theo size + mtime → chỉ hash một lần mỗi process)"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        with _lock:
+            _digests[key] = digest
+    return digest
+
+
+def manifest_path(directory=INT8_DIR):
+    return os.path.join(directory, MANIFEST_NAME)
+
+
+def load_manifest(directory=INT8_DIR):
+    """
+    Manifest do quantize_models.py ghi:
+        {"models": {sha1 model FP32: {"task", "source", "path", "drift", "speedup", ...}}}
+    "path" tương đối với thư mục manifest. Không có file → manifest rỗng.
+    """
+    path = manifest_path(directory)
+    if not os.path.exists(path):
+        return {"models": {}}
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.setdefault("models", {})
+    return manifest
+
+
+def save_manifest(manifest, directory=INT8_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = manifest_path(directory)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def passes(entry, max_drift):
+    """Bản INT8 đạt ngưỡng: drift p95 (1 - cos so với FP32 trên tập held-out) ≤ max_drift"""
+    drift = entry.get("drift") or {}
+    return drift.get("p95") is not None and drift["p95"] <= max_drift
+
+
+def int8_variant(model_path, max_drift, directory=INT8_DIR):
+    """
+    Đường dẫn bản INT8 của model_path nếu manifest có bản lượng tử hoá từ đúng
+    file này (so sha1) và drift đạt ngưỡng; ngược lại None (dùng FP32).
+
+    Drift đo trên embedding so với FP32 → gallery enroll bằng model FP32 vẫn
+    dùng được khi nhận diện bằng INT8, sai lệch cosine bị chặn bởi max_drift.
+    """
+    entries = load_manifest(directory)["models"]
+    if not entries:
+        return None
+    entry = entries.get(file_digest(model_path))
+    if entry is None:
+        return None
+
+    name = os.path.basename(model_path)
+    variant = os.path.join(directory, entry["path"])
+    accepted = passes(entry, max_drift) and os.path.exists(variant)
+    with _lock:
+        report = (name, accepted) not in _reported
+        _reported.add((name, accepted))
+    if report:
+        p95 = (entry.get("drift") or {}).get("p95")
+        if accepted:
+            print(f"✓ {name}: dùng bản INT8 (drift p95 {p95:.4f} ≤ {max_drift}, "
+                  f"nhanh hơn {entry.get('speedup', '?')}x)")
+        elif not os.path.exists(variant):
+            print(f"⚠ {name}: manifest có bản INT8 nhưng thiếu file {variant} → FP32")
+        else:
+            print(f"⚠ {name}: bản INT8 drift p95 {p95} > {max_drift} → FP32")
+    return variant if accepted else None
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Bộ lọc chuyển động rẻ đặt trước pipeline nhận diện.
+    So frame (thu nhỏ, grayscale, blur) với background trung bình trượt;
+    nếu tỉ lệ pixel thay đổi nhỏ hơn min_changed_ratio thì coi là frame tĩnh
+    → bỏ qua detection / anti-spoof / matching.
+    Cứ max_idle_frames frame tĩnh liên tiếp thì vẫn cho qua một frame
+    (phòng ánh sáng đổi chậm hoặc người đứng yên từ trước).
+    """
+
+    def __init__(self, size=(160, 120), pixel_threshold=25, min_changed_ratio=0.005,
+                 learning_rate=0.05, max_idle_frames=30):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.learning_rate = learning_rate
+        self.max_idle_frames = max_idle_frames
+
+        self.background = None
+        self.idle_run = 0
+        self.last_ratio = 0.0
+        self.counts = {"frames": 0, "motion": 0, "idle": 0, "forced": 0}
+
+    def reset(self):
+        self.background = None
+        self.idle_run = 0
+        self.last_ratio = 0.0
+        self.counts = dict.fromkeys(self.counts, 0)
+
+    def check(self, frame_bgr):
+        """True nếu frame cần chạy pipeline (có chuyển động, frame đầu hoặc bị ép)"""
+        self.counts["frames"] += 1
+        small = cv2.resize(frame_bgr, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            self.counts["motion"] += 1
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        self.last_ratio = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+
+        if self.last_ratio >= self.min_changed_ratio:
+            self.idle_run = 0
+            self.counts["motion"] += 1
+            return True
+
+        self.idle_run += 1
+        if self.idle_run >= self.max_idle_frames:
+            self.idle_run = 0
+            self.counts["forced"] += 1
+            return True
+
+        self.counts["idle"] += 1
+        return False
+
+    @property
+    def stats(self):
+        frames = max(self.counts["frames"], 1)
+        return {**self.counts, "idle_ratio": round(self.counts["idle"] / frames, 3)}
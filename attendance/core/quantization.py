@@ -0,0 +1,49 @@
+import numpy as np
+from core.similarity import get_kernel
+
+
+class ScalarQuantizer:
+    """
+    Lượng tử hoá embedding theo từng chiều (scalar quantization).
+    - int8:    x_d ≈ code_d * scale_d, scale_d = max|x_d| / 127 (giảm 4x bộ nhớ)
+    - float16: ép kiểu trực tiếp (giảm 2x bộ nhớ)
+    Similarity tính trên code chỉ là xấp xỉ → cần re-rank bằng float32.
+    """
+
+    MODES = ("int8", "float16")
+
+    def __init__(self, mode="int8"):
+        if mode not in self.MODES:
+            raise ValueError(f"Quantization mode không hỗ trợ: {mode}")
+        self.mode = mode
+        self.scale = None           # (dim,) - chỉ dùng cho int8
+
+    def train(self, vectors, chunk_rows=65536):
+        if self.mode == "int8":
+            # Theo block → không tạo bản float32 tạm bằng cả gallery (vectors thường là mmap)
+            max_abs = np.zeros(vectors.shape[1], dtype=np.float32)
+            for start in range(0, len(vectors), chunk_rows):
+                np.maximum(max_abs, np.abs(vectors[start:start + chunk_rows]).max(axis=0),
+                           out=max_abs)
+            self.scale = (np.maximum(max_abs, 1e-10) / 127.0).astype(np.float32)
+        return self
+
+    def encode(self, vectors, chunk_rows=65536):
+        if self.mode == "float16":
+            return np.asarray(vectors, dtype=np.float16)
+
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, len(vectors), chunk_rows):
+            block = vectors[start:start + chunk_rows] / self.scale
+            codes[start:start + chunk_rows] = np.clip(np.rint(block), -127, 127)
+        return codes
+
+    def score(self, queries, codes, kernel=None):
+        """Similarity xấp xỉ (N, len(codes)) giữa query float32 và code"""
+        kernel = kernel or get_kernel()
+        # Scale đưa thẳng cho kernel: SimSIMD gộp vào query rồi lượng tử hoá một lần,
+        # NumPy nhân scale vào query float32 rồi đổi block sang float32
+        return kernel.dot(queries, codes, self.scale if self.mode == "int8" else None)
+
+    def nbytes(self, codes):
+        return codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
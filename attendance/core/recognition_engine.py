@@ -0,0 +1,417 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from core.anti_spoofing import AntiSpoofing
+from core.model_pool import FACE_MODULES, FacePipeline, ModelPool
+from core.motion_gate import MotionGate
+from core.scheduler import AdaptiveScheduler
+from core.tracker import FaceTracker
+
+
+class FaceResult:
+    """Một khuôn mặt (track) trong frame - bbox theo toạ độ frame gốc"""
+
+    def __init__(self, track, face=None):
+        self.track = track
+        self.face = face                    # insightface Face nếu detect ở frame này, không thì None
+        self.bbox = tuple(int(v) for v in track.bbox)   # (left, top, right, bottom)
+        self.is_real = bool(track.is_real)  # kết luận liveness (cache theo track)
+        self.real_conf = track.real_conf
+
+    @property
+    def track_id(self):
+        return self.track.track_id
+
+    @property
+    def det_score(self):
+        return self.track.score
+
+    @property
+    def embedding(self):
+        """Embedding vừa tính ở frame này, None nếu dùng cache của track"""
+        return self.face.normed_embedding if self.face is not None else None
+
+    @property
+    def identity(self):
+        """(student_id, name, similarity) đã cache trên track, None nếu chưa match"""
+        return self.track.identity
+
+
+class FrameResult:
+    """Kết quả xử lý một frame, được worker đẩy sang UI qua queue"""
+
+    def __init__(self, seq, frame, faces, spoof_info, latency_ms, stages=None, idle=False,
+                 dropped=False):
+        self.seq = seq
+        self.frame = frame                  # frame BGR đã xử lý
+        self.faces = faces                  # list[FaceResult]
+        self.spoof_info = spoof_info        # dict từ AntiSpoofing.detect_spoof()
+        self.latency_ms = latency_ms
+        self.stages = stages or {}          # {stage: ms} các stage đã chạy
+        self.idle = idle                    # motion gate bỏ qua frame này
+        self.dropped = dropped              # frame zero-copy bị ghi đè giữa chừng → bỏ kết quả
+        self.view = None                    # giá trị handler trả về (overlay, status...)
+
+
+class RecognitionEngine:
+    """
+    Pipeline nhận diện chạy trên thread riêng, tách khỏi Tk main thread.
+
+    UI gọi submit(frame) (không block, chỉ giữ frame mới nhất chưa xử lý) và
+    latest_result() để lấy kết quả mới nhất. Worker chạy detection + embedding
+    (InsightFace), anti-spoofing (YOLO), rồi gọi handler(result) của màn hình
+    đang dùng engine - handler cũng chạy trên worker nên các việc nặng như
+    match / ghi SQLite / lưu embedding không chạm tới Tk. Giá trị handler trả
+    về được gắn vào result.view để UI chỉ việc vẽ.
+
+    Tracking (cache=True): detector chạy mỗi detect_interval frame, các frame
+    giữa chỉ predict vị trí bằng FaceTracker. ArcFace / YOLO chỉ chạy cho track
+    mới, chưa chắc chắn hoặc có cache quá embed_refresh / liveness_refresh frame.
+    cache=False (enroll): detect + embed + anti-spoof mọi frame.
+
+    detect_interval, scale (resize trước detect), det_size và liveness_refresh
+    do AdaptiveScheduler quyết định theo latency đo được để đạt target_fps.
+
+    liveness_mode:
+        - "roi": YOLO chỉ chạy trên crop mặt của các track cần kiểm tra,
+          gom thành một batch (AntiSpoofing.detect_spoof_rois)
+        - "frame": YOLO trên full frame rồi ghép box "real" với mặt (cách cũ)
+
+    motion_gate (chỉ khi cache=True): frame không có chuyển động thì giữ nguyên
+    box và cache của track, không chạy model nào. None = tắt.
+    """
+
+    def __init__(self, app=None, anti_spoof=None, max_pending_results=2,
+                 embed_refresh=30, liveness_mode="roi", motion_gate=True,
+                 target_fps=15.0, scheduler=None, allowed_modules=FACE_MODULES,
+                 profile=None):
+        self.app = app or ModelPool.get(
+            name="buffalo_l",
+            providers=["CPUExecutionProvider"],
+            det_size=(480, 480),
+            allowed_modules=allowed_modules,
+            ctx_id=0,
+            profile=profile
+        )
+        self.faces = FacePipeline(self.app)     # detect / embed tách rời
+        self.anti_spoof = anti_spoof or AntiSpoofing()
+        self.scheduler = scheduler or AdaptiveScheduler(target_fps=target_fps)
+        self.embed_refresh = embed_refresh
+        self.liveness_mode = liveness_mode
+        self.motion_gate = MotionGate() if motion_gate is True else (motion_gate or None)
+        self._was_idle = False
+        self.tracker = FaceTracker()
+        self.cache = True
+        self.frame_index = 0
+
+        self._inbox = queue.Queue(maxsize=1)
+        self._outbox = queue.Queue(maxsize=max_pending_results)
+        self._handler = None
+        self._thread = None
+        self._running = False
+        self._seq = 0
+
+        self.frames_processed = 0
+        self.frames_skipped = 0             # frame bị thay bằng frame mới hơn trước khi xử lý
+        self.stats = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        # Số lần chạy / bỏ qua ở từng cửa (gate) - so với "frames" để thấy hiệu quả
+        self.stats = {
+            "frames": 0,
+            "idle_skipped": 0,      # motion gate: cảnh tĩnh, không chạy model
+            "detections": 0,
+            "detect_skipped": 0,    # frame giữa hai lần detect, chỉ predict track
+            "liveness": 0,          # số lần gọi YOLO
+            "liveness_cached": 0,   # track dùng lại kết luận liveness
+            "embeddings": 0,        # số khuôn mặt chạy ArcFace
+            "embed_cached": 0,      # track dùng lại embedding / danh tính
+            "torn": 0,              # frame shared memory bị ghi đè khi đang xử lý
+        }
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+    def report(self):
+        """Thống kê các gate (kèm motion gate) để log / benchmark"""
+        report = dict(self.stats)
+        if self.motion_gate is not None:
+            report["motion_gate"] = self.motion_gate.stats
+        report["scheduler"] = self.scheduler.snapshot()
+        return report
+
+    # =====================================================
+    def start(self, handler=None, cache=True):
+        """Chạy worker với handler(result) của màn hình hiện tại"""
+        self.stop()
+        self.reset(cache)
+        self._handler = handler
+        self._drain(self._inbox)
+        self._drain(self._outbox)
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def reset(self, cache=True):
+        """Xoá track, thống kê và trạng thái scheduler - dùng khi chạy run_once() trực tiếp"""
+        self.cache = cache
+        self.tracker.reset()
+        self.frame_index = 0
+        self._was_idle = False
+        self.scheduler.reset()
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self._reset_stats()
+
+    def stop(self, timeout=2.0):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+            print(f"RecognitionEngine stopped: {self.report()}")
+        self._handler = None
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def submit(self, frame_bgr):
+        """Đưa frame mới vào hàng đợi (thay frame cũ chưa xử lý). Không block."""
+        self._seq += 1
+        try:
+            self._inbox.get_nowait()
+            self.frames_skipped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._inbox.put_nowait((self._seq, frame_bgr))
+        except queue.Full:
+            self.frames_skipped += 1
+
+    def latest_result(self):
+        """FrameResult mới nhất (bỏ qua các kết quả cũ hơn), None nếu chưa có"""
+        result = None
+        while True:
+            try:
+                result = self._outbox.get_nowait()
+            except queue.Empty:
+                return result
+
+    # =====================================================
+    def run_once(self, frame_bgr, seq=0, handler=None, valid=None):
+        """process() + handler trên cùng thread, rồi báo latency cho scheduler"""
+        start = time.perf_counter()
+        result = self.process(frame_bgr, seq, valid)
+        if result.dropped:
+            return result
+        if handler is not None:
+            handler_start = time.perf_counter()
+            result.view = handler(result)
+            result.stages["handler"] = (time.perf_counter() - handler_start) * 1000
+        if not result.idle:
+            # Frame tĩnh không phản ánh tải → không đưa vào scheduler
+            self.scheduler.observe((time.perf_counter() - start) * 1000, result.stages)
+        return result
+
+    def process(self, frame_bgr, seq=0, valid=None):
+        """
+        Xử lý đồng bộ một frame: detection / tracking + embedding + anti-spoofing.
+
+        valid: với frame là view zero-copy (SharedCameraReader), hàm không tham số
+        trả về False khi writer đã ghi đè slot. Được kiểm tra sau mỗi lần đọc
+        frame_bgr (motion gate, đổi sang RGB, anti-spoofing) - detect / embed
+        chạy trên bản RGB riêng. Frame bị ghi đè → kết quả dropped, liveness
+        không được ghi vào track, handler không chạy.
+        """
+        start = time.perf_counter()
+        self.frame_index += 1
+        self.stats["frames"] += 1
+        config = self.scheduler.current
+        stages = {}
+
+        if self.cache and self.motion_gate is not None and not self.motion_gate.check(frame_bgr):
+            if valid is not None and not valid():
+                return self._dropped(seq, frame_bgr, start)
+            # Cảnh tĩnh: giữ nguyên box / cache của track, không chạy model nào
+            self.stats["idle_skipped"] += 1
+            self._was_idle = True
+            tracks = self.tracker.active_tracks()
+            results = [FaceResult(track) for track in tracks]
+            return FrameResult(seq, frame_bgr, results, self._spoof_info_from_tracks(tracks),
+                               (time.perf_counter() - start) * 1000, idle=True)
+
+        # Frame đầu tiên sau một đoạn tĩnh luôn detect lại
+        detect_now = (not self.cache
+                      or self._was_idle
+                      or not self.tracker.tracks
+                      or self.frame_index % config["detect_interval"] == 0)
+        self._was_idle = False
+        if not detect_now:
+            # Frame giữa hai lần detect: chỉ predict box, dùng cache của track
+            self.stats["detect_skipped"] += 1
+            tracks = self.tracker.predict()
+            results = [FaceResult(track) for track in tracks]
+            return FrameResult(seq, frame_bgr, results, self._spoof_info_from_tracks(tracks),
+                               (time.perf_counter() - start) * 1000)
+
+        t = time.perf_counter()
+        scale = config["scale"]
+        frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+        if valid is not None and not valid():
+            return self._dropped(seq, frame_bgr, start)
+        small = cv2.resize(frame_rgb, None, fx=scale, fy=scale) if scale != 1.0 else frame_rgb
+        detections = self.faces.detect(
+            small, input_size=(config["det_size"], config["det_size"]))
+        self.stats["detections"] += 1
+
+        boxes = np.array([face.bbox for face in detections], dtype=np.float32).reshape(-1, 4)
+        scores = np.array([face.det_score for face in detections], dtype=np.float32)
+        tracks = self.tracker.update(boxes / scale, scores, detections)
+        stages["detect"] = (time.perf_counter() - t) * 1000
+
+        # ========== ANTI-SPOOF: chỉ cho track cần kết luận liveness mới ==========
+        t = time.perf_counter()
+        spoof_info = None
+        pending = [track for track in tracks
+                   if not self.cache or track.needs_liveness(self.frame_index,
+                                                             config["liveness_refresh"])]
+        self.stats["liveness_cached"] += len(tracks) - len(pending)
+        if pending and self.liveness_mode == "roi":
+            verdicts = self.anti_spoof.detect_spoof_rois(
+                frame_bgr, [tuple(int(v) for v in track.bbox) for track in pending])
+            self.stats["liveness"] += 1
+            if valid is not None and not valid():
+                return self._dropped(seq, frame_bgr, start)
+            for track, (is_real, conf, _) in zip(pending, verdicts):
+                track.set_liveness(is_real, conf, self.frame_index)
+        elif pending:
+            # YOLO trên FULL FRAME rồi ghép box "real" với từng mặt
+            spoof_info = self.anti_spoof.detect_spoof(frame_bgr)
+            self.stats["liveness"] += 1
+            if valid is not None and not valid():
+                return self._dropped(seq, frame_bgr, start)
+            for track in tracks:
+                is_real, real_conf = self._verify_real(
+                    tuple(int(v) for v in track.bbox), spoof_info["real_boxes"])
+                track.set_liveness(is_real, real_conf, self.frame_index)
+        if pending:
+            stages["liveness"] = (time.perf_counter() - t) * 1000
+
+        # ========== ArcFace chỉ cho track thật cần embed ==========
+        t = time.perf_counter()
+        to_embed = []
+        for track in tracks:
+            if track.is_real and (not self.cache or track.needs_embedding(
+                    self.frame_index, self.embed_refresh)):
+                to_embed.append(track)
+            elif track.is_real:
+                self.stats["embed_cached"] += 1
+        if to_embed:
+            self.faces.embed(small, [track.detection for track in to_embed])
+            for track in to_embed:
+                track.embedding = track.detection.normed_embedding
+                track.embedded_at = self.frame_index
+            self.stats["embeddings"] += len(to_embed)
+            stages["embed"] = (time.perf_counter() - t) * 1000
+        results = [FaceResult(track, track.detection) for track in tracks]
+
+        if spoof_info is None:
+            spoof_info = self._spoof_info_from_tracks(tracks)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        return FrameResult(seq, frame_bgr, results, spoof_info, latency_ms, stages)
+
+    def _dropped(self, seq, frame_bgr, start):
+        # Track giữ nguyên kết luận liveness / embedding cũ, frame sau làm lại
+        self.stats["torn"] += 1
+        return FrameResult(seq, frame_bgr, [], self._spoof_info_from_tracks([]),
+                           (time.perf_counter() - start) * 1000, dropped=True)
+
+    @staticmethod
+    def _spoof_info_from_tracks(tracks):
+        """spoof_info (cùng dạng detect_spoof) dựng từ liveness đã cache trên track"""
+        detections, real_boxes, fake_boxes = [], [], []
+        for track in tracks:
+            if track.is_real is None:
+                continue
+            x1, y1, x2, y2 = (int(v) for v in track.bbox)
+            label = "real" if track.is_real else "fake"
+            detections.append({'bbox': (x1, y1, x2, y2), 'conf': track.real_conf,
+                               'label': label, 'class_id': int(track.is_real)})
+            (real_boxes if track.is_real else fake_boxes).append(
+                (x1, y1, x2, y2, track.real_conf))
+        return {
+            'detections': detections,
+            'has_real': len(real_boxes) > 0,
+            'max_real_conf': max((box[4] for box in real_boxes), default=0.0),
+            'real_boxes': real_boxes,
+            'fake_boxes': fake_boxes
+        }
+
+    @staticmethod
+    def _verify_real(bbox, real_boxes):
+        """Kiểm tra overlap với ít nhất một box "real" từ YOLO"""
+        left, top, right, bottom = bbox
+        for rx1, ry1, rx2, ry2, rconf in real_boxes:
+            # Overlap đơn giản (có giao nhau đáng kể)
+            if left < rx2 and right > rx1 and top < ry2 and bottom > ry1:
+                return True, rconf
+        return False, 0.0
+
+    # =====================================================
+    def _worker(self):
+        while self._running:
+            try:
+                seq, frame = self._inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                result = self.run_once(frame, seq, self._handler)
+            except Exception as e:
+                print(f"⚠ Lỗi xử lý frame {seq}: {e}")
+                continue
+
+            self.frames_processed += 1
+            self._post(result)
+
+    def _post(self, result):
+        # UI chỉ cần kết quả mới nhất → bỏ kết quả cũ nếu UI chưa kịp lấy
+        while True:
+            try:
+                self._outbox.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self._outbox.get_nowait()
+                except queue.Empty:
+                    pass
+
+    @staticmethod
+    def _drain(q):
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+
+def draw_overlays(img_bgr, overlays):
+    """
+    Vẽ overlay do handler trả về lên frame (tại chỗ).
+    overlay: dict {"bbox", "color", "thickness", "labels": [(text, dy, scale, color)]}
+    color = None → chỉ vẽ label, không vẽ khung.
+    """
+    for overlay in overlays:
+        left, top, right, bottom = overlay["bbox"]
+        if overlay["color"] is not None:
+            cv2.rectangle(img_bgr, (left, top), (right, bottom),
+                          overlay["color"], overlay.get("thickness", 2))
+        for text, dy, scale, color in overlay.get("labels", ()):
+            cv2.putText(img_bgr, text, (left, max(top - dy, 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, scale, color, 2)
+    return img_bgr
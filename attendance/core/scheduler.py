@@ -0,0 +1,91 @@
+import time
+
+
+class AdaptiveScheduler:
+    """
+    Điều chỉnh cấu hình pipeline theo ngân sách latency đo được lúc chạy.
+
+    Đo EWMA latency từng stage (detect, liveness, embed) và tổng mỗi frame,
+    rồi chọn một mức trong LEVELS (từ chất lượng cao → rẻ nhất):
+        - quá ngân sách (> budget * step_down_ratio) → xuống một mức
+        - dư nhiều (< budget * step_up_ratio) → lên một mức
+    Mỗi lần đổi mức phải chờ đủ `window` frame để tránh dao động.
+    """
+
+    # detect_interval, scale (resize trước detect), det_size (input SCRFD), liveness_refresh
+    LEVELS = (
+        {"detect_interval": 1, "scale": 1.0, "det_size": 640, "liveness_refresh": 10},
+        {"detect_interval": 2, "scale": 1.0, "det_size": 640, "liveness_refresh": 20},
+        {"detect_interval": 3, "scale": 0.75, "det_size": 480, "liveness_refresh": 30},
+        {"detect_interval": 4, "scale": 0.75, "det_size": 480, "liveness_refresh": 45},
+        {"detect_interval": 5, "scale": 0.5, "det_size": 320, "liveness_refresh": 60},
+        {"detect_interval": 8, "scale": 0.5, "det_size": 320, "liveness_refresh": 90},
+    )
+
+    def __init__(self, target_fps=15.0, start_level=2, window=15, alpha=0.2,
+                 step_down_ratio=1.1, step_up_ratio=0.6, adaptive=True):
+        self.target_fps = target_fps
+        self.budget_ms = 1000.0 / target_fps
+        self.start_level = start_level
+        self.window = window
+        self.alpha = alpha
+        self.step_down_ratio = step_down_ratio
+        self.step_up_ratio = step_up_ratio
+        self.adaptive = adaptive
+        self.reset()
+
+    def reset(self):
+        self.level = self.start_level
+        self.frame_ms = None            # EWMA latency mỗi frame (không tính frame tĩnh)
+        self.stage_ms = {}              # EWMA theo stage
+        self.observed = 0
+        self.since_change = 0
+        self.changes = []               # (time, level cũ, level mới, frame_ms)
+
+    @property
+    def current(self):
+        return self.LEVELS[self.level]
+
+    # =====================================================
+    def observe(self, frame_ms, stages=None):
+        """Ghi nhận latency một frame vừa xử lý. stages: {stage: ms} nếu stage có chạy."""
+        self.frame_ms = self._ewma(self.frame_ms, frame_ms)
+        for stage, ms in (stages or {}).items():
+            self.stage_ms[stage] = self._ewma(self.stage_ms.get(stage), ms)
+
+        self.observed += 1
+        self.since_change += 1
+        if self.adaptive and self.since_change >= self.window:
+            self._adjust()
+
+    def _ewma(self, old, value):
+        return value if old is None else old + self.alpha * (value - old)
+
+    def _adjust(self):
+        level = self.level
+        if self.frame_ms > self.budget_ms * self.step_down_ratio:
+            level = min(level + 1, len(self.LEVELS) - 1)
+        elif self.frame_ms < self.budget_ms * self.step_up_ratio:
+            level = max(level - 1, 0)
+
+        if level != self.level:
+            self.changes.append((time.time(), self.level, level, round(self.frame_ms, 2)))
+            self.changes = self.changes[-20:]
+            print(f"⚙ Scheduler: level {self.level} → {level} "
+                  f"(frame {self.frame_ms:.1f}ms / budget {self.budget_ms:.1f}ms) {self.LEVELS[level]}")
+            self.level = level
+        self.since_change = 0
+
+    # =====================================================
+    def snapshot(self):
+        """Quyết định hiện tại + số đo để monitor"""
+        return {
+            "level": self.level,
+            "decisions": dict(self.current),
+            "target_fps": self.target_fps,
+            "budget_ms": round(self.budget_ms, 2),
+            "frame_ms": round(self.frame_ms, 2) if self.frame_ms is not None else None,
+            "stage_ms": {stage: round(ms, 2) for stage, ms in self.stage_ms.items()},
+            "observed": self.observed,
+            "changes": list(self.changes),
+        }
@@ -0,0 +1,207 @@
+import hashlib
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from core.model_variants import INT8_DIR, int8_variant
+
+CACHE_DIR = os.path.join("models", "ort_cache")
+
+
+@dataclass(frozen=True)
+class SessionProfile:
+    """
+    Cấu hình ONNX Runtime áp cho mọi model InsightFace (SCRFD, ArcFace...)
+    và số thread torch của YOLO anti-spoofing.
+
+    0 thread = để ONNX Runtime tự chọn (mặc định của InsightFace: bằng số core
+    vật lý cho từng session → detector và YOLO giành core của nhau).
+    cpu_affinity: danh sách core (0-based) ghim process và thread intra-op.
+    optimize_cache: lưu graph đã tối ưu (optimized_model_filepath), lần
+    khởi động sau load thẳng graph đó và tắt bước tối ưu.
+    int8_max_drift: load bản INT8 (quantize_models.py) của model nào có drift
+    p95 ≤ ngưỡng này; None = luôn FP32.
+    extra_config: session config entry thêm (dict hoặc cặp key/value), lưu
+    thành tuple đã sắp xếp → tham gia so sánh / hash như các trường khác, hai
+    profile chỉ khác extra_config không dùng chung session trong ModelPool.
+    """
+
+    name: str = "default"
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    execution_mode: str = "sequential"      # sequential / parallel
+    graph_optimization: str = "all"         # disable / basic / extended / all
+    cpu_affinity: Optional[tuple] = None
+    torch_threads: int = 0                  # YOLO (ultralytics / torch), 0 = mặc định
+    optimize_cache: bool = True
+    cache_dir: str = CACHE_DIR
+    int8_max_drift: Optional[float] = None
+    int8_dir: str = INT8_DIR
+    extra_config: tuple = ()
+
+    def __post_init__(self):
+        items = self.extra_config.items() if isinstance(self.extra_config, dict) else self.extra_config
+        object.__setattr__(self, "extra_config",
+                           tuple(sorted((str(k), str(v)) for k, v in items)))
+
+    # =====================================================
+    def session_options(self, model_path):
+        """(SessionOptions, đường dẫn model cần load) cho một file .onnx"""
+        import onnxruntime as ort
+
+        if self.int8_max_drift is not None:
+            model_path = int8_variant(model_path, self.int8_max_drift, self.int8_dir) or model_path
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if self.execution_mode == "parallel"
+                                  else ort.ExecutionMode.ORT_SEQUENTIAL)
+        options.graph_optimization_level = GRAPH_LEVELS[self.graph_optimization](ort)
+
+        affinities = self._thread_affinities()
+        if affinities:
+            options.add_session_config_entry("session.intra_op_thread_affinities", affinities)
+        for key, value in self.extra_config:
+            options.add_session_config_entry(key, value)
+
+        if not self.optimize_cache or self.graph_optimization == "disable":
+            return options, model_path
+
+        cached = self.cached_model_path(model_path, ort.__version__)
+        if os.path.exists(cached):
+            # Graph đã tối ưu ở lần chạy trước → bỏ qua bước tối ưu
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return options, cached
+        # Ghi ra file tạm riêng từng process rồi publish bằng os.replace:
+        # nhiều worker khởi động cùng lúc không ghi đè file của nhau
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        options.optimized_model_filepath = f"{cached}.{os.getpid()}.tmp"
+        return options, model_path
+
+    @staticmethod
+    def publish_cache(options):
+        """Gọi sau khi tạo session: đưa graph tối ưu vừa ghi vào cache"""
+        tmp_path = options.optimized_model_filepath
+        if tmp_path and tmp_path.endswith(".tmp") and os.path.exists(tmp_path):
+            os.replace(tmp_path, tmp_path[:tmp_path.rindex(".", 0, -4)])
+
+    def cached_model_path(self, model_path, ort_version):
+        """
+        File cache phụ thuộc model gốc (size, mtime), phiên bản ORT và mức tối ưu.
+        Graph mức "all" có thể chứa kernel riêng của CPU (NCHWc) → cache chỉ
+        dùng trên chính máy đã tạo ra nó, không copy sang máy khác.
+        """
+        stat = os.stat(model_path)
+        key = f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime_ns}|{ort_version}|{self.graph_optimization}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(model_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}.{digest}.opt.onnx")
+
+    def _thread_affinities(self):
+        """
+        ORT ghim thread intra-op 1..n-1 (thread 0 là thread gọi run()) theo
+        chuỗi "p1;p2;..." với processor id bắt đầu từ 1.
+        """
+        if not self.cpu_affinity or self.intra_op_threads < 2:
+            return None
+        cores = list(self.cpu_affinity)
+        threads = min(self.intra_op_threads, len(cores))
+        return ";".join(str(cores[i] + 1) for i in range(1, threads))
+
+    # =====================================================
+    def apply_process(self):
+        """Ghim process hiện tại vào cpu_affinity và đặt số thread torch cho YOLO"""
+        if self.cpu_affinity:
+            set_cpu_affinity(self.cpu_affinity)
+        if self.torch_threads:
+            try:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            except ImportError:
+                pass
+
+    def with_affinity(self, cores):
+        return replace(self, cpu_affinity=tuple(cores) if cores else None)
+
+    def with_int8(self, max_drift):
+        return replace(self, int8_max_drift=None if max_drift is None else float(max_drift))
+
+
+GRAPH_LEVELS = {
+    "disable": lambda ort: ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": lambda ort: ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": lambda ort: ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": lambda ort: ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+PROFILES = {
+    # Hành vi cũ của InsightFace (ORT tự chọn thread) + cache graph tối ưu
+    "default": SessionProfile(),
+    # Một camera / GUI trên máy nhiều core: model chạy tuần tự nên mỗi
+    # session lấy vài core là đủ, chừa core cho YOLO và capture
+    "latency": SessionProfile(name="latency", intra_op_threads=4, inter_op_threads=1,
+                              torch_threads=4),
+    # Nhiều worker trên một máy (service.py): mỗi process ít thread,
+    # tránh oversubscription khi 12 camera cùng chạy
+    "shared": SessionProfile(name="shared", intra_op_threads=2, inter_op_threads=1,
+                             torch_threads=2),
+    # Máy yếu / Raspberry Pi
+    "single": SessionProfile(name="single", intra_op_threads=1, inter_op_threads=1,
+                             torch_threads=1),
+}
+
+
+def get_profile(profile=None):
+    """
+    SessionProfile theo tên (hoặc trả lại chính profile truyền vào).
+    Mặc định đọc biến môi trường FACE_ORT_PROFILE, không có thì "default".
+    FACE_INT8_MAX_DRIFT (vd. 0.02) bật model INT8 cho profile lấy theo tên.
+    """
+    if isinstance(profile, SessionProfile):
+        return profile
+    name = profile or os.environ.get("FACE_ORT_PROFILE", "default")
+    if name not in PROFILES:
+        raise ValueError(f"ORT profile không hỗ trợ: {name}")
+    max_drift = os.environ.get("FACE_INT8_MAX_DRIFT")
+    return PROFILES[name].with_int8(max_drift) if max_drift else PROFILES[name]
+
+
+def set_cpu_affinity(cores):
+    try:
+        import psutil
+        psutil.Process().cpu_affinity(list(cores))
+    except ImportError:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, set(cores))
+        else:
+            print("⚠ Không đặt được CPU affinity (cần psutil)")
+
+
+@contextmanager
+def insightface_sessions(profile):
+    """
+    InsightFace chỉ truyền providers / provider_options khi tạo session
+    (model_zoo.get_model) → tạm thay lớp session của model_zoo để mọi model
+    load trong khối with dùng SessionOptions của profile.
+    Bản INT8 chỉ thay file được load: model_file / model_path vẫn là file FP32
+    (ArcFaceONNX đọc mean/std từ graph gốc, key cache / log không đổi).
+    """
+    from insightface.model_zoo import model_zoo
+
+    original = model_zoo.PickableInferenceSession
+
+    class TunedInferenceSession(original):
+        def __init__(self, model_path, **kwargs):
+            options, load_path = profile.session_options(model_path)
+            kwargs.setdefault("sess_options", options)
+            original.__init__(self, load_path, **kwargs)
+            profile.publish_cache(options)
+            self.model_path = model_path
+
+    model_zoo.PickableInferenceSession = TunedInferenceSession
+    try:
+        yield
+    finally:
+        model_zoo.PickableInferenceSession = original
@@ -0,0 +1,277 @@
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class SharedFrameRing:
+    """
+    Ring buffer frame trong multiprocessing.shared_memory - chuyển frame giữa
+    process capture và process inference mà không pickle / copy qua Queue.
+
+    Layout một block (offset căn 64 byte):
+        header  int64[8]:  magic, slots, h, w, c, write_seq, closed, _
+        seqs    int64[slots]:    seq của frame trong từng slot (-1 = đang ghi)
+        stamps  float64[slots]:  time.monotonic() lúc capture
+        frames  uint8[slots, h, w, c]
+
+    Một writer duy nhất: frame seq ghi vào slot seq % slots. Reader lấy view
+    thẳng vào slot (zero-copy); view còn hợp lệ tới khi writer ghi vòng lại
+    slot đó (sau slots - 1 frame nữa) - kiểm tra bằng valid(seq).
+    """
+
+    MAGIC = 0x46524D52      # "FRMR"
+    HEADER = 8
+    _WRITE_SEQ, _CLOSED = 5, 6
+
+    def __init__(self, name=None, shape=(480, 640, 3), slots=4, create=False):
+        if create:
+            h, w, c = shape
+            size = self._layout(slots, h, w, c)[-1]
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = self._attach(name)
+        self.owner = create
+
+        header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            header[:] = (self.MAGIC, slots, h, w, c, 0, 0, 0)
+        elif header[0] != self.MAGIC:
+            raise ValueError(f"Shared memory {name} không phải SharedFrameRing")
+
+        self.slots, h, w, c = (int(v) for v in header[1:5])
+        self.shape = (h, w, c)
+        seqs_at, stamps_at, frames_at, _ = self._layout(self.slots, h, w, c)
+        self.header = header
+        self.seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=self.shm.buf, offset=seqs_at)
+        self.stamps = np.ndarray((self.slots,), dtype=np.float64, buffer=self.shm.buf, offset=stamps_at)
+        self.frames = np.ndarray((self.slots, h, w, c), dtype=np.uint8,
+                                 buffer=self.shm.buf, offset=frames_at)
+        if create:
+            self.seqs[:] = -1
+
+    @classmethod
+    def _layout(cls, slots, h, w, c):
+        def align(n):
+            return (n + 63) // 64 * 64
+        seqs_at = align(cls.HEADER * 8)
+        stamps_at = align(seqs_at + slots * 8)
+        frames_at = align(stamps_at + slots * 8)
+        return seqs_at, stamps_at, frames_at, frames_at + slots * h * w * c
+
+    @staticmethod
+    def _attach(name):
+        # Process con tạo bằng multiprocessing dùng chung resource_tracker với
+        # process tạo block nên attach bình thường là đủ; Python 3.13+ thì
+        # tắt hẳn tracking cho phía attach
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            return shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def write_seq(self):
+        return int(self.header[self._WRITE_SEQ])
+
+    @property
+    def closed(self):
+        return bool(self.header[self._CLOSED])
+
+    # =====================================================
+    def write(self, frame, timestamp=None):
+        """Ghi frame vào slot kế tiếp (chỉ một writer). Trả về seq của frame."""
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]))
+        seq = self.write_seq + 1
+        slot = seq % self.slots
+        self.seqs[slot] = -1                # reader bỏ qua slot đang ghi
+        self.frames[slot] = frame
+        self.stamps[slot] = time.monotonic() if timestamp is None else timestamp
+        self.seqs[slot] = seq
+        self.header[self._WRITE_SEQ] = seq
+        return seq
+
+    def get(self, seq, copy=False):
+        """(timestamp, frame) của seq, None nếu slot đã bị ghi đè"""
+        slot = seq % self.slots
+        if self.seqs[slot] != seq:
+            return None
+        frame = self.frames[slot].copy() if copy else self.frames[slot]
+        timestamp = float(self.stamps[slot])
+        return (timestamp, frame) if self.seqs[slot] == seq else None
+
+    def valid(self, seq):
+        """View của frame seq vẫn chưa bị writer ghi đè"""
+        return self.seqs[seq % self.slots] == seq
+
+    def mark_closed(self):
+        self.header[self._CLOSED] = 1
+
+    def close(self):
+        # Bỏ reference tới buffer trước khi đóng, tránh BufferError
+        self.header = self.seqs = self.stamps = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Nơi gọi còn giữ view frame (zero-copy) → để GC đóng mmap sau
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+# =====================================================
+def capture_to_ring(src, ring_name, width=640, height=480, stop=None, max_failures=50):
+    """Target của process capture: đọc camera và ghi vào SharedFrameRing"""
+    from core.camera import Camera
+
+    ring = SharedFrameRing(ring_name)
+    camera = Camera(src, width=width, height=height, threaded=False)
+    failures = 0
+    try:
+        while stop is None or not stop.is_set():
+            frame = camera.read()
+            if frame is None:
+                failures += 1
+                if failures >= max_failures:
+                    print("⚠ Camera không trả frame, dừng process capture")
+                    break
+                time.sleep(0.01)
+                continue
+            failures = 0
+            ring.write(frame, camera.last_timestamp)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.mark_closed()
+        camera.release()
+        ring.close()
+
+
+class SharedCameraReader:
+    """
+    Giao diện giống Camera(threaded=True) nhưng frame do một process capture
+    riêng ghi vào SharedFrameRing. read() / lease() trả về view zero-copy vào
+    slot; view chỉ đúng tới khi writer ghi vòng lại slot đó (sau slots frame).
+    lease() trả kèm hàm valid() - RecognitionEngine.process(..., valid) kiểm
+    tra sau mỗi lần đọc frame và bỏ kết quả nếu slot đã bị ghi đè (seqlock),
+    không copy frame. Chọn slots ≥ fps camera × latency inference tối đa
+    (mặc định 8: ~260 ms ở 30 fps) để việc bỏ frame hiếm khi xảy ra; thống kê
+    ở engine.stats["torn"]. read(copy=True) khi cần giữ frame lâu hơn.
+
+    Dùng spawn() để tạo ring + process capture; release() dừng process và
+    giải phóng shared memory.
+    """
+
+    threaded = True
+    zero_copy = True
+
+    def __init__(self, ring, process=None, stop=None, poll_interval=0.002):
+        self.ring = ring
+        self.process = process
+        self._stop = stop
+        self.poll_interval = poll_interval
+        self._start_seq = self._last_seq = ring.write_seq
+        self.frames_dropped = 0
+        self.last_timestamp = None
+
+    @classmethod
+    def spawn(cls, src=0, width=640, height=480, slots=8, ctx=None):
+        ctx = ctx or mp.get_context("spawn")
+        ring = SharedFrameRing(shape=(height, width, 3), slots=slots, create=True)
+        stop = ctx.Event()
+        process = ctx.Process(target=capture_to_ring, args=(src, ring.name, width, height, stop),
+                              name=f"capture-{src}", daemon=True)
+        process.start()
+        return cls(ring, process, stop)
+
+    # =====================================================
+    @property
+    def is_running(self):
+        if self.ring.frames is None:
+            return False
+        if self.ring.closed:
+            return self._has_new()      # writer đã dừng, vẫn đọc nốt frame cuối
+        return self.process is None or self.process.is_alive()
+
+    @property
+    def pending(self):
+        return min(self.ring.write_seq - self._last_seq, self.ring.slots)
+
+    @property
+    def frames_captured(self):
+        """Số frame writer đã ghi kể từ lúc mở reader"""
+        return self.ring.write_seq - self._start_seq if self.ring.frames is not None else 0
+
+    @property
+    def stats(self):
+        return {
+            "captured": self.frames_captured,
+            "dropped": self.frames_dropped,
+            "pending": self.pending,
+            "last_timestamp": self.last_timestamp,
+        }
+
+    def _has_new(self):
+        return self.ring.write_seq > self._last_seq
+
+    # =====================================================
+    def read(self, timeout=0, copy=False):
+        item = self.read_latest(timeout, copy)
+        return item[2] if item is not None else None
+
+    def read_latest(self, timeout=0, copy=False):
+        """(seq, timestamp, frame) mới nhất chưa đọc, None nếu không có"""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._has_new():
+                seq = self.ring.write_seq
+                item = self.ring.get(seq, copy)
+                if item is not None:
+                    self.frames_dropped += seq - self._last_seq - 1
+                    self._last_seq = seq
+                    self.last_timestamp = item[0]
+                    return seq, item[0], item[1]
+            if time.monotonic() >= deadline or not self.is_running:
+                return None
+            time.sleep(self.poll_interval)
+
+    def recent(self, n=None, copy=False):
+        """Tối đa n frame gần nhất còn trong ring (cũ → mới), không đánh dấu đã đọc"""
+        newest = self.ring.write_seq
+        items = []
+        for seq in range(max(newest - self.ring.slots + 1, 1), newest + 1):
+            item = self.ring.get(seq, copy)
+            if item is not None:
+                items.append((seq, item[0], item[1]))
+        return items[-n:] if n else items
+
+    def valid(self, seq):
+        return self.ring.valid(seq)
+
+    def lease(self, timeout=0):
+        """
+        (frame view, valid) của frame mới nhất chưa đọc, None nếu không có.
+        valid() = False khi writer đã ghi đè slot → bỏ mọi kết quả tính từ frame.
+        """
+        item = self.read_latest(timeout)
+        if item is None:
+            return None
+        seq = item[0]
+        return item[2], lambda: self.ring.valid(seq)
+
+    # =====================================================
+    def release(self):
+        if self._stop is not None:
+            self._stop.set()
+        if self.process is not None:
+            self.process.join(timeout=2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.ring.frames is not None:
+            self.ring.close()
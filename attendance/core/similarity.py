@@ -0,0 +1,181 @@
+import os
+import time
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+
+class NumpyKernel:
+    """Inner product bằng NumPy/BLAS - luôn có sẵn, nhanh nhất cho float32 GEMM"""
+
+    name = "numpy"
+
+    def dot(self, queries, matrix, scale=None):
+        """
+        (N, dim) x (M, dim) → (N, M) float32
+        scale: (dim,) scale của code int8 (x ≈ code * scale), None = matrix là giá trị thật
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if scale is not None:
+            # <q, code * scale> = <q * scale, code>
+            queries = queries * scale
+        if matrix.dtype != np.float32:
+            # BLAS không có GEMM int8/float16 → đổi sang float32 rồi nhân
+            matrix = matrix.astype(np.float32)
+        return queries @ matrix.T
+
+
+class SimsimdKernel:
+    """
+    Inner product bằng SimSIMD (AVX2/AVX-512/NEON) trên f32/f16/i8.
+    Với ma trận int8, scale của code được gộp vào query rồi lượng tử hoá int8 theo
+    từng dòng đúng một lần, kết quả nhân lại scale của dòng.
+    """
+
+    name = "simsimd"
+
+    def __init__(self, threads=0):
+        if simsimd is None:
+            raise ImportError("simsimd chưa được cài (pip install simsimd)")
+        self.threads = threads      # 0 = dùng tất cả core
+
+    def dot(self, queries, matrix, scale=None):
+        """
+        (N, dim) x (M, dim) → (N, M) float32
+        scale: (dim,) scale của code int8 (x ≈ code * scale), None = matrix là giá trị thật
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        matrix = np.ascontiguousarray(matrix)
+        if len(queries) == 0 or len(matrix) == 0:
+            return np.zeros((len(queries), len(matrix)), dtype=np.float32)
+
+        row_scale = None
+        if matrix.dtype == np.int8:
+            if scale is not None:
+                queries = queries * scale
+            row_scale = np.maximum(np.abs(queries).max(axis=1, keepdims=True), 1e-10) / 127.0
+            queries = np.clip(np.rint(queries / row_scale), -127, 127).astype(np.int8)
+        elif matrix.dtype == np.float16:
+            queries = queries.astype(np.float16)
+        elif matrix.dtype != np.float32:
+            matrix = matrix.astype(np.float32)
+
+        sims = np.asarray(simsimd.cdist(np.ascontiguousarray(queries), matrix,
+                                        metric="dot", threads=self.threads),
+                          dtype=np.float32)
+        return sims * row_scale if row_scale is not None else sims
+
+
+class AutoKernel:
+    """
+    Chọn kernel nhanh hơn trên CPU hiện tại cho từng dtype.
+    Lần đầu gặp một dtype sẽ đo nhanh NumPy vs SimSIMD (vài chục ms) rồi cache lại.
+    """
+
+    name = "auto"
+    CALIBRATION_SHAPE = (16, 4096)      # (queries, rows) dùng để đo
+
+    def __init__(self):
+        self.candidates = [NumpyKernel()]
+        if simsimd is not None:
+            self.candidates.append(SimsimdKernel())
+        self.choice = {}                # dtype -> kernel
+
+    def dot(self, queries, matrix, scale=None):
+        kernel = self.choice.get(matrix.dtype)
+        if kernel is None:
+            kernel = self._calibrate(matrix.dtype, queries.shape[1])
+        return kernel.dot(queries, matrix, scale)
+
+    def _calibrate(self, dtype, dim):
+        if len(self.candidates) == 1:
+            kernel = self.candidates[0]
+        else:
+            queries, matrix = _random_operands(*self.CALIBRATION_SHAPE, dim, dtype)
+            kernel = min(self.candidates,
+                         key=lambda k: _time_dot(k, queries, matrix, repeats=3))
+        self.choice[dtype] = kernel
+        return kernel
+
+
+KERNELS = {
+    NumpyKernel.name: NumpyKernel,
+    SimsimdKernel.name: SimsimdKernel,
+    AutoKernel.name: AutoKernel,
+}
+
+_instances = {}
+
+
+def get_kernel(name=None):
+    """
+    Lấy kernel theo tên ("numpy", "simsimd", "auto").
+    Mặc định đọc biến môi trường FACE_SIM_KERNEL, không có thì "auto".
+    simsimd không cài được → fallback NumPy.
+    """
+    name = name or os.environ.get("FACE_SIM_KERNEL", "auto")
+    if name not in KERNELS:
+        raise ValueError(f"Similarity kernel không hỗ trợ: {name}")
+
+    if name not in _instances:
+        try:
+            _instances[name] = KERNELS[name]()
+        except ImportError as e:
+            print(f"⚠ {e} → dùng NumPy kernel")
+            _instances[name] = NumpyKernel()
+    return _instances[name]
+
+
+# =====================================================
+def _random_operands(n_queries, n_rows, dim, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+    matrix = rng.standard_normal((n_rows, dim)).astype(np.float32)
+    if np.dtype(dtype) == np.int8:
+        return queries, np.clip(np.rint(matrix * 40), -127, 127).astype(np.int8)
+    return queries, matrix.astype(dtype)
+
+
+def _time_dot(kernel, queries, matrix, repeats):
+    """Thời gian trung bình (ms) của kernel.dot, đã warm-up"""
+    kernel.dot(queries, matrix)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        kernel.dot(queries, matrix)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def benchmark(n_queries=32, n_rows=50000, dim=512, repeats=5):
+    """
+    Đo thời gian inner product (n_queries x n_rows) cho từng kernel và dtype.
+
+    Returns:
+        dict {dtype: {kernel_name: ms trung bình}}
+    """
+    kernels = [NumpyKernel()]
+    if simsimd is not None:
+        kernels.append(SimsimdKernel())
+
+    results = {}
+    for dtype in ("float32", "float16", "int8"):
+        queries, matrix = _random_operands(n_queries, n_rows, dim, dtype)
+        results[dtype] = {
+            kernel.name: _time_dot(kernel, queries, matrix, repeats)
+            for kernel in kernels
+        }
+    return results
+
+
+if __name__ == "__main__":
+    # Chạy: python -m core.similarity (từ thư mục attendance)
+    results = benchmark()
+    print(f"simsimd: {'có' if simsimd is not None else 'không có'}"
+          + (f" - capabilities: {[k for k, v in simsimd.get_capabilities().items() if v]}"
+             if simsimd is not None else ""))
+    for dtype, timings in results.items():
+        winner = min(timings, key=timings.get)
+        cells = "  ".join(f"{name}: {ms:8.2f} ms" for name, ms in timings.items())
+        print(f"{dtype:>8}  {cells}  → {winner}")
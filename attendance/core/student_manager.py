@@ -1,25 +1,19 @@
-import os
-import pickle
-import shutil
-from tkinter import messagebox
+from core.embedding_store import EmbeddingStore
 
 
 class StudentManager:
     def __init__(self, db_path="database/embeddings.pkl", controller=None):
         self.db_path = db_path
+        self.store = EmbeddingStore(db_path)
         self.students = self._load_students()
         self.controller = controller
 
     def _load_students(self):
-        """Hàm nội bộ load dữ liệu, có thể gọi lại khi cần"""
-        if not os.path.exists(self.db_path):
-            return []
+        """Hàm nội bộ load metadata (không kèm embedding), có thể gọi lại khi cần"""
         try:
-            with open(self.db_path, "rb") as f:
-                data = pickle.load(f)
-            return data
+            return self.store.records()
         except Exception as e:
-            print(f"Lỗi đọc embeddings.pkl: {e}")
+            print(f"Lỗi đọc embedding store: {e}")
             return []
 
     def reload(self):
@@ -40,45 +34,23 @@ class StudentManager:
         if not self.students:
             return False
 
-        # Backup file cũ
-        backup_path = self.db_path + ".backup"
-        try:
-            if os.path.exists(self.db_path):
-                shutil.copy2(self.db_path, backup_path)
-        except Exception as e:
-            print(f"Không backup được: {e}")
-
-        # Lọc bỏ nhân viên
-        original_count = len(self.students)
-        self.students = [s for s in self.students  if str(s["id"]) != str(student_id)]
-
-        if len(self.students) == original_count:
-            print("❌ Không tìm thấy nhân viên để xóa")
-            return False
-        
-        # Ghi đè file
+        # Store ghi file thế hệ mới rồi mới thay meta → không cần backup thủ công
         try:
-            with open(self.db_path, "wb") as f:
-                pickle.dump(self.students, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if not self.store.remove(student_id):
+                print("❌ Không tìm thấy nhân viên để xóa")
+                return False
             self.reload()
 
             try:
                 if self.controller and hasattr(self.controller, 'face_matcher'):
-                    self.controller.face_matcher.reload()
-                    print(f"Đã reload FaceMatcher sau khi xóa {student_id}")
+                    self.controller.face_matcher.remove(student_id)
+                    print(f"Đã cập nhật FaceMatcher sau khi xóa {student_id}")
             except Exception as e:
                 print(
-                    f"Không reload được FaceMatcher: {e} (sẽ reload khi restart)")
+                    f"Không cập nhật được FaceMatcher: {e} (sẽ reload khi restart)")
 
             return True
 
         except Exception as e:
             print(f"Lỗi ghi file khi xóa {student_id}: {e}")
-            # Phục hồi từ backup nếu có
-            if os.path.exists(backup_path):
-                try:
-                    shutil.copy2(backup_path, self.db_path)
-                    print("Đã khôi phục từ backup")
-                except:
-                    pass
             return False
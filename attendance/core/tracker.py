@@ -0,0 +1,193 @@
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """IoU giữa hai tập box (N, 4) và (M, 4) dạng (x1, y1, x2, y2) → (N, M)"""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class KalmanBox:
+    """
+    Kalman filter vận tốc không đổi cho một bbox (kiểu SORT).
+    State: [cx, cy, s, r, vcx, vcy, vs] - s = diện tích, r = tỉ lệ w/h (coi như cố định).
+    """
+
+    F = np.eye(7, dtype=np.float64)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1.0
+    H = np.eye(4, 7, dtype=np.float64)
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+
+    def __init__(self, bbox):
+        self.x = np.zeros(7)
+        self.x[:4] = self._to_z(bbox)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+
+    @staticmethod
+    def _to_z(bbox):
+        x1, y1, x2, y2 = bbox[:4]
+        w, h = max(x2 - x1, 1.0), max(y2 - y1, 1.0)
+        return np.array([x1 + w / 2, y1 + h / 2, w * h, w / h])
+
+    def bbox(self):
+        cx, cy, s, r = self.x[:4]
+        s = max(s, 1.0)
+        w = np.sqrt(s * r)
+        h = s / max(w, 1e-6)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self):
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0.0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.bbox()
+
+    def update(self, bbox):
+        y = self._to_z(bbox) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+
+
+class Track:
+    """
+    Một khuôn mặt được theo dõi qua nhiều frame.
+    Cache danh tính (identity) và liveness để không phải embed / chạy
+    anti-spoofing lại ở mỗi frame.
+    """
+
+    def __init__(self, track_id, bbox, score):
+        self.track_id = track_id
+        self.kalman = KalmanBox(bbox)
+        self.bbox = np.asarray(bbox[:4], dtype=np.float32)
+        self.score = float(score)
+        self.hits = 1               # số lần khớp detection
+        self.misses = 0             # số lần detect liên tiếp không khớp
+        self.detection = None       # dữ liệu detection của frame hiện tại (bbox, kps, score ở ảnh detect)
+
+        # ===== Cache =====
+        self.embedding = None       # normed embedding gần nhất
+        self.embedded_at = None     # frame index lúc embed
+        self.identity = None        # (student_id, name, similarity) từ lần match gần nhất
+        self.identity_confident = False
+        self.is_real = None         # None = chưa kiểm tra liveness
+        self.real_conf = 0.0        # conf của kết luận liveness gần nhất
+        self.liveness_at = None
+
+    @property
+    def updated(self):
+        """Track khớp detection ở frame hiện tại (có kps mới để embed)"""
+        return self.detection is not None
+
+    def set_identity(self, identity, confident):
+        self.identity = identity
+        self.identity_confident = bool(confident)
+
+    def set_liveness(self, is_real, real_conf, frame_index):
+        self.is_real = bool(is_real)
+        self.real_conf = float(real_conf)
+        self.liveness_at = frame_index
+
+    def needs_embedding(self, frame_index, refresh_interval):
+        """Embed lại nếu track mới, danh tính chưa chắc chắn hoặc cache đã cũ"""
+        return (self.embedding is None
+                or not self.identity_confident
+                or frame_index - self.embedded_at >= refresh_interval)
+
+    def needs_liveness(self, frame_index, refresh_interval):
+        """Kiểm tra liveness lại nếu chưa có, chưa là "real" hoặc đã cũ"""
+        return (self.is_real is None
+                or not self.is_real
+                or frame_index - self.liveness_at >= refresh_interval)
+
+
+class FaceTracker:
+    """
+    Multi-object tracker nhẹ cho khuôn mặt: Kalman (vận tốc không đổi) +
+    ghép detection theo IoU (greedy). Giữa các frame detect chỉ predict để
+    box không nhấp nháy; track mất quá max_misses lần detect thì bị xoá.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=3):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self._next_id = 1
+
+    def reset(self):
+        self.tracks = []
+        self._next_id = 1
+
+    def predict(self):
+        """Frame không detect: dự đoán vị trí mới của các track đang hoạt động"""
+        for track in self.tracks:
+            track.bbox = track.kalman.predict().astype(np.float32)
+            track.detection = None
+        return self.active_tracks()
+
+    def update(self, boxes, scores, detections=None):
+        """
+        Frame có detect: ghép detection vào track, tạo track mới cho detection lẻ.
+
+        Args:
+            boxes: (N, 4) bbox toạ độ frame gốc
+            scores: (N,) det score
+            detections: list N phần tử gắn vào track.detection (vd. bbox/kps ở ảnh detect)
+
+        Returns:
+            list Track khớp detection ở frame này
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        predicted = np.array([track.kalman.predict() for track in self.tracks]).reshape(-1, 4)
+        for track in self.tracks:
+            track.detection = None
+
+        matched_tracks, matched_dets = set(), set()
+        if len(self.tracks) and len(boxes):
+            ious = iou_matrix(predicted, boxes)
+            # Greedy: cặp IoU lớn nhất trước
+            for flat in np.argsort(-ious, axis=None):
+                t, d = np.unravel_index(flat, ious.shape)
+                if ious[t, d] < self.iou_threshold:
+                    break
+                if t in matched_tracks or d in matched_dets:
+                    continue
+                matched_tracks.add(t)
+                matched_dets.add(d)
+                track = self.tracks[t]
+                track.kalman.update(boxes[d])
+                track.bbox = boxes[d].copy()
+                track.score = float(scores[d])
+                track.hits += 1
+                track.misses = 0
+                track.detection = detections[d] if detections is not None else True
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                track.bbox = predicted[t].astype(np.float32)
+
+        for d in range(len(boxes)):
+            if d not in matched_dets:
+                track = Track(self._next_id, boxes[d], scores[d])
+                track.detection = detections[d] if detections is not None else True
+                self._next_id += 1
+                self.tracks.append(track)
+
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        return [track for track in self.tracks if track.updated]
+
+    def active_tracks(self):
+        """Track còn khớp ở lần detect gần nhất (dùng để hiển thị)"""
+        return [track for track in self.tracks if track.misses == 0]
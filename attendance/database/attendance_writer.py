@@ -0,0 +1,180 @@
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from database.attendance_db import AttendanceDB
+from database.session_db import SessionDB
+
+
+class AttendanceWriter:
+    """
+    Write-behind cho AttendanceDB.mark_attendance.
+
+    mark_attendance() chỉ đưa lượt chấm công vào hàng đợi và trả về True ngay
+    (kết quả lạc quan) nên vòng lặp frame không chờ SELECT / INSERT / commit.
+    Một thread nền với connection SQLite riêng gom các lượt trong tối đa
+    flush_interval giây (hoặc batch_size lượt) rồi ghi bằng một executemany
+    + một commit. Lượt bị từ chối (phiên không hoạt động, lỗi DB) được báo
+    lại qua callback on_failed(session_id, student_id, reason) và queue
+    `failures` - nơi gọi tự quyết định cho chấm lại hay không. Lượt đã commit
+    được báo qua on_written(session_id, student_id).
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, db_path="database/attendance.db", batch_size=64,
+                 flush_interval=0.5, session_ttl=5.0, on_failed=None, on_written=None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl      # cache kết quả kiểm tra phiên (giây)
+        self.on_failed = on_failed
+        self.on_written = on_written
+
+        self.failures = queue.Queue()       # (session_id, student_id, reason)
+        self.stats = {"queued": 0, "written": 0, "failed": 0, "batches": 0}
+
+        self._queue = queue.Queue()
+        self._submitted = set()             # (session_id, student_id) đã nhận
+        self._lock = threading.Lock()
+        self._session_cache = {}            # session_id → (active, checked_at)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # =====================================================
+    def mark_attendance(self, session_id, student_id, status="present") -> bool:
+        """Giống AttendanceDB.mark_attendance nhưng không chờ ghi DB"""
+        if self._closed:
+            return False
+        key = (str(session_id), str(student_id))
+        with self._lock:
+            if key in self._submitted:
+                return True
+            self._submitted.add(key)
+            self.stats["queued"] += 1
+        # Giờ chấm công lấy lúc nhận diện, không phải lúc ghi
+        self._queue.put((session_id, str(student_id), datetime.now().isoformat(), status))
+        return True
+
+    def flush(self, timeout=5.0):
+        """Chờ các lượt đã xếp hàng được ghi xong. True nếu kịp trong timeout."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Ghi nốt hàng đợi rồi dừng thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((self._STOP, None))
+        self._thread.join(timeout)
+
+    # =====================================================
+    def _run(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        AttendanceDB(conn)                  # đảm bảo bảng attendance đã có
+        session_db = SessionDB(conn)
+
+        running = True
+        while running:
+            batch, waiters, running = self._next_batch()
+            if batch:
+                self._write(conn, session_db, batch)
+            for done in waiters:
+                done.set()
+        conn.close()
+
+    def _next_batch(self):
+        """Gom lượt chấm công: chờ lượt đầu, rồi tối đa flush_interval giây / batch_size lượt"""
+        batch, waiters = [], []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item[0] is self._STOP:
+                # Lấy nốt phần còn lại trong hàng đợi trước khi dừng
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        return batch, waiters, False
+                    if item[0] is self._FLUSH:
+                        waiters.append(item[1])
+                    elif item[0] is not self._STOP:
+                        batch.append(item)
+            if item[0] is self._FLUSH:
+                waiters.append(item[1])
+                return batch, waiters, True
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, waiters, True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, waiters, True
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, waiters, True
+
+    def _session_active(self, session_db, session_id):
+        active, checked_at = self._session_cache.get(session_id, (None, 0.0))
+        if active is None or time.monotonic() - checked_at > self.session_ttl:
+            try:
+                active = session_db._is_session_active(session_id)
+            except Exception as e:
+                print(f"DB error kiểm tra session {session_id}: {e}")
+                active = False
+            self._session_cache[session_id] = (active, time.monotonic())
+        return active
+
+    def _write(self, conn, session_db, batch):
+        rows, failed = [], []
+        for session_id, student_id, marked_at, status in batch:
+            if self._session_active(session_db, session_id):
+                rows.append((session_id, student_id, marked_at, status))
+            else:
+                failed.append((session_id, student_id, "Session chưa bắt đầu hoặc đã kết thúc"))
+
+        if rows:
+            try:
+                conn.executemany("""
+                    INSERT OR IGNORE INTO attendance
+                    (session_id, student_id, time, status)
+                    VALUES (?, ?, ?, ?)
+                """, rows)
+                conn.commit()
+                self.stats["written"] += len(rows)
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"DB error ghi {len(rows)} lượt chấm công: {e}")
+                failed.extend((session_id, student_id, f"DB error: {e}")
+                              for session_id, student_id, _, _ in rows)
+                rows = []
+        self.stats["batches"] += 1
+
+        if self.on_written is not None:
+            for session_id, student_id, _, _ in rows:
+                self._callback(self.on_written, session_id, student_id)
+
+        for session_id, student_id, reason in failed:
+            with self._lock:
+                self._submitted.discard((str(session_id), student_id))
+                self.stats["failed"] += 1
+            self.failures.put((session_id, student_id, reason))
+            if self.on_failed is not None:
+                self._callback(self.on_failed, session_id, student_id, reason)
+
+    @staticmethod
+    def _callback(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"⚠ Lỗi callback {callback.__name__}: {e}")
@@ -19,6 +19,13 @@ class SessionDB:
                 status TEXT DEFAULT 'present'
             )
         """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS session_roster (
+                session_id INTEGER NOT NULL,
+                student_id TEXT NOT NULL,
+                UNIQUE(session_id, student_id)
+            )
+        """)
         self.conn.commit()
 
     def create_session(
@@ -41,6 +48,28 @@ class SessionDB:
         self.conn.commit()
         return self.cursor.lastrowid
 
+    def set_roster(self, session_id: int, student_ids) -> int:
+        """Gán danh sách người thuộc phiên (ghi đè roster cũ)"""
+        self.cursor.execute(
+            "DELETE FROM session_roster WHERE session_id = ?",
+            (session_id,)
+        )
+        self.cursor.executemany("""
+            INSERT OR IGNORE INTO session_roster (session_id, student_id)
+            VALUES (?, ?)
+        """, [(session_id, str(sid)) for sid in student_ids])
+        self.conn.commit()
+        return len(self.get_roster(session_id))
+
+    def get_roster(self, session_id: int) -> list:
+        """Danh sách student_id của phiên, rỗng nếu phiên không giới hạn roster"""
+        self.cursor.execute("""
+            SELECT student_id FROM session_roster
+            WHERE session_id = ?
+            ORDER BY rowid
+        """, (session_id,))
+        return [row[0] for row in self.cursor.fetchall()]
+
     def _is_session_active(self, session_id: int) -> bool:
         self.cursor.execute("""
             SELECT start_time, end_time, status
@@ -1,7 +1,9 @@
 import tkinter as tk
-from tkinter import scrolledtext, messagebox, ttk
+from tkinter import scrolledtext, messagebox, ttk, filedialog
+import csv
 from PIL import Image, ImageTk
 import cv2
+import queue
 from datetime import datetime, timedelta
 
 from gui.scrollable import create_scrollable_page
@@ -9,16 +11,16 @@ from gui.base_ui import BaseFrame
 from core.camera import Camera
 from database.db_connection import DBConnection
 from database.attendance_db import AttendanceDB
+from database.attendance_writer import AttendanceWriter
 from database.session_db import SessionDB
-from core.insightface_singleton import InsightFaceSingleton
-from core.anti_spoofing import AntiSpoofing
+from core.attendance_pipeline import AttendanceRecorder
+from core.recognition_engine import draw_overlays
 
 
 class AttendanceUI(BaseFrame):
     # ================= CONFIG =================
     SIMILARITY_THRESHOLD = 0.45
-    COOLDOWN_MAX = 60
-    DETECT_INTERVAL = 5
+    COOLDOWN_MAX = 60   # tính theo số frame worker đã xử lý
 
     # =========================================
     def __init__(self, parent, controller):
@@ -36,23 +38,20 @@ class AttendanceUI(BaseFrame):
         self.running = False
         self.photo_image = None
         self.frame_count = 0
-        self.cooldown_frames = 0
         self.marked_ids = set()
+        self.roster = None
+        self.recorder = None
+        self.last_result = None
+        self.events = queue.Queue()     # ("marked" | "failed", payload) từ worker / writer
+        self.attendance_writer = None
 
-        # InsightFace
-        self.app = InsightFaceSingleton.get_instance(
-            name="buffalo_l",
-            providers=["CPUExecutionProvider"],
-            det_size=(480, 480),
-            ctx_id=0
-        )
+        # Detection + anti-spoofing chạy trên worker của engine dùng chung
+        self.engine = controller.recognition_engine
 
         self.matcher = controller.face_matcher
         self.attendance_db = AttendanceDB(DBConnection())
         self.session_db = SessionDB(DBConnection())
 
-        self.anti_spoof = AntiSpoofing()
-
     # =====================================================
     def create_placeholder_image(self):
         img = Image.new('RGB', (640, 480), color='#34495e')
@@ -110,6 +109,12 @@ class AttendanceUI(BaseFrame):
             command=self.load_sessions
         ).grid(row=0, column=2, padx=10, pady=10)
 
+        tk.Button(
+            session_frame,
+            text="Gán danh sách",
+            command=self.import_roster
+        ).grid(row=0, column=3, padx=10, pady=10)
+
         # Row 2: Tạo session mới
         tk.Label(
             session_frame,
@@ -297,6 +302,20 @@ class AttendanceUI(BaseFrame):
         total = len(self.marked_ids)
         self.total_label.config(text=f"{total} nhân viên")
 
+    def add_attendance_error(self, student_id, reason):
+        """Lượt chấm công bị từ chối khi ghi DB"""
+        self.attendance_text.config(state="normal")
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.attendance_text.insert("1.0", f"[{timestamp}] ✗ {student_id} - {reason}\n")
+        self.attendance_text.config(state="disabled")
+        self.total_label.config(text=f"{len(self.marked_ids)} nhân viên")
+
+    def on_mark_failed(self, session_id, student_id, reason):
+        """Writer thread: bỏ đánh dấu để có thể chấm lại, báo lỗi về Tk"""
+        if self.recorder is not None:
+            self.recorder.unmark(student_id)
+        self.events.put(("failed", (student_id, reason)))
+
     def load_sessions(self):
         """Tải danh sách session từ DB (ưu tiên session chưa kết thúc)"""
         try:
@@ -374,6 +393,30 @@ class AttendanceUI(BaseFrame):
         except Exception as e:
             messagebox.showerror("Lỗi", f"Không tạo được phiên\n{e}")
 
+    def import_roster(self):
+        """Gán roster cho phiên đang chọn từ file CSV/TXT (cột đầu là Mã NV)"""
+        if self.current_session_id is None:
+            messagebox.showwarning(
+                "Cảnh báo", "Vui lòng chọn hoặc tạo phiên trước!")
+            return
+
+        path = filedialog.askopenfilename(
+            title="Chọn danh sách nhân viên của phiên",
+            filetypes=[("CSV / Text", "*.csv *.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                student_ids = [row[0].strip() for row in csv.reader(f)
+                               if row and row[0].strip()]
+            count = self.session_db.set_roster(self.current_session_id, student_ids)
+            messagebox.showinfo(
+                "Thành công", f"Đã gán {count} nhân viên cho phiên {self.current_session_id}")
+        except Exception as e:
+            messagebox.showerror("Lỗi", f"Không đọc được danh sách\n{e}")
+
     # =====================================================
     def start(self):
         try:
@@ -381,11 +424,25 @@ class AttendanceUI(BaseFrame):
                 messagebox.showwarning(
                     "Cảnh báo", "Vui lòng chọn hoặc tạo phiên trước!")
                 return
-            self.camera = Camera()
+            self.camera = Camera(threaded=True)
             self.running = True
-            self.marked_ids.clear()
-            self.cooldown_frames = 0
             self.frame_count = 0
+            self.last_result = None
+
+            # Roster của phiên → so khớp trên gallery con trước
+            roster_ids = self.session_db.get_roster(self.current_session_id)
+            self.roster = self.matcher.roster_view(roster_ids) if roster_ids else None
+
+            # Logic chấm công chạy trên worker, ghi DB ở thread write-behind,
+            # log đẩy về Tk qua self.events
+            self.attendance_writer = AttendanceWriter(on_failed=self.on_mark_failed)
+            self.recorder = AttendanceRecorder(
+                self.matcher, self.attendance_writer, self.current_session_id,
+                roster=self.roster,
+                threshold=self.SIMILARITY_THRESHOLD,
+                cooldown_max=self.COOLDOWN_MAX,
+                on_marked=lambda *event: self.events.put(("marked", event)))
+            self.marked_ids = self.recorder.marked_ids
 
             # Clear attendance log
             self.attendance_text.config(state="normal")
@@ -404,6 +461,7 @@ class AttendanceUI(BaseFrame):
             print(f"🎯 Starting attendance tracking")
             print(f"{'='*60}\n")
 
+            self.engine.start(self.recorder.process, cache=True)
             self.update_frame()
 
         except Exception as e:
@@ -414,106 +472,42 @@ class AttendanceUI(BaseFrame):
 
     # =====================================================
     def update_frame(self):
+        """Tk thread: chỉ đẩy frame cho worker và vẽ kết quả mới nhất"""
         if not self.running or self.camera is None:
             return
 
         frame_bgr = self.camera.read()
         if frame_bgr is None:
-            self.after(30, self.update_frame)
+            self.after(10, self.update_frame)
             return
 
         self.frame_count += 1
-        frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-        display_frame = frame_bgr.copy()  # frame để vẽ và hiển thị
-
-        # Face detection + embedding (giữ nguyên)
-        faces = []
-        if self.frame_count % self.DETECT_INTERVAL == 0:
-            small = cv2.resize(frame_rgb, None, fx=0.75, fy=0.75)
-            faces = self.app.get(small)
-
-        # ========== ANTI-SPOOF: Chạy YOLO detection trên FULL FRAME ==========
-        spoof_info = self.anti_spoof.detect_spoof(frame_bgr)
-        display_frame = self.anti_spoof.draw_results(frame_bgr, spoof_info)
-
-        has_real = spoof_info['has_real']
-        real_boxes = spoof_info['real_boxes']
-
-        # ========== Logic chấm công ==========
-        attendance_success = False
-
-        if has_real:
-            # Có ít nhất một box "real" → có khả năng là người thật
-            for face in faces:
-                bbox_scaled = (face.bbox * (1 / 0.75)).astype(int)
-                f_left, f_top, f_right, f_bottom = bbox_scaled
-
-                # Kiểm tra overlap với ít nhất một box "real" từ YOLO
-                verified = False
-                max_real_conf = 0.0
-                for rx1, ry1, rx2, ry2, rconf in real_boxes:
-                    # Overlap đơn giản (có giao nhau đáng kể)
-                    if (f_left < rx2 and f_right > rx1 and
-                            f_top < ry2 and f_bottom > ry1):
-                        verified = True
-                        max_real_conf = max(max_real_conf, rconf)
-                        break
-
-                if verified and face.normed_embedding is not None:
-                    student_id, name, similarity = self.matcher.match(
-                        face.normed_embedding)
-
-                    if student_id and similarity >= self.SIMILARITY_THRESHOLD:
-                        color = (0, 255, 0)
-                        label_text = f"{name} ({similarity:.2f})"
-
-                        if (self.cooldown_frames <= 0 and
-                            student_id not in self.marked_ids and
-                                self.current_session_id is not None):
-
-                            if self.attendance_db.mark_attendance(
-                                session_id=self.current_session_id,
-                                student_id=student_id,
-                                status="present"
-                            ):
-                                self.marked_ids.add(student_id)
-                                self.cooldown_frames = self.COOLDOWN_MAX
-                                self.add_attendance_log(
-                                    student_id, name, similarity)
-
-                                self.status.config(
-                                    text=f"✅ Chấm công: {name} (Session {self.current_session_id})",
-                                    bg="#27ae60"
-                                )
-                                print(
-                                    f"Marked: {name} in session {self.current_session_id}")
-                                attendance_success = True
-                    else:
-                        label_text = "Unknown"
-                        color = (0, 165, 255)  # vàng cho unknown
-
-                    # Vẽ box từ face detector
-                    cv2.rectangle(display_frame, (f_left, f_top), (f_right, f_bottom),
-                                  color, 2)
-                    cv2.putText(display_frame, label_text, (f_left, max(f_top - 10, 10)),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-
-        # ========== Status tổng ==========
-        if attendance_success:
-            pass  # đã set ở trên
-        elif has_real:
-            self.status.config(
-                text="✅ Khuôn mặt thật – đang kiểm tra danh tính", bg="#3498db")
-        elif len(real_boxes) == 0 and len(faces) > 0:
-            self.status.config(
-                text="🚨 Có thể là giả mạo hoặc chất lượng thấp", bg="#e74c3c")
-        else:
-            self.status.config(
-                text="Đang chờ phát hiện khuôn mặt...", bg="#7f8c8d")
+        self.engine.submit(frame_bgr)
+
+        result = self.engine.latest_result()
+        if result is not None:
+            self.last_result = result
+            if result.view is not None:
+                text, bg = result.view["status"]
+                self.status.config(text=text, bg=bg)
+
+        while True:
+            try:
+                kind, event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "marked":
+                self.add_attendance_log(*event)
+            else:
+                self.add_attendance_error(*event)
 
-        # Cooldown countdown
-        if self.cooldown_frames > 0:
-            self.cooldown_frames -= 1
+        # Overlay của kết quả mới nhất vẽ lên frame hiện tại
+        display_frame = frame_bgr
+        if self.last_result is not None:
+            display_frame = self.engine.anti_spoof.draw_results(
+                frame_bgr, self.last_result.spoof_info)
+            if self.last_result.view is not None:
+                draw_overlays(display_frame, self.last_result.view["overlays"])
 
         # ========== Hiển thị frame (giữ nguyên) ==========
         img = Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB))
@@ -526,6 +520,10 @@ class AttendanceUI(BaseFrame):
     # =====================================================
     def stop(self):
         self.running = False
+        self.engine.stop()
+        if self.attendance_writer is not None:
+            self.attendance_writer.close()      # ghi nốt các lượt còn trong hàng đợi
+            self.attendance_writer = None
         if self.camera:
             self.camera.release()
             self.camera = None
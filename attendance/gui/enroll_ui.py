@@ -7,16 +7,16 @@ from gui.scrollable import create_scrollable_page
 from gui.base_ui import BaseFrame
 from core.camera import Camera
 from core.enroll_manager import EnrollManager
-from core.insightface_singleton import InsightFaceSingleton
-from core.anti_spoofing import AntiSpoofing
+from core.recognition_engine import draw_overlays
 
 
 class EnrollUI(BaseFrame):
     # ================= CONFIG =================
     MAX_SAMPLES = 15
-    SAMPLE_COOLDOWN = 4
-    DETECT_INTERVAL = 5
-    MIN_FACE_SIZE = 120
+    SAMPLE_COOLDOWN = 4     # tính theo số frame worker đã xử lý
+    # Kích thước box trên frame gốc (trước đây so trên frame thu nhỏ 0.75: 120 / 400)
+    MIN_FACE_SIZE = 160
+    MAX_FACE_SIZE = 533
     MIN_CONFIDENCE = 0.65
 
     # =========================================
@@ -34,19 +34,14 @@ class EnrollUI(BaseFrame):
         self.frame_count = 0
         self.sample_cooldown = 0
         self.last_sample_count = 0
+        self.last_result = None
+        self.completion = None      # None / True (lưu xong) / False (lỗi lưu) - worker ghi
 
         # EnrollManager
         self.enroll_mgr = EnrollManager(max_samples=self.MAX_SAMPLES)
 
-        # InsightFace
-        self.app = InsightFaceSingleton.get_instance(
-            name="buffalo_l",
-            providers=["CPUExecutionProvider"],
-            det_size=(480, 480),
-            ctx_id=0
-        )
-
-        self.anti_spoof = AntiSpoofing()
+        # Detection + anti-spoofing chạy trên worker của engine dùng chung
+        self.engine = controller.recognition_engine
 
     # =====================================================
     def create_placeholder_image(self):
@@ -304,11 +299,13 @@ class EnrollUI(BaseFrame):
         self.btn_start.config(state="disabled")
 
         try:
-            self.camera = Camera()
+            self.camera = Camera(threaded=True)
             self.running = True
             self.frame_count = 0
             self.sample_cooldown = 0
             self.last_sample_count = 0
+            self.last_result = None
+            self.completion = None
 
             self.progress["value"] = 0
             self.progress_label.config(text=f"0/{self.MAX_SAMPLES} mẫu (0%)")
@@ -321,6 +318,8 @@ class EnrollUI(BaseFrame):
                 text="🎥 Đang khởi động camera...",
                 bg="#3498db"
             )
+            # Enroll cần embedding mới ở mọi frame để thu mẫu đa dạng → tắt cache
+            self.engine.start(self.process_result, cache=False)
             self.update_frame()
 
         except Exception as e:
@@ -331,163 +330,177 @@ class EnrollUI(BaseFrame):
 
     # =====================================================
     def update_frame(self):
+        """Tk thread: chỉ đẩy frame cho worker, vẽ kết quả và cập nhật widget"""
         if not self.running or self.camera is None:
             return
 
         frame_bgr = self.camera.read()
         if frame_bgr is None:
-            self.after(40, self.update_frame)
+            self.after(10, self.update_frame)
             return
 
         self.frame_count += 1
-        frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-        display_frame = frame_bgr.copy()  # dùng để vẽ và hiển thị
+        self.engine.submit(frame_bgr)
+
+        result = self.engine.latest_result()
+        if result is not None:
+            self.last_result = result
+            if result.view is not None:
+                self.apply_view(result.view)
+
+        if self.completion is not None:
+            if self.completion:
+                self.show_success_screen()
+            else:
+                self.stop()
+                self.status.config(text="❌ Lỗi khi lưu dữ liệu!", bg="#e74c3c")
+            return
+
+        # Overlay của kết quả mới nhất vẽ lên frame hiện tại
+        display_frame = frame_bgr
+        if self.last_result is not None:
+            display_frame = self.engine.anti_spoof.draw_results(
+                frame_bgr, self.last_result.spoof_info)
+            if self.last_result.view is not None:
+                draw_overlays(display_frame, self.last_result.view["overlays"])
+
+        # Display frame
+        img = Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB))
+        img = img.resize((640, 480), Image.Resampling.LANCZOS)
+        self.photo_image = ImageTk.PhotoImage(img)
+        self.video_label.config(image=self.photo_image, text="")
 
-        faces = []
-        if self.frame_count % self.DETECT_INTERVAL == 0:
-            small = cv2.resize(frame_rgb, None, fx=0.75, fy=0.75)
-            faces = self.app.get(small)
+        self.after(40, self.update_frame)
+
+    def apply_view(self, view):
+        for key, state in view["indicators"].items():
+            self.update_quality_indicator(key, state)
+
+        count = len(self.enroll_mgr.samples)
+        if count != self.last_sample_count:
+            self.last_sample_count = count
+            self.progress["value"] = count
+            percentage = int((count / self.MAX_SAMPLES) * 100)
+            self.progress_label.config(
+                text=f"{count}/{self.MAX_SAMPLES} mẫu ({percentage}%)",
+                fg="#27ae60"
+            )
 
-        status_text = None
-        status_color = "#3498db"
+        if view["status"]:
+            self.status.config(text=view["status"][0], bg=view["status"][1])
 
+    # =====================================================
+    def process_result(self, result):
+        """
+        Worker thread: kiểm tra chất lượng, thu thập mẫu và lưu khi đủ.
+        Trả về {"overlays", "indicators", "status"} để Tk thread vẽ.
+        """
+        if self.completion is not None:
+            return None
+
+        status = None
+        overlays = []
         # Reset indicators
-        for key in self.quality_labels:
-            self.update_quality_indicator(key, "inactive")
+        indicators = {key: "inactive" for key in self.quality_labels}
 
-        # ========== ANTI-SPOOF: Chạy YOLO detection trên FULL FRAME ==========
-        spoof_info = self.anti_spoof.detect_spoof(frame_bgr)
-        display_frame = self.anti_spoof.draw_results(frame_bgr, spoof_info)
-        has_real = spoof_info['has_real']
+        has_real = result.spoof_info['has_real']
 
         # ========== Xử lý khuôn mặt detect được ==========
-        if faces:
-            face = faces[0]  # giả sử chỉ xử lý 1 mặt trong đăng ký
-            l, t, r, b = face.bbox.astype(int)
+        if result.faces:
+            face = result.faces[0]  # giả sử chỉ xử lý 1 mặt trong đăng ký
+            l, t, r, b = face.bbox
             w, h = r - l, b - t
 
-            # Kiểm tra overlap với box "real" từ YOLO
-            verified_real = False
-            max_real_conf = 0.0
-            for rx1, ry1, rx2, ry2, rconf in spoof_info['real_boxes']:
-                # Overlap đơn giản (có giao nhau đáng kể)
-                if (l < rx2 and r > rx1 and t < ry2 and b > ry1):
-                    verified_real = True
-                    max_real_conf = max(max_real_conf, rconf)
-                    break
-
-            if not verified_real or not has_real:
+            if not face.is_real or not has_real:
                 # Không có box real overlap → coi như spoof hoặc không xác thực
-                status_text = "🚨 Phát hiện khả năng giả mạo hoặc không rõ ràng"
-                status_color = "#e74c3c"
-                self.update_quality_indicator("face", "bad")
-                cv2.rectangle(display_frame, (l, t), (r, b), (0, 0, 255), 3)
-                cv2.putText(display_frame, "SPOOF?", (l, t - 25),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                status = ("🚨 Phát hiện khả năng giả mạo hoặc không rõ ràng", "#e74c3c")
+                indicators["face"] = "bad"
+                overlays.append({"bbox": face.bbox, "color": (0, 0, 255), "thickness": 3,
+                                 "labels": [("SPOOF?", 25, 0.8, (0, 0, 255))]})
             else:
                 # Có xác thực real → tiếp tục check chất lượng
-                self.update_quality_indicator("face", "good")
+                indicators["face"] = "good"
+                box_color = None
+                labels = []
 
                 is_distance_ok = False
                 is_confidence_ok = False
 
                 # Distance check
                 if w < self.MIN_FACE_SIZE or h < self.MIN_FACE_SIZE:
-                    self.update_quality_indicator("distance", "bad")
-                    status_text = "📏 Đưa khuôn mặt lại GẦN camera hơn"
-                    status_color = "#e67e22"
-                    cv2.rectangle(display_frame, (l, t), (r, b), (0, 165, 255), 3)
-                elif w > 400 or h > 400:
-                    self.update_quality_indicator("distance", "bad")
-                    status_text = "📏 Lùi ra XA camera một chút"
-                    status_color = "#e67e22"
-                    cv2.rectangle(display_frame, (l, t), (r, b), (0, 165, 255), 3)
+                    indicators["distance"] = "bad"
+                    status = ("📏 Đưa khuôn mặt lại GẦN camera hơn", "#e67e22")
+                    box_color = (0, 165, 255)
+                elif w > self.MAX_FACE_SIZE or h > self.MAX_FACE_SIZE:
+                    indicators["distance"] = "bad"
+                    status = ("📏 Lùi ra XA camera một chút", "#e67e22")
+                    box_color = (0, 165, 255)
                 else:
-                    self.update_quality_indicator("distance", "good")
+                    indicators["distance"] = "good"
                     is_distance_ok = True
 
                 # Confidence check (từ face detector)
                 if face.det_score < self.MIN_CONFIDENCE:
-                    self.update_quality_indicator("confidence", "bad")
-                    status_text = f"✨ Ánh sáng chưa đủ ({face.det_score*100:.0f}%)"
-                    status_color = "#e67e22"
-                    cv2.rectangle(display_frame, (l, t), (r, b), (0, 0, 255), 3)
+                    indicators["confidence"] = "bad"
+                    status = (f"✨ Ánh sáng chưa đủ ({face.det_score*100:.0f}%)", "#e67e22")
+                    box_color = (0, 0, 255)
                 else:
-                    self.update_quality_indicator("confidence", "good")
+                    indicators["confidence"] = "good"
                     is_confidence_ok = True
 
                 # Chỉ thu thập sample khi tất cả OK
                 if is_distance_ok and is_confidence_ok:
-                    cv2.rectangle(display_frame, (l, t), (r, b), (0, 255, 0), 3)
-                    cv2.putText(display_frame, f"REAL {max_real_conf:.2f}", (l, t - 25),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    box_color = (0, 255, 0)
+                    labels.append((f"REAL {face.real_conf:.2f}", 25, 0.8, (0, 255, 0)))
 
                     if self.sample_cooldown <= 0:
-                        ok = self.enroll_mgr.add_frame(frame_rgb)
+                        # Dùng lại embedding worker vừa tính, không detect lần 2
+                        ok = self.enroll_mgr.add_faces([f.face for f in result.faces])
 
                         if ok:
                             count = len(self.enroll_mgr.samples)
                             self.sample_cooldown = self.SAMPLE_COOLDOWN
 
-                            self.progress["value"] = count
-                            percentage = int((count / self.MAX_SAMPLES) * 100)
-                            self.progress_label.config(
-                                text=f"{count}/{self.MAX_SAMPLES} mẫu ({percentage}%)",
-                                fg="#27ae60"
-                            )
-
-                            status_text = f"✅ Thu thập mẫu {count}/{self.MAX_SAMPLES}"
-                            status_color = "#27ae60"
-                            self.update_quality_indicator("diversity", "good")
+                            status = (f"✅ Thu thập mẫu {count}/{self.MAX_SAMPLES}", "#27ae60")
+                            indicators["diversity"] = "good"
 
                             if self.enroll_mgr.is_complete():
-                                print("\n🎉 Enrollment completed!")
-                                success = self.enroll_mgr.save(self.student_id, self.name)
-                                if success:
-                                    self.show_success_screen()
-                                    if hasattr(self.controller, 'face_matcher'):
-                                        self.controller.face_matcher.reload()
-                                        print("Đã reload FaceMatcher")
-                                    else:
-                                        print("Warning: Controller chưa có face_matcher")
-                                else:
-                                    self.status.config(text="❌ Lỗi khi lưu dữ liệu!", bg="#e74c3c")
-                                return
+                                self.completion = self.save_enrollment()
                         else:
-                            self.update_quality_indicator("diversity", "warning")
-                            status_text = "🔄 Xoay nhẹ đầu sang trái/phải/lên/xuống"
-                            status_color = "#f39c12"
+                            indicators["diversity"] = "warning"
+                            status = ("🔄 Xoay nhẹ đầu sang trái/phải/lên/xuống", "#f39c12")
                     else:
-                        status_text = f"⏱ Giữ yên ({self.sample_cooldown} frames)..."
-                        status_color = "#3498db"
-                        self.update_quality_indicator("diversity", "warning")
-
-                cv2.putText(display_frame,
-                            f"{face.det_score*100:.0f}%",
-                            (l, t - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.7,
-                            (0, 255, 0) if is_confidence_ok else (0, 0, 255),
-                            2)
+                        status = (f"⏱ Giữ yên ({self.sample_cooldown} frames)...", "#3498db")
+                        indicators["diversity"] = "warning"
+
+                labels.append((f"{face.det_score*100:.0f}%", 10, 0.7,
+                               (0, 255, 0) if is_confidence_ok else (0, 0, 255)))
+                overlays.append({"bbox": face.bbox, "color": box_color, "thickness": 3,
+                                 "labels": labels})
 
         else:
-            status_text = "👤 Không phát hiện khuôn mặt"
-            status_color = "#e74c3c"
-            self.update_quality_indicator("face", "bad")
+            status = ("👤 Không phát hiện khuôn mặt", "#e74c3c")
+            indicators["face"] = "bad"
 
         if self.sample_cooldown > 0:
             self.sample_cooldown -= 1
 
-        if status_text:
-            self.status.config(text=status_text, bg=status_color)
+        return {"overlays": overlays, "indicators": indicators, "status": status}
 
-        # Display frame
-        img = Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB))
-        img = img.resize((640, 480), Image.Resampling.LANCZOS)
-        self.photo_image = ImageTk.PhotoImage(img)
-        self.video_label.config(image=self.photo_image, text="")
+    def save_enrollment(self):
+        """Worker thread: lưu embedding + vá FaceMatcher. Trả về True nếu thành công."""
+        print("\n🎉 Enrollment completed!")
+        templates = self.enroll_mgr.save(self.student_id, self.name)
+        if templates is None:
+            return False
 
-        self.after(40, self.update_frame)
+        if hasattr(self.controller, 'face_matcher'):
+            # Chỉ vá người vừa đăng ký bằng templates vừa ghi, không reload / đọc lại store
+            self.controller.face_matcher.upsert(self.student_id, self.name, templates)
+            print("Đã cập nhật FaceMatcher")
+        else:
+            print("Warning: Controller chưa có face_matcher")
+        return True
 
     # =====================================================
     def show_success_screen(self):
@@ -589,6 +602,7 @@ class EnrollUI(BaseFrame):
     # =====================================================
     def stop(self):
         self.running = False
+        self.engine.stop()
         if self.camera:
             self.camera.release()
             self.camera = None
@@ -3,6 +3,7 @@ from gui.enroll_ui import EnrollUI
 from gui.attendance_ui import AttendanceUI
 from gui.home_ui import HomeUI
 from core.face_matcher import FaceMatcher   
+from core.recognition_engine import RecognitionEngine
 
 class MainUI(tk.Tk):
     def __init__(self):
@@ -14,6 +15,8 @@ class MainUI(tk.Tk):
         self.minsize(1000, 600)
 
         self.face_matcher = FaceMatcher() 
+        # Worker nhận diện dùng chung cho EnrollUI / AttendanceUI
+        self.recognition_engine = RecognitionEngine()
 
         container = tk.Frame(self)
         container.pack(fill="both", expand=True)
@@ -257,8 +257,6 @@ class StudentListWindow(tk.Toplevel):
                 messagebox.showinfo(
                     "✅ Thành công", f"Đã xóa nhân viên: {name}")
                 self.refresh_list()
-                # Reload face_matcher nếu có
-                if self.controller and hasattr(self.controller, 'face_matcher'):
-                    self.controller.face_matcher.reload()
+                # FaceMatcher đã được StudentManager cập nhật (remove), không cần reload
             else:
                 messagebox.showerror("❌ Lỗi", "Không thể xóa nhân viên!")
@@ -0,0 +1,215 @@
+"""
+Chạy chấm công không cần GUI (server / kiosk không có màn hình).
+
+Dùng cùng pipeline với AttendanceUI: RecognitionEngine (detect + tracking +
+anti-spoofing + embedding) → AttendanceRecorder (match) → AttendanceWriter
+(ghi AttendanceDB theo lô ở thread nền).
+Không import tkinter / gui ở bất kỳ đâu trên đường chạy.
+
+Chạy (từ thư mục attendance):
+    python headless.py --source 0 --session-id 12
+    python headless.py --source lobby.mp4 --course "Phòng IT"
+    python headless.py --source captures/ --session-id 12 --report report.json
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import cv2
+
+from core.attendance_pipeline import AttendanceRecorder
+from core.camera import Camera
+from core.face_matcher import FaceMatcher
+from core.recognition_engine import RecognitionEngine
+from core.session_profile import get_profile
+from core.shm_transport import SharedCameraReader
+from database.attendance_writer import AttendanceWriter
+from database.db_connection import DBConnection
+from database.session_db import SessionDB
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+STREAM_COOLDOWN = 60    # frame
+
+
+# =====================================================
+def open_source(source, shared_memory=False):
+    """
+    Trả về (iterator (frame BGR, valid), is_stream, camera).
+    valid là None, hoặc với frame zero-copy từ shared memory là hàm kiểm tra
+    slot chưa bị ghi đè - truyền cho engine.run_once(..., valid=valid).
+    is_stream=False với thư mục ảnh: các ảnh độc lập → engine chạy cache=False
+    (detect + liveness + embed mọi ảnh, không motion gate / cache theo track).
+    camera là None với thư mục ảnh.
+    shared_memory=True: webcam / stream được capture ở process riêng, frame
+    chuyển qua SharedFrameRing (zero-copy, không pickle) thay vì thread trong
+    process này.
+    """
+    source = str(source)
+    if source.isdigit() or "://" in source:
+        src = int(source) if source.isdigit() else source
+        if shared_memory:
+            camera = SharedCameraReader.spawn(src)
+        else:
+            # Webcam hoặc stream (rtsp://, http://): thread capture, luôn lấy frame mới nhất
+            camera = Camera(src, threaded=True)
+        return _camera_frames(camera), True, camera
+    if os.path.isdir(source):
+        return _image_frames(source), False, None
+    if os.path.isfile(source):
+        # Video: đọc tuần tự từng frame (không bỏ frame) để kết quả tái lập được
+        camera = Camera(source, threaded=False)
+        return _camera_frames(camera), True, camera
+    raise FileNotFoundError(f"Không tìm thấy nguồn: {source}")
+
+
+def _camera_frames(camera):
+    try:
+        while camera.is_running:
+            if getattr(camera, "zero_copy", False):
+                # View vào shared memory: engine tự kiểm tra valid() sau mỗi lần đọc
+                item = camera.lease(timeout=1.0)
+                if item is not None:
+                    yield item
+                continue
+            frame = camera.read(timeout=1.0) if camera.threaded else camera.read()
+            if frame is None:
+                if camera.threaded:
+                    continue
+                break   # hết video
+            yield frame, None
+    finally:
+        camera.release()
+        print(f"Camera: {camera.stats}")
+
+
+def _image_frames(directory):
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is None:
+            print(f"⚠ Không đọc được ảnh {name}")
+            continue
+        yield frame, None
+
+
+def resolve_session(session_db, session_id=None, course=None, hours=2.0):
+    if session_id is not None:
+        if not session_db.session_exists(session_id):
+            raise ValueError(f"Không có phiên {session_id}")
+        return session_id
+    now = datetime.now()
+    session_id = session_db.create_session(
+        course=course or "Headless", start_time=now, end_time=now + timedelta(hours=hours))
+    print(f"✓ Đã tạo phiên {session_id}: {course or 'Headless'}")
+    return session_id
+
+
+def load_roster_file(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+
+
+# =====================================================
+def run(source, session_id=None, course=None, roster_path=None, index="flat",
+        target_fps=15.0, threshold=0.45, max_frames=None, report_path=None,
+        shared_memory=False, ort_profile=None, int8_max_drift=None):
+    session_db = SessionDB(DBConnection())
+    session_id = resolve_session(session_db, session_id, course)
+
+    if roster_path:
+        session_db.set_roster(session_id, load_roster_file(roster_path))
+
+    matcher = FaceMatcher(threshold=threshold, index=index)
+    roster_ids = session_db.get_roster(session_id)
+
+    def on_failed(_, student_id, reason):
+        recorder.unmark(student_id)     # ghi thất bại → cho phép chấm lại
+        print(f"✗ {student_id}: {reason}")
+
+    profile = get_profile(ort_profile)
+    if int8_max_drift is not None:
+        profile = profile.with_int8(int8_max_drift)
+    engine = RecognitionEngine(target_fps=target_fps, profile=profile)
+    frames, is_stream, _ = open_source(source, shared_memory)
+    engine.reset(cache=is_stream)
+
+    # Ghi DB ở thread write-behind, vòng lặp frame không chờ commit.
+    # Cooldown (theo frame) chỉ có nghĩa với stream; các ảnh trong thư mục độc
+    # lập với nhau → cooldown sẽ bỏ qua STREAM_COOLDOWN ảnh sau mỗi lượt chấm.
+    writer = AttendanceWriter(on_failed=on_failed)
+    recorder = AttendanceRecorder(
+        matcher, writer, session_id,
+        roster=matcher.roster_view(roster_ids) if roster_ids else None,
+        threshold=threshold, cooldown_max=STREAM_COOLDOWN if is_stream else 0)
+
+    print(f"\n{'='*60}")
+    print(f"🎯 Headless attendance - source {source} - session {session_id}")
+    print(f"{'='*60}\n")
+
+    start = time.perf_counter()
+    processed = 0
+    try:
+        for seq, (frame, valid) in enumerate(frames, start=1):
+            engine.run_once(frame, seq, recorder.process, valid)
+            processed += 1
+            if max_frames and processed >= max_frames:
+                break
+    except KeyboardInterrupt:
+        print("\n⏸ Dừng theo yêu cầu")
+
+    writer.close()
+    elapsed = time.perf_counter() - start
+    report = {
+        "source": source,
+        "session_id": session_id,
+        "frames": processed,
+        "seconds": round(elapsed, 2),
+        "fps": round(processed / elapsed, 2) if elapsed else None,
+        "marked": sorted(recorder.marked_ids),
+        "writer": dict(writer.stats),
+        "engine": engine.report(),
+    }
+    print(f"\n✓ Session {session_id}: {len(recorder.marked_ids)} nhân viên, "
+          f"{processed} frames, {report['fps']} fps")
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chấm công headless (không GUI)")
+    parser.add_argument("--source", required=True,
+                        help="chỉ số camera (0, 1...), URL stream, file video hoặc thư mục ảnh")
+    parser.add_argument("--session-id", type=int, default=None,
+                        help="phiên đã có; bỏ trống để tạo phiên mới")
+    parser.add_argument("--course", default=None, help="tên phiên khi tạo mới")
+    parser.add_argument("--roster", default=None, help="CSV/TXT danh sách Mã NV của phiên")
+    parser.add_argument("--index", default="flat",
+                        help="flat / int8 / float16 / ivf / hnsw (gallery lớn: ivf build ~25s / 200k "
+                             "templates, hnsw phải build offline bằng python -m core.ann_index hnsw)")
+    parser.add_argument("--target-fps", type=float, default=15.0)
+    parser.add_argument("--threshold", type=float, default=0.45)
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--report", default=None, help="ghi thống kê ra file JSON")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="capture ở process riêng, chuyển frame qua shared memory")
+    parser.add_argument("--ort-profile", default=None,
+                        help="default / latency / shared / single (mặc định FACE_ORT_PROFILE)")
+    parser.add_argument("--int8-max-drift", type=float, default=None,
+                        help="dùng model INT8 (quantize_models.py) có drift p95 ≤ ngưỡng")
+    args = parser.parse_args()
+
+    run(args.source, session_id=args.session_id, course=args.course,
+        roster_path=args.roster, index=args.index, target_fps=args.target_fps,
+        threshold=args.threshold, max_frames=args.max_frames, report_path=args.report,
+        shared_memory=args.shared_memory, ort_profile=args.ort_profile,
+        int8_max_drift=args.int8_max_drift)
+
+
+if __name__ == "__main__":
+    main()
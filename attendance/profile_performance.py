@@ -1,12 +1,12 @@
 import cv2
 import time
 from core.anti_spoofing import AntiSpoofing
-from core.insightface_singleton import InsightFaceSingleton
+from core.model_pool import ModelPool
 
 # Khởi tạo
 print("Loading models...")
 anti_spoof = AntiSpoofing(conf_threshold=0.5)
-app = InsightFaceSingleton.get_instance(
+app = ModelPool.get(
     name="buffalo_l",
     providers=["CPUExecutionProvider"],
     det_size=(640, 640),
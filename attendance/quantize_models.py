@@ -0,0 +1,391 @@
+"""
+Lượng tử hoá tĩnh (static INT8) detector SCRFD và recognizer ArcFace của model pack.
+
+Ảnh khuôn mặt trong thư mục local được chia làm hai phần:
+    - calibration: chạy FP32 để lấy dải activation (blob detector 640x640 và
+      crop 112x112 đã align) cho quantize_static
+    - held-out: so INT8 với FP32 - embedding cosine drift (1 - cos) của từng mặt
+      và tốc độ (median ms mỗi lần gọi model, cùng SessionOptions)
+Drift của detector đo trên embedding cuối: detect bằng INT8 → align → ArcFace
+FP32, so với pipeline FP32 (mặt INT8 bỏ sót tính drift = 1).
+
+Kết quả ghi vào models/int8/manifest.json (key = sha1 file FP32). Model pool
+chỉ load bản INT8 khi profile bật int8_max_drift và drift p95 ≤ ngưỡng đó
+(headless --int8-max-drift, service "int8_max_drift", FACE_INT8_MAX_DRIFT).
+
+Chạy (từ thư mục attendance):
+    python quantize_models.py --images datasets/faces --report int8_report.json
+    python quantize_models.py --images calib/ --holdout val/ --models recognition
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+from insightface.utils import face_align
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                      QuantType, quantize_static)
+
+from core.model_pool import FACE_MODULES, ModelPool
+from core.model_variants import (INT8_DIR, file_digest, load_manifest, passes,
+                                 save_manifest)
+from core.session_profile import SessionProfile
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+TASK_ATTRS = {"detection": "detector", "recognition": "recognizer"}     # thuộc tính FacePipeline
+METHODS = {
+    "minmax": CalibrationMethod.MinMax,
+    "entropy": CalibrationMethod.Entropy,
+    "percentile": CalibrationMethod.Percentile,
+}
+
+
+# =====================================================
+def list_images(directory, limit=None):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, n) for n in names[:limit]]
+
+
+def split_images(images, holdout_ratio, seed=0):
+    """Chia ngẫu nhiên (tái lập được) thành (calibration, held-out)"""
+    order = np.random.default_rng(seed).permutation(len(images))
+    n_holdout = max(1, int(round(len(images) * holdout_ratio)))
+    holdout = sorted(images[i] for i in order[:n_holdout])
+    calib = sorted(images[i] for i in order[n_holdout:])
+    return calib, holdout
+
+
+def read_images(paths):
+    """
+    Ảnh RGB - đúng input mà RecognitionEngine / EnrollManager đưa vào model
+    (đổi BGR → RGB trước khi detect), để calibration và drift đo trên cùng
+    phân phối với lúc chạy thật.
+    """
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"⚠ Không đọc được ảnh {os.path.basename(path)}")
+            continue
+        yield cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def detector_blob(detector, img):
+    """Tiền xử lý giống SCRFD.detect: resize giữ tỉ lệ, pad về input_size, normalize"""
+    input_size = detector.input_size
+    im_ratio = float(img.shape[0]) / img.shape[1]
+    model_ratio = float(input_size[1]) / input_size[0]
+    if im_ratio > model_ratio:
+        new_height = input_size[1]
+        new_width = int(new_height / im_ratio)
+    else:
+        new_width = input_size[0]
+        new_height = int(new_width * im_ratio)
+    det_img = np.zeros((input_size[1], input_size[0], 3), dtype=np.uint8)
+    det_img[:new_height, :new_width, :] = cv2.resize(img, (new_width, new_height))
+    mean = detector.input_mean
+    return cv2.dnn.blobFromImage(det_img, 1.0 / detector.input_std, input_size,
+                                 (mean, mean, mean), swapRB=True)
+
+
+def recognizer_blob(recognizer, crops):
+    mean = recognizer.input_mean
+    return cv2.dnn.blobFromImages(crops, 1.0 / recognizer.input_std, recognizer.input_size,
+                                  (mean, mean, mean), swapRB=True)
+
+
+def align_crops(recognizer, img, faces):
+    return [face_align.norm_crop(img, landmark=face.kps, image_size=recognizer.input_size[0])
+            for face in faces]
+
+
+class BlobReader(CalibrationDataReader):
+    """CalibrationDataReader trên danh sách blob đã tính sẵn"""
+
+    def __init__(self, input_name, blobs):
+        self.input_name = input_name
+        self.blobs = blobs
+        self._iter = iter(blobs)
+
+    def get_next(self):
+        blob = next(self._iter, None)
+        return None if blob is None else {self.input_name: blob}
+
+    def rewind(self):
+        self._iter = iter(self.blobs)
+
+
+# =====================================================
+def calibration_blobs(pipeline, paths):
+    """Blob calibration của detector (mỗi ảnh một blob) và recognizer (crop theo batch)"""
+    det_blobs, crops = [], []
+    for img in read_images(paths):
+        det_blobs.append(detector_blob(pipeline.detector, img))
+        crops.extend(align_crops(pipeline.recognizer, img, pipeline.detect(img)))
+    batch = pipeline.max_batch
+    rec_blobs = [recognizer_blob(pipeline.recognizer, crops[i:i + batch])
+                 for i in range(0, len(crops), batch)]
+    return {"detection": det_blobs, "recognition": rec_blobs}, len(crops)
+
+
+def quantize(model_path, output_path, input_name, blobs, method="minmax", per_channel=True):
+    """quantize_static định dạng QDQ: weight int8 (theo kênh), activation uint8"""
+    with tempfile.TemporaryDirectory() as workdir:
+        source = model_path
+        try:
+            # Shape inference + fold trước khi quantize (khuyến nghị của ORT)
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            source = os.path.join(workdir, "prep.onnx")
+            quant_pre_process(model_path, source, skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"⚠ Bỏ qua pre-process ({e}) → quantize trực tiếp")
+            source = model_path
+
+        quantize_static(source, output_path, BlobReader(input_name, blobs),
+                        quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=METHODS[method])
+
+
+def int8_model(model, int8_path, profile):
+    """
+    Bản sao nông của model FP32 (RetinaFace / ArcFaceONNX) với session INT8 -
+    giữ nguyên input_size, mean/std, det_thresh của bản đã prepare.
+    """
+    options, _ = profile.session_options(int8_path)
+    quantized = copy.copy(model)
+    quantized.session = ort.InferenceSession(int8_path, sess_options=options,
+                                             providers=model.session.get_providers())
+    return quantized
+
+
+# =====================================================
+def _iou(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-10)
+
+
+def _normalize(feats):
+    return feats / np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-10)
+
+
+def _drift_stats(drifts, missed=0, extra=0):
+    drifts = np.asarray(drifts, dtype=np.float64)
+    if not len(drifts):
+        return {"faces": 0, "mean": None, "p95": None, "max": None}
+    return {
+        "faces": int(len(drifts)),
+        "mean": round(float(drifts.mean()), 6),
+        "p95": round(float(np.percentile(drifts, 95)), 6),
+        "max": round(float(drifts.max()), 6),
+        "missed": missed,
+        "extra": extra,
+    }
+
+
+def _median_ms(fn, args_list, repeats):
+    fn(*args_list[0])   # warm-up
+    samples = []
+    for _ in range(repeats):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def variant(pipeline, detector=None, recognizer=None):
+    """Bản sao nông của FacePipeline với detector / recognizer thay thế"""
+    other = copy.copy(pipeline)
+    other.detector = detector or pipeline.detector
+    other.recognizer = recognizer or pipeline.recognizer
+    return other
+
+
+def evaluate(reference, candidate, paths, iou_threshold=0.5):
+    """
+    Drift embedding của pipeline candidate so với pipeline FP32 reference trên
+    ảnh held-out. Mỗi mặt FP32 được ghép với box candidate có IoU lớn nhất;
+    không ghép được (IoU < iou_threshold) → drift = 1.
+    """
+    drifts, missed, extra = [], 0, 0
+    for img in read_images(paths):
+        ref_faces = reference.detect(img)
+        if not ref_faces:
+            continue
+        ref_feats = _normalize(reference.embed_batch([(img, ref_faces)]))
+        faces = ref_faces if candidate.detector is reference.detector else candidate.detect(img)
+        extra += max(0, len(faces) - len(ref_faces))
+        if not faces:
+            drifts.extend([1.0] * len(ref_faces))
+            missed += len(ref_faces)
+            continue
+
+        feats = _normalize(candidate.embed_batch([(img, faces)]))
+        boxes = np.array([face.bbox for face in faces])
+        for ref_face, ref_feat in zip(ref_faces, ref_feats):
+            ious = _iou(ref_face.bbox, boxes)
+            if ious.max() < iou_threshold:
+                drifts.append(1.0)
+                missed += 1
+            else:
+                drifts.append(1.0 - float(np.dot(ref_feat, feats[int(ious.argmax())])))
+    return _drift_stats(drifts, missed, extra)
+
+
+def benchmark(pipeline, model, task, paths, repeats):
+    """Median ms mỗi lần gọi: detect một ảnh / get_feat một batch crop"""
+    images = list(read_images(paths))
+    if task == "detection":
+        return _median_ms(lambda img: model.detect(img, max_num=0, metric="default"),
+                          [(img,) for img in images], repeats)
+    crops = []
+    for img in images:
+        crops.extend(align_crops(pipeline.recognizer, img, pipeline.detect(img)))
+    batches = [(crops[i:i + pipeline.max_batch],)
+               for i in range(0, len(crops), pipeline.max_batch)]
+    return _median_ms(model.get_feat, batches, repeats) if batches else None
+
+
+# =====================================================
+def run(images, holdout=None, holdout_ratio=0.2, tasks=FACE_MODULES, name="buffalo_l",
+        det_size=(640, 640), method="minmax", per_channel=True, max_calib=300,
+        repeats=5, max_drift=0.02, output_dir=INT8_DIR, report_path=None):
+    paths = list_images(images)
+    if holdout:
+        calib_paths, holdout_paths = paths[:max_calib], list_images(holdout)
+    else:
+        calib_paths, holdout_paths = split_images(paths, holdout_ratio)
+        calib_paths = calib_paths[:max_calib]
+    if not calib_paths or not holdout_paths:
+        raise ValueError("Cần ảnh cho cả calibration và held-out")
+
+    # FP32 thuần: không cache graph, không redirect sang INT8 cũ
+    profile = SessionProfile(name="quantize", optimize_cache=False)
+    pipeline = ModelPool.pipeline(name, det_size, allowed_modules=FACE_MODULES, profile=profile)
+    models = {task: getattr(pipeline, attr) for task, attr in TASK_ATTRS.items()}
+
+    print(f"\n{'='*60}")
+    print(f"🔧 INT8 {name}: {len(calib_paths)} ảnh calibration, {len(holdout_paths)} ảnh held-out")
+    print(f"{'='*60}\n")
+
+    blobs, n_crops = calibration_blobs(pipeline, calib_paths)
+    print(f"✓ Calibration: {len(blobs['detection'])} blob detector, {n_crops} khuôn mặt")
+    if "recognition" in tasks and not n_crops:
+        raise ValueError("Không detect được khuôn mặt nào trong ảnh calibration")
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    baseline = evaluate(pipeline, pipeline, holdout_paths)
+    results = {}
+    quantized = {}
+    for task in tasks:
+        model = models[task]
+        digest = file_digest(model.model_file)
+        stem = os.path.splitext(os.path.basename(model.model_file))[0]
+        filename = f"{stem}.{digest[:8]}.int8.onnx"
+        int8_path = os.path.join(output_dir, filename)
+
+        print(f"⏳ Quantize {task} ({os.path.basename(model.model_file)})...")
+        start = time.perf_counter()
+        quantize(model.model_file, int8_path, model.input_name, blobs[task], method, per_channel)
+        quantize_seconds = time.perf_counter() - start
+        quantized[task] = int8_model(model, int8_path, profile)
+
+        drift = evaluate(pipeline, variant(pipeline, **{TASK_ATTRS[task]: quantized[task]}),
+                         holdout_paths)
+        fp32_ms = benchmark(pipeline, model, task, holdout_paths, repeats)
+        int8_ms = benchmark(pipeline, quantized[task], task, holdout_paths, repeats)
+
+        entry = {
+            "task": task,
+            "source": os.path.basename(model.model_file),
+            "path": filename,
+            "drift": drift,
+            "fp32_ms": round(fp32_ms, 3) if fp32_ms else None,
+            "int8_ms": round(int8_ms, 3) if int8_ms else None,
+            "speedup": round(fp32_ms / int8_ms, 2) if fp32_ms and int8_ms else None,
+            "fp32_mb": round(os.path.getsize(model.model_file) / 1e6, 1),
+            "int8_mb": round(os.path.getsize(int8_path) / 1e6, 1),
+            "calibration": {"images": len(calib_paths), "faces": n_crops, "method": method,
+                            "per_channel": per_channel, "det_size": list(det_size)},
+            "holdout_images": len(holdout_paths),
+            "quantize_seconds": round(quantize_seconds, 1),
+            "onnxruntime": ort.__version__,
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        manifest["models"][digest] = entry
+        results[task] = entry
+        status = "✓ ĐẠT" if passes(entry, max_drift) else "✗ KHÔNG ĐẠT"
+        print(f"{status} {task}: drift mean {drift['mean']} p95 {drift['p95']} max {drift['max']} "
+              f"(ngưỡng {max_drift}) | {entry['fp32_ms']} → {entry['int8_ms']} ms "
+              f"({entry['speedup']}x) | {entry['fp32_mb']} → {entry['int8_mb']} MB")
+
+    save_manifest(manifest, output_dir)
+
+    report = {
+        "model_pack": name,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "max_drift": max_drift,
+        "fp32_self_check": baseline,    # FP32 vs FP32: drift ~0, kiểm tra cách ghép mặt
+        "models": results,
+    }
+    if len(quantized) == 2:
+        # Thông tin thêm: cả hai model INT8 cùng lúc
+        report["combined"] = evaluate(pipeline, variant(pipeline, quantized["detection"],
+                                                        quantized["recognition"]), holdout_paths)
+        print(f"Cả hai INT8: drift p95 {report['combined']['p95']}")
+    print(f"\n✓ Manifest: {os.path.join(output_dir, 'manifest.json')}")
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lượng tử hoá INT8 SCRFD / ArcFace + kiểm tra drift")
+    parser.add_argument("--images", required=True, help="thư mục ảnh khuôn mặt để calibration")
+    parser.add_argument("--holdout", default=None,
+                        help="thư mục ảnh held-out; bỏ trống để tách từ --images")
+    parser.add_argument("--holdout-ratio", type=float, default=0.2)
+    parser.add_argument("--models", default=",".join(FACE_MODULES), help="detection,recognition")
+    parser.add_argument("--pack", default="buffalo_l")
+    parser.add_argument("--det-size", type=int, default=640)
+    parser.add_argument("--method", default="minmax", choices=sorted(METHODS))
+    parser.add_argument("--no-per-channel", action="store_true",
+                        help="scale weight theo tensor thay vì theo kênh")
+    parser.add_argument("--max-calib", type=int, default=300, help="số ảnh calibration tối đa")
+    parser.add_argument("--repeats", type=int, default=5, help="số vòng đo tốc độ")
+    parser.add_argument("--max-drift", type=float, default=0.02,
+                        help="ngưỡng drift p95 để báo ĐẠT (runtime dùng ngưỡng cấu hình riêng)")
+    parser.add_argument("--output-dir", default=INT8_DIR)
+    parser.add_argument("--report", default=None, help="ghi báo cáo ra file JSON")
+    args = parser.parse_args()
+
+    tasks = [t for t in args.models.split(",") if t]
+    unknown = set(tasks) - set(FACE_MODULES)
+    if unknown:
+        parser.error(f"model không hỗ trợ: {', '.join(sorted(unknown))}")
+
+    run(args.images, holdout=args.holdout, holdout_ratio=args.holdout_ratio, tasks=tasks,
+        name=args.pack, det_size=(args.det_size, args.det_size), method=args.method,
+        per_channel=not args.no_per_channel, max_calib=args.max_calib, repeats=args.repeats,
+        max_drift=args.max_drift, output_dir=args.output_dir, report_path=args.report)
+
+
+if __name__ == "__main__":
+    main()
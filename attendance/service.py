@@ -0,0 +1,453 @@
+"""
+Dịch vụ chấm công nhiều camera trên một máy (cổng ra vào, kiosk...).
+
+Supervisor (process chính):
+    - đọc toàn bộ cấu hình từ một file JSON (xem service_config.json)
+    - spawn một worker process cho mỗi camera; mỗi worker có ONNX session
+      (InsightFace + YOLO anti-spoofing) riêng nên không tranh GIL / lock
+    - spawn một writer process duy nhất ghi AttendanceDB (SQLite chỉ nên có
+      một writer) - worker gửi lượt chấm công qua multiprocessing.Queue
+    - restart worker / writer bị crash (chờ backoff tăng dần)
+    - in FPS và độ sâu hàng đợi của từng camera theo chu kỳ
+
+Gallery dùng chung: EmbeddingStore mở ma trận .npy bằng mmap read-only nên
+mọi worker chia sẻ page cache của cùng một file; khi meta.json đổi (enroll
+mới) worker tự reload.
+
+Chạy (từ thư mục attendance):
+    python service.py --config service_config.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+
+# Worker / writer chỉ import core, database, headless bên trong hàm chạy của
+# chúng: process spawn import lại module này, giữ phần top-level thật nhẹ.
+
+DEFAULTS = {
+    "db_path": "database/attendance.db",
+    "gallery_path": "database/embeddings.pkl",
+    "index": "flat",               # flat / int8 / float16 / ivf (build ~25s / 200k) / hnsw (lớn: build offline)
+    "threshold": 0.45,
+    "allowed_modules": ["detection", "recognition"],    # module buffalo_l cần load
+    "session_id": None,            # None → tạo phiên mới tên `course`
+    "course": "Service",
+    "session_hours": 12.0,
+    "roster": None,                # CSV/TXT Mã NV của phiên (tùy chọn)
+    "threads_per_worker": 2,       # OMP_NUM_THREADS của mỗi worker
+    "ort_profile": "shared",       # SessionProfile cho ONNX Runtime / torch (core/session_profile.py)
+    "int8_max_drift": None,        # dùng model INT8 (quantize_models.py) có drift p95 ≤ ngưỡng, None = FP32
+    "report_interval": 10.0,       # giây
+    "gallery_reload_interval": 30.0,
+    "restart_backoff": 2.0,        # giây, nhân đôi sau mỗi lần restart liên tiếp
+    "max_restarts": 0,             # 0 = không giới hạn
+    "mark_queue_size": 1000,
+    "status_path": None,           # ghi snapshot JSON mỗi lần report (monitoring)
+    "cameras": [],
+}
+
+# shared_memory: capture ở process con, frame chuyển qua SharedFrameRing
+# cpu_affinity: danh sách core ghim worker (None = không ghim)
+CAMERA_DEFAULTS = {"target_fps": 15.0, "shared_memory": False, "cpu_affinity": None}
+
+EXIT_SOURCE_LOST = 3    # camera / stream mất kết nối → supervisor restart
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = {**DEFAULTS, **json.load(f)}
+
+    cameras = []
+    for i, camera in enumerate(config["cameras"]):
+        if "source" not in camera:
+            raise ValueError(f"Camera #{i} thiếu 'source'")
+        cameras.append({"name": f"cam-{i}", **CAMERA_DEFAULTS, **camera})
+    names = [camera["name"] for camera in cameras]
+    if not cameras:
+        raise ValueError("Cấu hình không có camera nào")
+    if len(set(names)) != len(names) or "writer" in names:
+        raise ValueError(f"Tên camera phải khác nhau và khác 'writer': {names}")
+    config["cameras"] = cameras
+    return config
+
+
+# =====================================================
+# Worker process
+# =====================================================
+class QueuedAttendanceDB:
+    """
+    Thay AttendanceDB trong worker: không mở SQLite, chỉ đẩy lượt chấm công
+    sang writer process. Trả về True khi đã xếp hàng (writer tự kiểm tra phiên);
+    lượt bị writer từ chối quay về qua hàng đợi `rejected` của worker.
+    """
+
+    def __init__(self, marks, camera):
+        self.marks = marks
+        self.camera = camera
+
+    def mark_attendance(self, session_id, student_id, status="present"):
+        try:
+            self.marks.put_nowait((session_id, student_id, status, self.camera))
+            return True
+        except queue.Full:
+            print(f"⚠ [{self.camera}] Hàng đợi ghi chấm công đầy, bỏ {student_id}")
+            return False
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def camera_worker(camera, config, session_id, roster_ids, marks, rejected, stats, stop):
+    os.environ.setdefault("OMP_NUM_THREADS", str(config["threads_per_worker"]))
+
+    from core.attendance_pipeline import AttendanceRecorder
+    from core.face_matcher import FaceMatcher
+    from core.recognition_engine import RecognitionEngine
+    from core.session_profile import get_profile
+    from headless import open_source
+
+    name = camera["name"]
+    matcher = FaceMatcher(db_path=config["gallery_path"], threshold=config["threshold"],
+                          index=config["index"])
+    recorder = AttendanceRecorder(
+        matcher, QueuedAttendanceDB(marks, name), session_id,
+        roster=matcher.roster_view(roster_ids) if roster_ids else None,
+        threshold=config["threshold"])
+    profile = get_profile(config["ort_profile"]).with_affinity(camera["cpu_affinity"])
+    if config["int8_max_drift"] is not None:
+        profile = profile.with_int8(config["int8_max_drift"])
+    engine = RecognitionEngine(target_fps=camera["target_fps"],
+                               allowed_modules=config["allowed_modules"], profile=profile)
+
+    frames, is_stream, source = open_source(camera["source"], camera["shared_memory"])
+    engine.reset(cache=is_stream)
+    print(f"🎥 [{name}] worker {os.getpid()} chạy nguồn {camera['source']}")
+
+    gallery_mtime = _mtime(matcher.store.meta_path)
+    run_start = window_start = last_reload = time.monotonic()
+    window_frames = 0
+
+    def send(state, fps):
+        stats.put({
+            "name": name,
+            "pid": os.getpid(),
+            "state": state,
+            "time": time.time(),
+            "fps": round(fps, 2),
+            "frames": engine.stats["frames"],
+            "pending": source.pending if source is not None else 0,
+            "dropped": source.frames_dropped if source is not None else 0,
+            "torn": engine.stats["torn"],
+            "marked": len(recorder.marked_ids),
+            "level": engine.scheduler.level,
+        })
+
+    def drain_rejected():
+        # Writer không ghi được → bỏ khỏi marked_ids để lần gặp sau chấm lại
+        while True:
+            try:
+                student_id = rejected.get_nowait()
+            except queue.Empty:
+                return
+            recorder.unmark(student_id)
+
+    try:
+        for seq, (frame, valid) in enumerate(frames, start=1):
+            if stop.is_set():
+                break
+            drain_rejected()
+            engine.run_once(frame, seq, recorder.process, valid)
+            window_frames += 1
+
+            now = time.monotonic()
+            if now - last_reload >= config["gallery_reload_interval"]:
+                last_reload = now
+                mtime = _mtime(matcher.store.meta_path)
+                if mtime != gallery_mtime:
+                    gallery_mtime = mtime
+                    matcher.reload()
+                    if roster_ids:
+                        recorder.roster = matcher.roster_view(roster_ids)
+
+            if now - window_start >= config["report_interval"]:
+                send("running", window_frames / (now - window_start))
+                window_start, window_frames = now, 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frames.close()
+
+    elapsed = time.monotonic() - run_start
+    send("stopped", engine.stats["frames"] / elapsed if elapsed else 0.0)
+    # Camera live tự dừng khi chưa có lệnh stop → báo lỗi để supervisor restart
+    if source is not None and source.threaded and not stop.is_set():
+        print(f"⚠ [{name}] Mất nguồn {camera['source']}")
+        sys.exit(EXIT_SOURCE_LOST)
+
+
+# =====================================================
+# Writer process
+# =====================================================
+def attendance_writer(config, marks, rejected, stats, stop):
+    """rejected: tên camera → hàng đợi Mã NV bị từ chối của worker đó"""
+    from database.attendance_writer import AttendanceWriter
+
+    # (session_id, student_id) đang chờ ghi → các camera đã gửi lượt đó
+    # (writer gộp lượt trùng nên một lần ghi có thể thuộc nhiều camera).
+    # Callback chạy trên thread của AttendanceWriter → truy cập dưới lock.
+    origins, written = {}, set()
+    lock = threading.Lock()
+
+    def on_written(session_id, student_id):
+        key = (str(session_id), student_id)
+        with lock:
+            cameras = origins.pop(key, ())
+            written.add(key)
+        print(f"✅ [{', '.join(sorted(cameras))}] Chấm công {student_id} (Session {session_id})")
+
+    def on_failed(session_id, student_id, reason):
+        with lock:
+            cameras = origins.pop((str(session_id), student_id), ())
+        print(f"✗ [{', '.join(sorted(cameras))}] Chấm công {student_id} "
+              f"(Session {session_id}) bị từ chối: {reason}")
+        for camera in cameras:
+            rejected[camera].put(student_id)
+
+    # Gom lượt chấm công của mọi camera thành transaction theo lô
+    writer = AttendanceWriter(config["db_path"], on_failed=on_failed, on_written=on_written)
+    last_report = time.monotonic()
+
+    def send(state):
+        stats.put({"name": "writer", "pid": os.getpid(), "state": state, "time": time.time(),
+                   "written": writer.stats["written"], "rejected": writer.stats["failed"]})
+
+    while True:
+        try:
+            item = marks.get(timeout=0.5)
+        except queue.Empty:
+            item = False
+        except KeyboardInterrupt:
+            continue    # supervisor gửi None khi dừng, xả hết hàng đợi trước
+
+        if item is None or (item is False and stop.is_set()):
+            break
+        if item:
+            session_id, student_id, status, camera = item
+            key = (str(session_id), str(student_id))
+            with lock:
+                queued = key not in written     # đã ghi rồi → writer cũng bỏ qua
+                if queued:
+                    origins.setdefault(key, set()).add(camera)
+            if queued:
+                writer.mark_attendance(session_id, student_id, status)
+
+        if time.monotonic() - last_report >= config["report_interval"]:
+            last_report = time.monotonic()
+            send("running")
+
+    writer.close()
+    send("stopped")
+
+
+# =====================================================
+# Supervisor
+# =====================================================
+class ServiceSupervisor:
+    """Quản lý vòng đời worker / writer, restart khi crash và tổng hợp thống kê"""
+
+    def __init__(self, config):
+        self.config = config
+        self.ctx = mp.get_context("spawn")     # không fork process đã có ONNX session
+        self.marks = self.ctx.Queue(maxsize=config["mark_queue_size"])
+        # Lượt bị writer từ chối, trả về đúng worker đã gửi để recorder.unmark()
+        self.rejected = {camera["name"]: self.ctx.Queue() for camera in config["cameras"]}
+        self.stats = self.ctx.Queue()
+        self.stop_event = self.ctx.Event()
+        self.slots = {}         # name → {target, args, process, restarts, next_start, finished}
+        self.latest = {}        # name → thống kê gần nhất
+        self.session_id = None
+
+    # =====================================================
+    def resolve_session(self):
+        """Chọn / tạo phiên và đọc roster trong supervisor, worker không đụng SQLite"""
+        from database.db_connection import DBConnection
+        from database.session_db import SessionDB
+        from headless import load_roster_file, resolve_session
+
+        session_db = SessionDB(DBConnection(self.config["db_path"]))
+        session_id = resolve_session(session_db, self.config["session_id"],
+                                     self.config["course"], self.config["session_hours"])
+        if self.config["roster"]:
+            session_db.set_roster(session_id, load_roster_file(self.config["roster"]))
+        return session_id, session_db.get_roster(session_id)
+
+    def start(self):
+        self.session_id, roster_ids = self.resolve_session()
+
+        self._add_slot("writer", attendance_writer,
+                       (self.config, self.marks, self.rejected, self.stats, self.stop_event))
+        for camera in self.config["cameras"]:
+            self._add_slot(camera["name"], camera_worker,
+                           (camera, self.config, self.session_id, roster_ids, self.marks,
+                            self.rejected[camera["name"]], self.stats, self.stop_event))
+
+        print(f"\n{'='*60}")
+        print(f"🎯 Attendance service - {len(self.config['cameras'])} camera - "
+              f"session {self.session_id}")
+        print(f"{'='*60}\n")
+
+    def _add_slot(self, name, target, args):
+        self.slots[name] = {"target": target, "args": args, "process": None,
+                            "restarts": 0, "next_start": 0.0, "finished": False}
+        self._spawn(name)
+
+    def _spawn(self, name):
+        slot = self.slots[name]
+        process = self.ctx.Process(target=slot["target"], args=slot["args"],
+                                   name=f"attendance-{name}", daemon=False)
+        process.start()
+        slot["process"] = process
+
+    # =====================================================
+    def run(self):
+        self.start()
+        last_report = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self._drain_stats()
+                self._supervise()
+                if all(slot["finished"] for name, slot in self.slots.items() if name != "writer"):
+                    print("✓ Không còn camera nào chạy (nguồn đã hết hoặc bỏ restart)")
+                    break
+                if time.monotonic() - last_report >= self.config["report_interval"]:
+                    last_report = time.monotonic()
+                    self.report()
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("\n⏸ Dừng service theo yêu cầu")
+        finally:
+            self.stop()
+
+    def _supervise(self):
+        now = time.monotonic()
+        for name, slot in self.slots.items():
+            process = slot["process"]
+            if process is None:
+                if not slot["finished"] and now >= slot["next_start"]:
+                    print(f"🔄 Khởi động lại {name} (lần {slot['restarts']})")
+                    self._spawn(name)
+                continue
+            if process.is_alive():
+                continue
+
+            process.join()
+            slot["process"] = None
+            if process.exitcode == 0:
+                slot["finished"] = True     # nguồn video / thư mục ảnh đã hết
+                continue
+
+            max_restarts = self.config["max_restarts"]
+            if max_restarts and slot["restarts"] >= max_restarts:
+                print(f"⛔ {name} crash {slot['restarts'] + 1} lần, không restart nữa")
+                slot["finished"] = True
+                continue
+            delay = self.config["restart_backoff"] * 2 ** min(slot["restarts"], 5)
+            slot["restarts"] += 1
+            slot["next_start"] = now + delay
+            print(f"⚠ {name} thoát với mã {process.exitcode}, restart sau {delay:.0f}s")
+
+    def _drain_stats(self):
+        while True:
+            try:
+                item = self.stats.get_nowait()
+            except queue.Empty:
+                return
+            self.latest[item["name"]] = item
+
+    # =====================================================
+    def _queue_depth(self):
+        try:
+            return self.marks.qsize()
+        except NotImplementedError:    # macOS không hỗ trợ qsize()
+            return None
+
+    def snapshot(self):
+        cameras = {}
+        for camera in self.config["cameras"]:
+            name = camera["name"]
+            slot = self.slots.get(name, {})
+            process = slot.get("process")
+            cameras[name] = {
+                **self.latest.get(name, {}),
+                "alive": bool(process and process.is_alive()),
+                "restarts": slot.get("restarts", 0),
+            }
+        return {
+            "time": time.time(),
+            "session_id": self.session_id,
+            "cameras": cameras,
+            "writer": {**self.latest.get("writer", {}),
+                       "queue_depth": self._queue_depth(),
+                       "restarts": self.slots.get("writer", {}).get("restarts", 0)},
+        }
+
+    def report(self):
+        snapshot = self.snapshot()
+        print(f"\n📊 {'Camera':<14}{'PID':>8}{'FPS':>8}{'Queue':>7}{'Dropped':>9}"
+              f"{'Marked':>8}{'Level':>7}{'Restart':>9}")
+        for name, item in snapshot["cameras"].items():
+            state = "" if item["alive"] else "  (down)"
+            print(f"   {name:<14}{item.get('pid', '-'):>8}{item.get('fps', 0):>8.1f}"
+                  f"{item.get('pending', 0):>7}{item.get('dropped', 0):>9}"
+                  f"{item.get('marked', 0):>8}{item.get('level', '-'):>7}"
+                  f"{item['restarts']:>9}{state}")
+        writer = snapshot["writer"]
+        print(f"   writer: queue {writer['queue_depth']}, đã ghi {writer.get('written', 0)}, "
+              f"từ chối {writer.get('rejected', 0)}, restart {writer['restarts']}")
+
+        if self.config["status_path"]:
+            tmp_path = self.config["status_path"] + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.config["status_path"])
+        return snapshot
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        for name, slot in self.slots.items():
+            if name != "writer" and slot["process"] is not None:
+                slot["process"].join(timeout)
+                if slot["process"].is_alive():
+                    slot["process"].terminate()
+
+        # Worker đã dừng → writer xả nốt hàng đợi rồi thoát
+        writer = self.slots.get("writer", {}).get("process")
+        if writer is not None and writer.is_alive():
+            self.marks.put(None)
+            writer.join(timeout)
+            if writer.is_alive():
+                writer.terminate()
+        self._drain_stats()
+        self.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ chấm công nhiều camera")
+    parser.add_argument("--config", default="service_config.json",
+                        help="file JSON cấu hình service + danh sách camera")
+    args = parser.parse_args()
+
+    ServiceSupervisor(load_config(args.config)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 import cv2
 from core.anti_spoofing import AntiSpoofing
-from core.insightface_singleton import InsightFaceSingleton
+from core.model_pool import ModelPool
 
 # Khởi tạo
 anti_spoof = AntiSpoofing(conf_threshold=0.5)
-app = InsightFaceSingleton.get_instance(
+app = ModelPool.get(
     name="buffalo_l",
     providers=["CPUExecutionProvider"],
     det_size=(640, 640),
@@ -31,24 +31,14 @@ while True:
         small = cv2.resize(frame_rgb, None, fx=0.75, fy=0.75)
         faces = app.get(small)
 
-    for face in faces:
-        bbox = (face.bbox * (1 / 0.75)).astype(int)
-        left, top, right, bottom = bbox
+    boxes = [tuple((face.bbox * (1 / 0.75)).astype(int)) for face in faces]
 
-        # Crop mặt từ frame (tương tự attendance_ui)
-        face_crop = frame_bgr[top:bottom, left:right]
-
-        if face_crop.size == 0:
-            continue
-
-        # Test anti-spoofing trên cropped image
-        # is_live, conf, label = anti_spoof.check_liveness(face_crop)
-        # Resize face_crop to standard size before checking
-        face_crop_resized = cv2.resize(face_crop, (224, 224))  # or YOLO input size
-        is_live, conf, label = anti_spoof.detect_spoof(face_crop_resized)
+    # Tất cả mặt trong frame → một lần gọi YOLO trên crop có padding
+    verdicts = anti_spoof.detect_spoof_rois(frame_bgr, boxes) if boxes else []
 
+    for (left, top, right, bottom), (is_live, conf, label) in zip(boxes, verdicts):
         print(
-            f"Face crop size: {face_crop.shape} | is_live: {is_live}, conf: {conf:.2f}, label: {label}")
+            f"Face box: {(left, top, right, bottom)} | is_live: {is_live}, conf: {conf:.2f}, label: {label}")
 
         # Vẽ kết quả
         color = (0, 255, 0) if is_live else (0, 0, 255)